@@ -1,87 +1,431 @@
 # ac_automaton.py
-import json
 import ahocorasick
+import hashlib
+import json
 import jsonlines
-from typing import List, Dict, Any
+import multiprocessing
+import os
+import pickle
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+from kb_io import is_columnar, iter_records
+from token_utils import count_tokens
+
+# 实体上下文的渲染方式
+ENTITY_CONTEXT_MODES = ("full", "brief", "names")
+# 实体匹配方式：all 返回词典中的全部命中；longest 按最左最长原则消解重叠，
+# 如“埋弧焊接工艺”中只保留“埋弧焊接”，不再返回其中的“焊接”
+ENTITY_MATCH_MODES = ("all", "longest")
+# 匹配实体的排序方式：first 按首次出现的位置，frequency 按出现次数，coverage 按覆盖的字符数
+ENTITY_RANK_MODES = ("first", "frequency", "coverage")
+
+# 自动机缓存格式版本，缓存内容变化时递增
+AUTOMATON_CACHE_VERSION = 1
+AUTOMATON_CACHE_SUFFIX = ".ac.pkl"
+# 实体提及索引文件格式版本
+MENTION_INDEX_VERSION = 2
+
+# 进程池中共享的匹配器：fork 前设置，子进程以写时复制的方式读取同一个自动机
+_SHARED_MATCHER: Optional["ACEntityMatcher"] = None
+
+
+def default_automaton_cache_file(entities_file: str) -> str:
+    """自动机缓存默认与实体库放在一起，如 entities_kb.json.ac.pkl"""
+    return entities_file.rstrip("/\\") + AUTOMATON_CACHE_SUFFIX
+
+
+def _kb_files(entities_file: str) -> List[str]:
+    """实体库包含的文件：JSON/JSONL为单个文件，列式存储为目录下的全部文件"""
+    if os.path.isdir(entities_file):
+        return [os.path.join(entities_file, name) for name in sorted(os.listdir(entities_file))]
+    return [entities_file]
+
+
+def _kb_stats(entities_file: str) -> List[List[Any]]:
+    stats = []
+    for path in _kb_files(entities_file):
+        st = os.stat(path)
+        stats.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+    return stats
+
+
+def _kb_sha256(entities_file: str) -> str:
+    digest = hashlib.sha256()
+    for path in _kb_files(entities_file):
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_fingerprint(path: str) -> Dict[str, Any]:
+    """文件（或列式存储目录）的大小、修改时间与内容 sha256，用于判断索引是否由当前文件生成"""
+    return {"stats": _kb_stats(path), "sha256": _kb_sha256(path)}
+
+
+def _fingerprint_matches(fingerprint: Optional[Dict[str, Any]], path: str) -> bool:
+    """与自动机缓存相同：先比较大小和修改时间，不一致时再比较内容"""
+    if not fingerprint or not os.path.exists(path):
+        return False
+    if fingerprint.get("stats") == _kb_stats(path):
+        return True
+    return fingerprint.get("sha256") == _kb_sha256(path)
+
 
 class ACEntityMatcher:
-    def __init__(self, entities_file: str):
+    def __init__(self, entities_file: str, use_cache: bool = True, cache_file: Optional[str] = None):
         """
         初始化AC自动机实体匹配器
         
         Args:
-            entities_file: 包含实体信息的JSON文件路径
+            entities_file: 包含实体信息的JSON或JSONL文件路径，或列式存储目录（.kbc）
+            use_cache: 是否使用磁盘上的自动机缓存；实体库未变化时直接载入，不再重新构建
+            cache_file: 缓存文件路径，默认为实体库路径加 .ac.pkl
         """
         self.entities_file = entities_file
+        self.cache_file = cache_file or default_automaton_cache_file(entities_file)
         self.automaton = ahocorasick.Automaton()
         self.entity_dict = {}
-        self._build_automaton()
+        if not (use_cache and self._load_cache()):
+            # 构建前记录实体库的文件信息，构建期间实体库被改写时下次会重新构建
+            stats = _kb_stats(entities_file) if use_cache else None
+            sha256 = _kb_sha256(entities_file) if use_cache else None
+            self._build_automaton()
+            if use_cache:
+                self._save_cache(stats, sha256)
+    
+    def _load_cache(self) -> bool:
+        """
+        载入自动机缓存。文件大小和修改时间与缓存一致时直接使用；
+        不一致时再比较内容的 sha256（如文件被复制或 touch 过），一致则更新缓存中的文件信息。
+        
+        Returns:
+            缓存有效并已载入时返回 True
+        """
+        if not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file, "rb") as f:
+                # 第一段只有元信息，校验不通过时不必反序列化整个自动机
+                meta = pickle.load(f)
+                if meta.get("version") != AUTOMATON_CACHE_VERSION:
+                    return False
+                stats = _kb_stats(self.entities_file)
+                sha256 = None
+                if meta.get("stats") != stats:
+                    sha256 = _kb_sha256(self.entities_file)
+                    if meta.get("sha256") != sha256:
+                        print(f"实体库 {self.entities_file} 已变化，重新构建AC自动机")
+                        return False
+                payload = pickle.load(f)
+        except Exception as e:
+            print(f"读取AC自动机缓存 {self.cache_file} 失败，重新构建: {e}")
+            return False
+        
+        self.automaton = payload["automaton"]
+        if payload["entity_dict"] is not None:
+            self.entity_dict = payload["entity_dict"]
+        else:
+            # 列式存储的实体仍从内存映射的文件中按需读取
+            from kb_columnar import ColumnarKB
+            self.entity_dict = ColumnarKB(self.entities_file).keyed("entity_name")
+        if sha256 is not None:
+            self._save_cache(stats, sha256)
+        print(f"已从缓存 {self.cache_file} 载入 {len(self.entity_dict)} 个实体的AC自动机")
+        return True
+    
+    def _save_cache(self, stats: List[List[Any]], sha256: str) -> None:
+        """保存自动机缓存，先写临时文件再替换，避免并发进程读到写了一半的缓存"""
+        meta = {"version": AUTOMATON_CACHE_VERSION, "stats": stats, "sha256": sha256}
+        payload = {
+            "automaton": self.automaton,
+            "entity_dict": self.entity_dict if isinstance(self.entity_dict, dict) else None,
+        }
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, "wb") as f:
+                pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            print(f"保存AC自动机缓存 {self.cache_file} 失败: {e}")
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
     
     def _build_automaton(self):
         """构建AC自动机"""
-        # 读取实体数据
-        with open(self.entities_file, 'r', encoding='utf-8') as f:
-            entities = json.load(f)
-        
-        # 将实体添加到自动机中
-        for entity in entities:
-            entity_name = entity["entity_name"]
-            self.automaton.add_word(entity_name, entity)
-            self.entity_dict[entity_name] = entity
+        # 自动机中只保存实体名称，匹配后再从 entity_dict 取实体
+        if is_columnar(self.entities_file):
+            # 列式存储只读取名称列，实体在匹配到时才从内存映射的文件中解码
+            from kb_columnar import ColumnarKB
+            kb = ColumnarKB(self.entities_file)
+            self.entity_dict = kb.keyed("entity_name")
+            for entity_name in kb.iter_column("entity_name"):
+                self.automaton.add_word(entity_name, entity_name)
+        else:
+            # 逐条读取实体数据并添加到自动机中
+            for entity in iter_records(self.entities_file):
+                entity_name = entity["entity_name"]
+                self.automaton.add_word(entity_name, entity_name)
+                self.entity_dict[entity_name] = entity
         
         # 构建自动机
         self.automaton.make_automaton()
         print(f"已加载 {len(self.entity_dict)} 个实体到AC自动机中")
     
-    def match_entities(self, text: str) -> List[Dict[str, Any]]:
+    def _iter_hits(self, text: str, mode: str) -> Iterator[Tuple[int, int, str]]:
+        """按自动机的输出顺序返回 (start, end, entity_name)，end 不包含在内"""
+        if mode not in ENTITY_MATCH_MODES:
+            raise ValueError(f"Unknown entity match mode: {mode}")
+        hits = ((end_index + 1 - len(entity_name), end_index + 1, entity_name)
+                for end_index, entity_name in self.automaton.iter(text))
+        if mode == "all":
+            yield from hits
+            return
+        # 最左最长：按 (起始位置, -长度) 排序后依次保留与已选匹配不重叠的一个。
+        # 不使用 automaton.iter_long：较长匹配失败后它会跳过之后的匹配（如“纵向钢珠滑道”中漏掉“钢珠滑道”）
+        last_end = 0
+        for start, end, entity_name in sorted(hits, key=lambda hit: (hit[0], hit[0] - hit[1])):
+            if start >= last_end:
+                yield start, end, entity_name
+                last_end = end
+    
+    def match_spans(self, text: str, mode: str = "longest") -> List[Tuple[int, int, str]]:
+        """
+        返回匹配到的实体位置
+        
+        Args:
+            text: 输入文本
+            mode: 匹配方式，见 ENTITY_MATCH_MODES
+            
+        Returns:
+            按起始位置排序的 (start, end, entity_name) 列表，text[start:end] == entity_name
+        """
+        return sorted(self._iter_hits(text, mode))
+    
+    def match_entities(self, text: str, mode: str = "all", rank: str = "first") -> List[Dict[str, Any]]:
         """
         在文本中匹配实体
         
         Args:
             text: 输入文本
+            mode: 匹配方式，见 ENTITY_MATCH_MODES；默认 all 与原来的结果相同
+            rank: 排序方式，见 ENTITY_RANK_MODES；出现次数或覆盖字符数相同时按首次出现的顺序
             
         Returns:
-            匹配到的实体列表
+            匹配到的实体列表（每个实体只出现一次）
+        """
+        names, _ = self._match_names(text, mode, rank)
+        return [self.entity_dict[name] for name in names]
+    
+    def _match_names(self, text: str, mode: str, rank: str) -> Tuple[List[str], List[Tuple[int, int, str]]]:
         """
-        matched_entities = []
-        matched_names = set()
+        返回 (排序后的实体名称, 按起始位置排序的匹配位置)，只扫描一遍文本
+        """
+        if rank not in ENTITY_RANK_MODES:
+            raise ValueError(f"Unknown entity rank mode: {rank}")
         
-        # 使用AC自动机匹配实体
-        for end_index, entity in self.automaton.iter(text):
-            entity_name = entity["entity_name"]
-            if entity_name not in matched_names:
-                matched_entities.append(entity)
-                matched_names.add(entity_name)
+        hits = list(self._iter_hits(text, mode))
+        # entity_name -> [出现次数, 覆盖字符数]，字典保持首次出现的顺序
+        stats: Dict[str, List[int]] = {}
+        for start, end, entity_name in hits:
+            entry = stats.get(entity_name)
+            if entry is None:
+                stats[entity_name] = [1, end - start]
+            else:
+                entry[0] += 1
+                entry[1] += end - start
         
-        return matched_entities
+        names = list(stats)
+        if rank == "frequency":
+            names.sort(key=lambda name: -stats[name][0])
+        elif rank == "coverage":
+            names.sort(key=lambda name: -stats[name][1])
+        # all 模式下自动机按结束位置输出
+        hits.sort()
+        return names, hits
     
-    def match_entities_with_context(self, text: str, max_entities: int = 15) -> str:
+    def iter_batch_matches(self, texts: Iterable[str], mode: str = "all", rank: str = "first",
+                           workers: int = 1, chunksize: int = 64) -> Iterator[Tuple[List[str], List[Tuple[int, int, str]]]]:
+        """
+        按输入顺序逐条返回每段文本的 (实体名称列表, 匹配位置列表)，结果与逐条调用 match_entities / match_spans 相同。
+        
+        workers > 1 时使用 fork 的进程池：子进程继承父进程中已构建的自动机（写时复制，不重新加载、不序列化），
+        进程间只传递文本和实体名称。不支持 fork 的平台上退回单进程。
+        
+        Args:
+            texts: 文本（可以是生成器）
+            mode: 匹配方式，见 ENTITY_MATCH_MODES
+            rank: 排序方式，见 ENTITY_RANK_MODES
+            workers: 进程数
+            chunksize: 每次分配给子进程的文本数
+        """
+        global _SHARED_MATCHER
+        if mode not in ENTITY_MATCH_MODES:
+            raise ValueError(f"Unknown entity match mode: {mode}")
+        if rank not in ENTITY_RANK_MODES:
+            raise ValueError(f"Unknown entity rank mode: {rank}")
+        
+        if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            for text in texts:
+                yield self._match_names(text, mode, rank)
+            return
+        
+        _SHARED_MATCHER = self
+        try:
+            with multiprocessing.get_context("fork").Pool(processes=workers) as pool:
+                tasks = ((text, mode, rank) for text in texts)
+                yield from pool.imap(_match_names_worker, tasks, chunksize=chunksize)
+        finally:
+            _SHARED_MATCHER = None
+    
+    def match_batch(self, texts: Iterable[str], mode: str = "all", rank: str = "first",
+                    workers: int = 1, chunksize: int = 64) -> List[List[Dict[str, Any]]]:
+        """
+        批量匹配实体，返回每段文本的实体列表，参数见 iter_batch_matches
+        """
+        return [[self.entity_dict[name] for name in names]
+                for names, _ in self.iter_batch_matches(texts, mode, rank, workers, chunksize)]
+    
+    def build_mention_index(self, chunks_file: str, output_file: str, mode: str = "all", rank: str = "first",
+                            workers: int = 1) -> int:
+        """
+        对 chunks 文件中的全部chunk预先匹配实体，写出 chunk -> 实体提及 索引（JSONL）。
+        第一行为元信息，之后每行一个chunk：
+            {"chunk_index": 0, "entities": [实体名称, ...], "spans": [[start, end, 实体名称], ...]}
+        chunk_index 为chunk在文件中的行号，位置相对于去掉首尾空白后的 chunk_content（与关系抽取时匹配的文本相同）。
+        元信息中记录 chunks 文件和实体库的指纹，使用前用 check_mention_index 校验。
+        
+        Returns:
+            写入的chunk数
+        """
+        def iter_contents():
+            with jsonlines.open(chunks_file, mode='r') as reader:
+                for chunk in reader:
+                    yield chunk.get("chunk_content", "").strip()
+        
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        
+        # 在扫描前记录指纹，扫描期间文件被改写时索引会被判定为过期
+        meta = {
+            "format": "mention_index",
+            "version": MENTION_INDEX_VERSION,
+            "entities_file": self.entities_file,
+            "chunks_file": chunks_file,
+            "entities_fingerprint": _file_fingerprint(self.entities_file),
+            "chunks_fingerprint": _file_fingerprint(chunks_file),
+            "mode": mode,
+            "rank": rank,
+        }
+        count = 0
+        tmp_file = f"{output_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+            for names, spans in self.iter_batch_matches(iter_contents(), mode, rank, workers):
+                record = {"chunk_index": count, "entities": names, "spans": [list(span) for span in spans]}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+        os.replace(tmp_file, output_file)
+        print(f"已为 {count} 个chunk写出实体提及索引: {output_file}")
+        return count
+    
+    def render_entity_context(
+        self,
+        entities: List[Dict[str, Any]],
+        mode: str = "brief",
+        summary_chars: int = 100,
+        max_tokens: Optional[int] = None,
+        max_entities: Optional[int] = None
+    ) -> str:
+        """
+        将匹配到的实体渲染为注入prompt的上下文字符串
+        
+        Args:
+            entities: 实体列表
+            mode: 渲染方式
+                - "full": 完整的实体字典列表（与直接传入实体列表相同）
+                - "brief": 每行一个实体，包含名称、前3个类型和截断后的摘要
+                - "names": 只保留实体名称
+            summary_chars: brief 模式下摘要保留的最大字符数
+            max_tokens: token 预算，超出预算的实体不再加入
+            max_entities: 最大实体数
+            
+        Returns:
+            格式化的实体字符串
+        """
+        if mode not in ENTITY_CONTEXT_MODES:
+            raise ValueError(f"Unknown entity context mode: {mode}")
+        
+        if max_entities is not None:
+            entities = entities[:max_entities]
+        
+        if mode == "full":
+            if max_tokens is None:
+                return str(entities)
+            # 按预算截断后仍保持列表格式
+            kept = []
+            used = 2
+            for entity in entities:
+                tokens = count_tokens(str(entity)) + 1
+                if used + tokens > max_tokens:
+                    break
+                kept.append(entity)
+                used += tokens
+            return str(kept)
+        
+        if mode == "names":
+            separator = "、"
+            lines = [entity["entity_name"] for entity in entities]
+        else:
+            separator = "\n"
+            lines = []
+            for entity in entities:
+                summary = entity.get("summary", "")
+                if len(summary) > summary_chars:
+                    summary = summary[:summary_chars] + "..."
+                lines.append(f"- {entity['entity_name']} ({', '.join(entity.get('type', [])[:3])}): {summary}")
+        
+        if max_tokens is not None:
+            kept = []
+            used = 0
+            for line in lines:
+                tokens = count_tokens(line) + 1
+                if used + tokens > max_tokens:
+                    break
+                kept.append(line)
+                used += tokens
+            lines = kept
+        
+        return separator.join(lines)
+    
+    def match_entities_with_context(self, text: str, max_entities: int = 15, mode: str = "brief",
+                                    summary_chars: int = 100, max_tokens: Optional[int] = None,
+                                    match_mode: str = "all", rank: str = "first") -> str:
         """
         匹配实体并格式化为上下文字符串
         
         Args:
             text: 输入文本
             max_entities: 最大返回实体数
+            mode: 渲染方式，见 render_entity_context
+            summary_chars: brief 模式下摘要保留的最大字符数
+            max_tokens: token 预算
+            match_mode: 匹配方式，见 match_entities
+            rank: 排序方式，见 match_entities；与 max_entities 一起使用时决定保留哪些实体
             
         Returns:
             格式化的实体字符串
         """
-        matched_entities = self.match_entities(text)
+        matched_entities = self.match_entities(text, mode=match_mode, rank=rank)
         
-        # 限制实体数量
-        if len(matched_entities) > max_entities:
-            matched_entities = matched_entities[:max_entities]
-        
-        # 格式化为字符串
         if not matched_entities:
             return "未找到相关实体"
         
-        entity_list_str = "\n".join([
-            f"- {entity['entity_name']} ({', '.join(entity['type'][:3])}): {entity['summary'][:100]}..." 
-            for entity in matched_entities
-        ])
-        
-        return entity_list_str
+        return self.render_entity_context(matched_entities, mode=mode, summary_chars=summary_chars,
+                                          max_tokens=max_tokens, max_entities=max_entities)
     
     def get_entity_stats(self) -> Dict[str, Any]:
         """
@@ -107,6 +451,64 @@ class ACEntityMatcher:
             "total_chunk_references": chunk_count
         }
 
+def _match_names_worker(task: Tuple[str, str, str]) -> Tuple[List[str], List[Tuple[int, int, str]]]:
+    text, mode, rank = task
+    return _SHARED_MATCHER._match_names(text, mode, rank)
+
+
+def read_mention_index_meta(index_file: str) -> Dict[str, Any]:
+    """读取提及索引的元信息（第一行）"""
+    with open(index_file, "r", encoding="utf-8") as f:
+        meta = json.loads(f.readline())
+    if meta.get("format") != "mention_index" or meta.get("version") != MENTION_INDEX_VERSION:
+        raise ValueError(f"{index_file} is not a mention index (version {MENTION_INDEX_VERSION})")
+    return meta
+
+
+def check_mention_index(index_file: str, chunks_file: str, entities_file: str, mode: str, rank: str) -> Optional[str]:
+    """
+    检查提及索引能否用于给定的 chunks 文件、实体库和匹配参数
+    
+    Returns:
+        可以使用时返回 None，否则返回原因
+    """
+    if not os.path.exists(index_file):
+        return f"{index_file} does not exist"
+    try:
+        meta = read_mention_index_meta(index_file)
+    except ValueError as e:
+        return str(e)
+    if not _fingerprint_matches(meta.get("chunks_fingerprint"), chunks_file):
+        return f"built from {meta.get('chunks_file')}, which does not match {chunks_file}"
+    if not _fingerprint_matches(meta.get("entities_fingerprint"), entities_file):
+        return f"built from entities {meta.get('entities_file')}, which do not match {entities_file}"
+    if (meta.get("mode"), meta.get("rank")) != (mode, rank):
+        return f"built with match mode {meta.get('mode')} / rank {meta.get('rank')}, expected {mode} / {rank}"
+    return None
+
+
+def load_mention_index(index_file: str, start_index: int = 0,
+                       end_index: Optional[int] = None) -> Tuple[Dict[str, Any], Dict[int, List[str]]]:
+    """
+    读取 build_mention_index 生成的索引中 [start_index, end_index) 范围内的chunk
+    
+    Returns:
+        (元信息, {chunk_index: 实体名称列表})
+    """
+    meta = read_mention_index_meta(index_file)
+    mentions: Dict[int, List[str]] = {}
+    with open(index_file, "r", encoding="utf-8") as f:
+        f.readline()
+        for line in f:
+            record = json.loads(line)
+            chunk_index = record["chunk_index"]
+            if end_index is not None and chunk_index >= end_index:
+                break
+            if chunk_index >= start_index:
+                mentions[chunk_index] = record["entities"]
+    return meta, mentions
+
+
 def test_entity_matching_with_relation_chunk():
     """使用relation_chunks中的第一个chunk进行实体匹配测试"""
     # 初始化匹配器
@@ -174,6 +576,24 @@ def interactive_test():
         print(result)
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Match entities in chunks, or build a chunk -> entity mention index')
+    parser.add_argument('--entities_file', type=str, default="./kg_output/entities_kb.json", help='Entity knowledge base')
+    parser.add_argument('--chunks_file', type=str, default="./chunks_output/relation_chunks.jsonl", help='Input JSONL chunks')
+    parser.add_argument('--mention-index', type=str, default=None,
+                        help='Write the mention index to this JSONL file (without it, run the matching test)')
+    parser.add_argument('--match-mode', type=str, default="all", choices=ENTITY_MATCH_MODES, help='Entity matching mode')
+    parser.add_argument('--entity-rank', type=str, default="first", choices=ENTITY_RANK_MODES, help='Order of matched entities')
+    parser.add_argument('--workers', type=int, default=1, help='Matching processes (forked, sharing one automaton)')
+    args = parser.parse_args()
+    
+    if args.mention_index:
+        matcher = ACEntityMatcher(args.entities_file)
+        matcher.build_mention_index(args.chunks_file, args.mention_index, mode=args.match_mode,
+                                    rank=args.entity_rank, workers=args.workers)
+        raise SystemExit(0)
+    
     # 运行测试
     matched_entities = test_entity_matching_with_relation_chunk()
     
@@ -0,0 +1,113 @@
+# async_runner.py
+# 并发调用LLM链的工具函数，供各抽取器共用
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    获取进程内复用的事件循环。
+    ChatOpenAI 的异步 httpx 连接池绑定在事件循环上，每个批次新建/关闭循环会导致连接失效，
+    因此整个进程只使用同一个循环。
+    """
+    global _LOOP
+    if _LOOP is None or _LOOP.is_closed():
+        _LOOP = asyncio.new_event_loop()
+    return _LOOP
+
+
+def iter_ordered_async(
+    func: Callable[[Any], Awaitable[Any]],
+    items: Iterable[Any],
+    concurrency: int,
+    controller: Optional[Any] = None,
+) -> Iterator[Tuple[Any, Any, Optional[BaseException]]]:
+    """
+    以最多 concurrency 个并发执行异步函数，并严格按输入顺序逐个返回结果。
+
+    后面的任务在等待前面的任务时仍在并发执行，调用方可以边取结果边合并/保存。
+
+    Args:
+        func: 对单个元素执行的异步函数
+        items: 输入元素
+        concurrency: 最大并发数
+        controller: 自适应并发控制器（llm_model.AdaptiveConcurrencyController），
+            提供时由其 slot() 动态控制并发窗口，concurrency 不再生效
+
+    Yields:
+        (item, result, error)，出错时 result 为 None，error 为捕获到的异常
+    """
+    items = list(items)
+    if not items:
+        return
+
+    loop = _get_event_loop()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(item: Any) -> Tuple[Any, Optional[BaseException]]:
+        # 异常需要穿过 slot()，控制器才能根据 429/503/超时 调整窗口
+        attempt = 0
+        while True:
+            try:
+                async with (controller.slot() if controller is not None else semaphore):
+                    return await func(item), None
+            except Exception as e:
+                # 控制器下的客户端不自行重试，过载失败的请求在窗口缩小后重新排队
+                if controller is None or attempt >= controller.overload_retries or not controller.is_overload(e):
+                    return None, e
+                attempt += 1
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    tasks = [loop.create_task(_run(item)) for item in items]
+    try:
+        for item, task in zip(items, tasks):
+            result, error = loop.run_until_complete(task)
+            yield item, result, error
+    finally:
+        # 调用方提前退出时取消尚未完成的请求
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+
+def iter_chain_results(
+    chain: Runnable,
+    tasks: List[Tuple[Any, Dict[str, Any]]],
+    concurrency: int = 1,
+    controller: Optional[Any] = None,
+) -> Iterator[Tuple[Any, Any, Optional[BaseException]]]:
+    """
+    按顺序返回 LLM 链对每个任务的输出。
+
+    concurrency <= 1 时逐个同步调用 invoke，与原有的串行流程完全一致；
+    否则通过 ainvoke 并发请求，vLLM 的连续批处理可以同时处理这些请求。
+
+    Args:
+        chain: prompt | model 构成的链
+        tasks: (key, inputs) 列表，inputs 为传给链的变量
+        concurrency: 最大并发请求数
+        controller: 自适应并发控制器，提供时始终走异步并发路径
+
+    Yields:
+        (key, output, error)
+    """
+    if concurrency <= 1 and controller is None:
+        for key, inputs in tasks:
+            try:
+                yield key, chain.invoke(inputs), None
+            except Exception as e:
+                yield key, None, e
+        return
+
+    async def _ainvoke(task: Tuple[Any, Dict[str, Any]]) -> Any:
+        return await chain.ainvoke(task[1])
+
+    for (key, _), output, error in iter_ordered_async(_ainvoke, tasks, concurrency, controller):
+        yield key, output, error
@@ -0,0 +1,317 @@
+# batch_driver.py
+# 常驻进程的批处理驱动，替代 entity_batch_process.sh / relation_batch_process.sh
+# 模型客户端与AC自动机只初始化一次，进度记录在manifest中，--resume 时从manifest继续
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import jsonlines
+
+from chunk_journal import JOURNAL_SUFFIX, list_range_files
+from llm_cache import DEFAULT_CACHE_FILE
+from summary_consolidation import DEFAULT_SUMMARY_MAX_CHARS
+
+TASK_DEFAULTS = {
+    "entity": {
+        "input_file": "./chunks_output/chunks.jsonl",
+        "output_dir": "./entities_output",
+        "batch_size": 20,
+        "prefix": "entities",
+    },
+    "relation": {
+        "input_file": "./chunks_output/relation_chunks.jsonl",
+        "output_dir": "./triplets_output",
+        "batch_size": 50,
+        "prefix": "triples",
+    },
+}
+
+
+class BatchDriver:
+    """
+    在一个进程内按批遍历整个chunk文件。
+    manifest 记录 done / failed / pending 三类chunk索引，每个批次结束后原子写入，
+    重启时只处理尚未完成或失败的chunk所在的批次。
+    """
+
+    def __init__(
+        self,
+        task: str,
+        input_file: str,
+        output_dir: str,
+        manifest_file: str,
+        batch_size: int,
+        concurrency: int = 1,
+        entities_file: str = "./kg_output/entities_kb.json",
+        use_cache: bool = True,
+        cache_file: str = DEFAULT_CACHE_FILE,
+        refresh_cache: bool = False,
+        adaptive: bool = False,
+        max_concurrency: int = 64,
+        endpoints: Optional[List[str]] = None,
+        entity_context: str = "full",
+        entity_summary_chars: int = 100,
+        entity_token_budget: Optional[int] = None,
+        summary_max_chars: Optional[int] = DEFAULT_SUMMARY_MAX_CHARS,
+        automaton_cache: bool = True,
+        entity_match_mode: str = "all",
+        entity_rank: str = "first",
+        mention_index: Optional[str] = None,
+    ):
+        if task not in TASK_DEFAULTS:
+            raise ValueError(f"Unknown task: {task}")
+
+        self.task = task
+        self.input_file = input_file
+        self.output_dir = output_dir
+        self.manifest_file = manifest_file
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.entities_file = entities_file
+
+        # 自适应并发时客户端不自行重试，过载信号交给控制器
+        from llm_model import ADAPTIVE_CLIENT_MAX_RETRIES
+        llm_max_retries = ADAPTIVE_CLIENT_MAX_RETRIES if adaptive else None
+
+        # 只导入并初始化一次 LangChain、模型客户端和AC自动机
+        if task == "entity":
+            from get_entities import EntityExtractor
+            self.extractor = EntityExtractor(use_cache=use_cache, cache_file=cache_file, refresh_cache=refresh_cache,
+                                             endpoints=endpoints, summary_max_chars=summary_max_chars,
+                                             llm_max_retries=llm_max_retries)
+        else:
+            from get_relations import RelationExtractor
+            self.extractor = RelationExtractor(entities_file=entities_file, use_cache=use_cache,
+                                               cache_file=cache_file, refresh_cache=refresh_cache, endpoints=endpoints,
+                                               entity_context=entity_context, entity_summary_chars=entity_summary_chars,
+                                               entity_token_budget=entity_token_budget, automaton_cache=automaton_cache,
+                                               entity_match_mode=entity_match_mode, entity_rank=entity_rank,
+                                               mention_index=mention_index, llm_max_retries=llm_max_retries)
+        self.logger = self.extractor.logger
+
+        # 自适应并发控制器在所有批次间共享，窗口不会在批次切换时重置
+        self.controller = None
+        if adaptive:
+            from llm_model import VLLMModel
+            self.controller = VLLMModel().get_concurrency_controller(initial_limit=concurrency, max_limit=max_concurrency)
+
+    def _count_chunks(self) -> int:
+        count = 0
+        with jsonlines.open(self.input_file, mode='r') as reader:
+            for _ in reader:
+                count += 1
+        return count
+
+    def _new_manifest(self, total_chunks: int) -> Dict[str, Any]:
+        return {
+            "task": self.task,
+            "input_file": self.input_file,
+            "output_dir": self.output_dir,
+            "batch_size": self.batch_size,
+            "total_chunks": total_chunks,
+            "done": [],
+            "failed": {},
+            "pending": list(range(total_chunks)),
+        }
+
+    def _load_manifest(self, total_chunks: int) -> Dict[str, Any]:
+        with open(self.manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        if manifest.get("task") != self.task or manifest.get("input_file") != self.input_file:
+            raise ValueError(f"Manifest {self.manifest_file} belongs to a different run "
+                             f"(task={manifest.get('task')}, input_file={manifest.get('input_file')})")
+        if manifest.get("batch_size") != self.batch_size:
+            # 已有的范围保持原来的边界（见 _plan_batches），新的批大小只用于尚无输出的chunk
+            self.logger.info(f"Batch size changed from {manifest.get('batch_size')} to {self.batch_size}")
+            manifest["batch_size"] = self.batch_size
+
+        # 输入文件追加了新chunk时，将新chunk加入pending
+        known = set(manifest["done"]) | {int(i) for i in manifest["failed"]} | set(manifest["pending"])
+        manifest["pending"].extend(i for i in range(manifest["total_chunks"], total_chunks) if i not in known)
+        manifest["total_chunks"] = total_chunks
+        return manifest
+
+    def _save_manifest(self, manifest: Dict[str, Any]) -> None:
+        manifest_dir = os.path.dirname(self.manifest_file)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        manifest["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+        tmp_file = f"{self.manifest_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.manifest_file)
+
+    def _plan_batches(self, todo: Set[int], total_chunks: int) -> List[Tuple[int, int]]:
+        """
+        将待处理的chunk分为 [start, end) 批次。
+        落在已有输出文件或预写日志范围内的chunk按该范围原来的边界重跑，其中已完成的chunk从日志复用；
+        其余chunk按 batch_size 对齐分批，并在已有范围处截断。这样修改批大小或输入文件追加chunk后，
+        已完成的chunk不会重新请求LLM，也不会产生相互重叠的输出文件。
+        """
+        prefix = TASK_DEFAULTS[self.task]["prefix"]
+        existing = sorted({(start, end) for suffix in (".json", JOURNAL_SUFFIX)
+                           for start, end, _ in list_range_files(self.output_dir, prefix, suffix)})
+
+        batches: List[Tuple[int, int]] = []
+        planned: Set[int] = set()
+        for index in sorted(todo):
+            if index in planned:
+                continue
+            containing = next(((start, end) for start, end in existing if start <= index <= end), None)
+            if containing is not None:
+                start, end = containing[0], min(containing[1] + 1, total_chunks)
+            else:
+                start = index - index % self.batch_size
+                end = min(start + self.batch_size, total_chunks)
+                for other_start, other_end in existing:
+                    if other_end < index:
+                        start = max(start, other_end + 1)
+                    elif other_start > index:
+                        end = min(end, other_start)
+            batches.append((start, end))
+            planned.update(range(start, end))
+        return batches
+
+    def _run_batch(self, start: int, end: int) -> None:
+        if self.task == "entity":
+            self.extractor.extract_entities_from_range(
+                input_file=self.input_file,
+                output_dir=self.output_dir,
+                start_index=start,
+                end_index=end,
+                concurrency=self.concurrency,
+                controller=self.controller
+            )
+        else:
+            self.extractor.extract_relations_from_range(
+                input_file=self.input_file,
+                entities_file=self.entities_file,
+                output_dir=self.output_dir,
+                start_index=start,
+                end_index=end,
+                concurrency=self.concurrency,
+                controller=self.controller
+            )
+
+    def run(self, resume: bool = False) -> Dict[str, Any]:
+        """
+        处理整个chunk文件
+
+        Args:
+            resume: 是否从已有manifest继续；为 False 时重新建立manifest
+
+        Returns:
+            最终的manifest
+        """
+        total_chunks = self._count_chunks()
+        if resume and os.path.exists(self.manifest_file):
+            manifest = self._load_manifest(total_chunks)
+            self.logger.info(f"Resuming from {self.manifest_file}: {len(manifest['done'])} done, "
+                             f"{len(manifest['failed'])} failed, {len(manifest['pending'])} pending")
+        else:
+            if resume:
+                self.logger.warning(f"Manifest {self.manifest_file} not found, starting a new run")
+            manifest = self._new_manifest(total_chunks)
+
+        done = set(manifest["done"])
+        failed: Dict[str, str] = manifest["failed"]
+        todo = set(manifest["pending"]) | {int(i) for i in failed}
+
+        batches = self._plan_batches(todo, total_chunks)
+        self.logger.info(f"{len(todo)} chunks to process in {len(batches)} batches (batch size {self.batch_size})")
+
+        try:
+            for batch_num, (start, end) in enumerate(batches, 1):
+                self.logger.info(f"Batch {batch_num}/{len(batches)}: chunks {start}-{end - 1}")
+
+                try:
+                    self._run_batch(start, end)
+                    batch_done = set(self.extractor.completed_chunks)
+                    batch_failed = {item["index"]: item["error"] for item in self.extractor.failed_chunks}
+                except Exception as e:
+                    self.logger.error(f"Batch {start}-{end - 1} failed: {e}")
+                    batch_done = set()
+                    batch_failed = {index: repr(e) for index in range(start, end) if index not in done}
+
+                for index in range(start, end):
+                    if index in batch_done:
+                        done.add(index)
+                        failed.pop(str(index), None)
+                    elif index in batch_failed:
+                        failed[str(index)] = batch_failed[index]
+
+                manifest["done"] = sorted(done)
+                manifest["pending"] = [i for i in range(total_chunks) if i not in done and str(i) not in failed]
+                self._save_manifest(manifest)
+        finally:
+            manifest["done"] = sorted(done)
+            manifest["pending"] = [i for i in range(total_chunks) if i not in done and str(i) not in failed]
+            self._save_manifest(manifest)
+
+        self.logger.info(f"Batch processing completed: {len(done)} done, {len(failed)} failed, "
+                         f"{len(manifest['pending'])} pending. Manifest saved to {self.manifest_file}")
+        if self.extractor.llm_cache is not None:
+            self.logger.info(f"LLM cache stats: {self.extractor.llm_cache.stats()}")
+        if self.controller is not None:
+            self.logger.info(f"Concurrency controller stats: {self.controller.stats()}")
+        if hasattr(self.extractor.model, "endpoint_stats"):
+            self.logger.info(f"Endpoint stats: {self.extractor.model.endpoint_stats()}")
+        return manifest
+
+
+if __name__ == "__main__":
+    # 任务特有的参数与 get_entities.py / get_relations.py 共用同一份定义
+    from get_entities import add_entity_arguments
+    from get_relations import add_relation_arguments
+
+    parser = argparse.ArgumentParser(description='Resumable batch driver for entity / relation extraction')
+    parser.add_argument('--task', type=str, choices=sorted(TASK_DEFAULTS), required=True, help='Extraction task')
+    parser.add_argument('--input_file', type=str, default=None, help='Input JSONL file path')
+    parser.add_argument('--output_dir', type=str, default=None, help='Output directory path')
+    parser.add_argument('--manifest', type=str, default=None, help='Progress manifest path')
+    parser.add_argument('--batch-size', type=int, default=None, help='Chunks per output file')
+    parser.add_argument('--concurrency', type=int, default=1, help='Max concurrent LLM requests (1 = sequential)')
+    parser.add_argument('--adaptive', action='store_true', help='Adapt concurrency to server load, starting from --concurrency')
+    parser.add_argument('--max-concurrency', type=int, default=64, help='Upper bound of the adaptive concurrency window')
+    parser.add_argument('--endpoints', type=str, default=None, help='Comma-separated vLLM base URLs to load-balance across')
+    parser.add_argument('--resume', action='store_true', help='Continue from the progress manifest')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the on-disk LLM response cache')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached responses and overwrite them with fresh ones')
+    parser.add_argument('--cache_file', type=str, default=DEFAULT_CACHE_FILE, help='LLM response cache file path')
+    add_entity_arguments(parser.add_argument_group('entity task'))
+    add_relation_arguments(parser.add_argument_group('relation task'))
+
+    args = parser.parse_args()
+    defaults = TASK_DEFAULTS[args.task]
+
+    driver = BatchDriver(
+        task=args.task,
+        input_file=args.input_file or defaults["input_file"],
+        output_dir=args.output_dir or defaults["output_dir"],
+        manifest_file=args.manifest or os.path.join("logs", f"{args.task}_manifest.json"),
+        batch_size=args.batch_size or defaults["batch_size"],
+        concurrency=args.concurrency,
+        entities_file=args.entities_file,
+        use_cache=not args.no_cache,
+        cache_file=args.cache_file,
+        refresh_cache=args.refresh,
+        adaptive=args.adaptive,
+        max_concurrency=args.max_concurrency,
+        endpoints=args.endpoints.split(',') if args.endpoints else None,
+        entity_context=args.entity_context,
+        entity_summary_chars=args.entity_summary_chars,
+        entity_token_budget=args.entity_token_budget,
+        summary_max_chars=args.summary_max_chars or None,
+        automaton_cache=not args.no_automaton_cache,
+        entity_match_mode=args.match_mode,
+        entity_rank=args.entity_rank,
+        mention_index=args.mention_index,
+    )
+    driver.run(resume=args.resume)
@@ -0,0 +1,126 @@
+# bench_entity_merge.py
+# 在合成语料上对比 entity_db.merge_entity_knowledge_base 与旧版（列表 in 判断 + 字符串反复拼接）的耗时
+# 用法：python benchmarks/bench_entity_merge.py --mentions 1000000 --legacy-mentions 100000
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from entity_db import merge_entity_knowledge_base, sorted_range_files
+
+TYPES = ["材料", "工艺", "设备", "缺陷", "参数", "标准", "方法", "部件"]
+DOMAINS = ["焊接", "热处理", "机械加工", "质量检测", "材料科学"]
+
+
+def legacy_merge(input_dir: str, output_file: str) -> Dict[str, Any]:
+    """旧版 merge_entity_knowledge_base 的合并逻辑（文件顺序与新版相同，便于比较输出）"""
+    entity_kb: Dict[str, Dict[str, Any]] = {}
+    for file_path in sorted_range_files(input_dir, prefix="entities_", suffix=".json"):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            entities = json.load(f)
+        for ent in entities:
+            key = ent["entity_name"]
+            if key in entity_kb:
+                for type_item in ent.get("type", []):
+                    if type_item not in entity_kb[key]["type"]:
+                        entity_kb[key]["type"].append(type_item)
+                for relevance in ent.get("domain_relevance", []):
+                    if relevance not in entity_kb[key]["domain_relevance"]:
+                        entity_kb[key]["domain_relevance"].append(relevance)
+                old_summary = entity_kb[key]["summary"]
+                new_summary = ent["summary"]
+                if old_summary != new_summary:
+                    entity_kb[key]["summary"] = f"{old_summary} | {new_summary}".strip()
+                for chunk_id in ent.get("chunk_ids", []):
+                    if chunk_id not in entity_kb[key]["chunk_ids"]:
+                        entity_kb[key]["chunk_ids"].append(chunk_id)
+            else:
+                entity_kb[key] = {
+                    "entity_name": ent["entity_name"],
+                    "type": ent["type"][:],
+                    "domain_relevance": ent.get("domain_relevance", [])[:],
+                    "summary": ent["summary"],
+                    "chunk_ids": ent.get("chunk_ids", [])[:]
+                }
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(list(entity_kb.values()), f, ensure_ascii=False, indent=4)
+    return entity_kb
+
+
+def make_corpus(output_dir: str, mentions: int, entity_count: int, chunks_per_file: int, seed: int) -> None:
+    """
+    生成 entities_{start}_{end}.json 文件。实体出现频率服从 Zipf 分布，
+    头部实体（类似“焊接”“钢板”）会出现在数万个chunk中。
+    """
+    rng = random.Random(seed)
+    names = [f"实体{i}" for i in range(entity_count)]
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(entity_count)))
+    mentions_per_chunk = 10
+    total_chunks = max(1, mentions // mentions_per_chunk)
+
+    for start in range(0, total_chunks, chunks_per_file):
+        end = min(start + chunks_per_file, total_chunks)
+        entities = []
+        for chunk_id in range(start, end):
+            for name in rng.choices(names, cum_weights=cum_weights, k=mentions_per_chunk):
+                entities.append({
+                    "entity_name": name,
+                    "type": rng.sample(TYPES, rng.randint(1, 2)),
+                    "domain_relevance": rng.sample(DOMAINS, 1),
+                    "summary": f"{name}的说明{rng.randint(0, 2)}",
+                    "chunk_ids": [chunk_id],
+                })
+        with open(os.path.join(output_dir, f"entities_{start}_{end - 1}.json"), "w", encoding="utf-8") as f:
+            json.dump(entities, f, ensure_ascii=False)
+
+
+def run(name: str, merge, input_dir: str, **kwargs: Any) -> Dict[str, Any]:
+    output_file = os.path.join(input_dir, f"{name}_kb.out")
+    start = time.perf_counter()
+    entity_kb = merge(input_dir, output_file, **kwargs)
+    print(f"{name:>8}: {time.perf_counter() - start:8.2f} s, {len(entity_kb)} entities")
+    return entity_kb
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark entity knowledge base merging')
+    parser.add_argument('--mentions', type=int, default=1_000_000, help='Entity mentions in the synthetic corpus')
+    parser.add_argument('--entities', type=int, default=20_000, help='Distinct entity names')
+    parser.add_argument('--chunks-per-file', type=int, default=20, help='Chunks per entities_*.json file')
+    parser.add_argument('--legacy-mentions', type=int, default=100_000,
+                        help='Also run the legacy merge when the corpus is at most this large (it is quadratic)')
+    parser.add_argument('--workers', type=int, default=4, help='Also run the parallel merge with this many processes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        start = time.perf_counter()
+        make_corpus(corpus_dir, args.mentions, args.entities, args.chunks_per_file, args.seed)
+        print(f"Generated {args.mentions} mentions in {time.perf_counter() - start:.2f} s")
+
+        # 各实现使用相同的文件顺序，输出应完全一致
+        new_kb = run("set", merge_entity_knowledge_base, corpus_dir)
+        if args.workers > 1:
+            parallel_kb = run(f"set x{args.workers}", merge_entity_knowledge_base, corpus_dir, workers=args.workers)
+            print(f"Parallel output identical: {list(new_kb.values()) == list(parallel_kb.values())}")
+        if args.mentions <= args.legacy_mentions:
+            legacy_kb = run("legacy", legacy_merge, corpus_dir)
+            # 摘要改为去重句子集合并限制长度，其余字段应与旧版完全一致
+            fields = ("entity_name", "type", "domain_relevance", "chunk_ids")
+            identical = all(
+                [new[f] for f in fields] == [old[f] for f in fields]
+                for new, old in zip(new_kb.values(), legacy_kb.values())
+            ) and list(new_kb) == list(legacy_kb)
+            print(f"Outputs identical (except summary): {identical}")
+            print(f"Summary characters: {sum(len(e['summary']) for e in new_kb.values())} "
+                  f"(legacy {sum(len(e['summary']) for e in legacy_kb.values())})")
+        else:
+            print(f"Skipping legacy merge (> {args.legacy_mentions} mentions)")
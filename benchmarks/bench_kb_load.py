@@ -0,0 +1,50 @@
+# bench_kb_load.py
+# 对比实体库/三元组库以 JSON 整体载入与以列式存储（kb_columnar）内存映射打开的耗时
+# 用法：python benchmarks/bench_kb_load.py --input ./kg_output/entities_kb.json --key entity_name
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kb_columnar import ColumnarKB
+from kb_io import load_records, write_records
+
+
+def timed(label: str, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:>28}: {(time.perf_counter() - start) * 1000:9.2f} ms")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark JSON vs columnar knowledge base loading')
+    parser.add_argument('--input', type=str, default="./kg_output/entities_kb.json", help='JSON knowledge base')
+    parser.add_argument('--key', type=str, default="entity_name", help='String field used for keyed lookups')
+    parser.add_argument('--lookups', type=int, default=1000, help='Random keyed lookups')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    records = timed("json load", lambda: load_records(args.input))
+    keyed = timed("json build dict", lambda: {r[args.key]: r for r in records})
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "kb.kbc")
+        timed("columnar write", lambda: write_records(path, records))
+        kb = timed("columnar open", lambda: ColumnarKB(path))
+        view = kb.keyed(args.key)
+
+        keys = random.Random(args.seed).sample(list(keyed), min(args.lookups, len(keyed)))
+        timed(f"{len(keys)} dict lookups", lambda: [keyed[k] for k in keys])
+        columnar_hits = timed(f"{len(keys)} columnar lookups", lambda: [view[k] for k in keys])
+        columnar_records = timed("columnar iterate all", lambda: list(kb))
+
+        print(f"Records identical: {columnar_records == records}")
+        print(f"Lookups identical: {columnar_hits == [keyed[k] for k in keys]}")
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        print(f"Size: JSON {os.path.getsize(args.input) / 1e6:.2f} MB, columnar {size / 1e6:.2f} MB")
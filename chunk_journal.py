@@ -0,0 +1,176 @@
+# chunk_journal.py
+# 按chunk追加写入的JSONL预写日志，用于抽取过程的增量保存与断点续跑
+
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+JOURNAL_SUFFIX = ".journal.jsonl"
+
+
+def range_file(directory: str, prefix: str, start: int, end: int, suffix: str) -> str:
+    """
+    抽取结果与预写日志的文件名 {prefix}_{start}_{end}{suffix}，start/end 为文件中第一个和最后一个chunk的索引
+    """
+    return os.path.join(directory, f"{prefix}_{start}_{end}{suffix}")
+
+
+def list_range_files(directory: str, prefix: str, suffix: str) -> List[Tuple[int, int, str]]:
+    """
+    列出目录中 {prefix}_{start}_{end}{suffix} 形式的文件，按 (start, end) 排序
+    """
+    if not os.path.isdir(directory):
+        return []
+    pattern = re.compile(rf"^{re.escape(prefix)}_(\d+)_(\d+){re.escape(suffix)}$")
+    files = []
+    for filename in os.listdir(directory):
+        match = pattern.match(filename)
+        if match:
+            files.append((int(match.group(1)), int(match.group(2)), os.path.join(directory, filename)))
+    return sorted(files)
+
+
+def _read_records(journal_file: str, truncate: bool, logger: logging.Logger) -> Dict[int, Dict[str, Any]]:
+    """
+    读取日志中的完整记录。truncate 为 True 时截断末尾不完整的半行（只用于自己要继续追加的日志，
+    其他范围的日志可能正被另一个进程写入，只读不改）
+    """
+    completed: Dict[int, Dict[str, Any]] = {}
+    if not os.path.exists(journal_file):
+        return completed
+
+    with open(journal_file, "rb") as f:
+        data = f.read()
+
+    valid_length = data.rfind(b"\n") + 1
+    if truncate and valid_length < len(data):
+        logger.warning(f"Truncating incomplete trailing record in {journal_file}")
+        with open(journal_file, "r+b") as f:
+            f.truncate(valid_length)
+
+    for line_no, line in enumerate(data[:valid_length].splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping corrupted journal line {line_no} in {journal_file}: {e}")
+            continue
+        completed[record["index"]] = record
+
+    return completed
+
+
+class ChunkJournal:
+    """
+    每处理完一个chunk追加一条记录（JSONL），每 fsync_every 条记录 fsync 一次。
+    重启时通过 load() 回放日志，已完成的chunk可直接跳过。
+    """
+
+    def __init__(self, journal_file: str, fsync_every: int = 20):
+        """
+        Args:
+            journal_file: 日志文件路径
+            fsync_every: 每写入多少条记录执行一次 fsync
+        """
+        self.journal_file = journal_file
+        self.fsync_every = max(1, fsync_every)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._file = None
+        self._unsynced = 0
+
+    def load(self) -> Dict[int, Dict[str, Any]]:
+        """
+        回放日志，返回 {chunk全局索引: 记录}。
+        崩溃时可能留下半行记录，这部分会被截断，之后的追加从完整行开始。
+        """
+        return _read_records(self.journal_file, truncate=True, logger=self.logger)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """
+        追加一条chunk记录，记录中必须包含 "index" 字段
+        """
+        if self._file is None:
+            journal_dir = os.path.dirname(self.journal_file)
+            if journal_dir:
+                os.makedirs(journal_dir, exist_ok=True)
+            self._file = open(self.journal_file, "a", encoding="utf-8")
+
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "ChunkJournal":
+        return self
+
+    def __exit__(self, exc_type: Optional[type], exc: Optional[BaseException], tb: Any) -> None:
+        self.close()
+
+
+def load_range_journal(output_dir: str, prefix: str, start: int, end: int) -> Tuple[ChunkJournal, Dict[int, Dict[str, Any]]]:
+    """
+    打开 chunk 范围 [start, end] 的预写日志并回放。
+    其他范围的日志（之前用不同的 --end 或批大小运行留下的）中落在该范围内的chunk同样视为已完成，
+    这些记录会复制到本范围的日志中，之后本范围的日志不再依赖其他日志。
+
+    Returns:
+        (本范围的日志, {chunk全局索引: 记录})
+    """
+    journal = ChunkJournal(range_file(output_dir, prefix, start, end, JOURNAL_SUFFIX))
+    completed = journal.load()
+
+    adopted = 0
+    for other_start, other_end, other_file in list_range_files(output_dir, prefix, JOURNAL_SUFFIX):
+        if other_file == journal.journal_file or other_end < start or other_start > end:
+            continue
+        for index, record in _read_records(other_file, truncate=False, logger=journal.logger).items():
+            if start <= index <= end and index not in completed:
+                journal.append(record)
+                completed[index] = record
+                adopted += 1
+    if adopted:
+        journal.sync()
+        journal.logger.info(f"Reused {adopted} chunks from journals of other ranges")
+    return journal, completed
+
+
+def remove_superseded_range_files(output_dir: str, prefix: str, start: int, end: int,
+                                  done: Iterable[int], suffix: str = ".json") -> List[str]:
+    """
+    写出 [start, end] 范围的结果后，删除被该范围完全覆盖、且其中chunk都已在本范围完成的其他范围的
+    输出文件及其日志，避免合并结果时同一chunk被计入两次。部分重叠的文件保留并给出警告。
+
+    Returns:
+        删除的文件路径
+    """
+    logger = logging.getLogger(ChunkJournal.__name__)
+    done = set(done)
+    removed = []
+    for other_start, other_end, other_file in list_range_files(output_dir, prefix, suffix):
+        if (other_start, other_end) == (start, end) or other_end < start or other_start > end:
+            continue
+        if start <= other_start and other_end <= end and all(i in done for i in range(other_start, other_end + 1)):
+            for path in (other_file, range_file(output_dir, prefix, other_start, other_end, JOURNAL_SUFFIX)):
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed.append(path)
+        else:
+            logger.warning(f"{other_file} overlaps chunks {start}-{end}, the overlapping chunks will be merged twice")
+    if removed:
+        logger.info(f"Removed {len(removed)} files superseded by chunks {start}-{end}")
+    return removed
@@ -1,76 +1,225 @@
+import argparse
+import multiprocessing
 import os
-import json
-from typing import Dict, List, Any
+import re
+from typing import Dict, Iterator, List, Any, Optional, Tuple
 
-def merge_entity_knowledge_base(input_dir: str, output_file: str) -> Dict[str, Any]:
+from chunk_journal import JOURNAL_SUFFIX
+from kb_io import JSONL_SUFFIXES, load_records, write_records
+from summary_consolidation import DEFAULT_SUMMARY_MAX_CHARS, SummaryAccumulator, summary_accumulator
+
+# 输出文件名中的chunk范围，如 entities_0_19.json
+_RANGE_PATTERN = re.compile(r"_(\d+)_(\d+)\.[^.]+$")
+# 可合并的输出文件格式；抽取时的预写日志（*.journal.jsonl）记录的是逐chunk的原始结果，不参与合并
+KB_INPUT_SUFFIXES = (".json",) + JSONL_SUFFIXES
+
+
+class _OrderedUnion:
+    """
+    保持插入顺序的去重列表：列表负责输出顺序，集合负责 O(1) 的成员判断。
+    初始列表原样保留（与原先 ent["type"][:] 的行为一致），之后只追加未出现过的元素。
+    两个实例的合并（a.update(b.items)）满足结合律，可用于并行归并。
+    """
+
+    __slots__ = ("items", "seen")
+
+    def __init__(self, items: List[Any]):
+        self.items = list(items)
+        self.seen = set(self.items)
+
+    def update(self, items: List[Any]) -> None:
+        for item in items:
+            if item not in self.seen:
+                self.seen.add(item)
+                self.items.append(item)
+
+
+def sorted_range_files(input_dir: str, prefix: str = "", suffix: Any = KB_INPUT_SUFFIXES) -> List[str]:
+    """
+    列出目录中的输出文件（JSON 与 JSONL，不含预写日志），按文件名中的 chunk 范围 (start, end) 排序，
+    例如 entities_0_19.json、triples_20_69.jsonl。无法解析范围的文件按文件名排在最后。
+    合并顺序固定后，结果不再依赖 os.listdir 的返回顺序。
+    """
+    def sort_key(filename: str) -> Tuple[int, int, int, str]:
+        match = _RANGE_PATTERN.search(filename)
+        if match:
+            return 0, int(match.group(1)), int(match.group(2)), filename
+        return 1, 0, 0, filename
+
+    filenames = [
+        filename for filename in os.listdir(input_dir)
+        if filename.startswith(prefix) and filename.endswith(suffix) and not filename.endswith(JOURNAL_SUFFIX)
+    ]
+    return [os.path.join(input_dir, filename) for filename in sorted(filenames, key=sort_key)]
+
+
+def split_contiguous(items: List[Any], parts: int) -> List[List[Any]]:
+    """将列表切成至多 parts 段连续的子列表，保持原有顺序"""
+    parts = max(1, min(parts, len(items)))
+    size, extra = divmod(len(items), parts)
+    slices = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(items[start:end])
+        start = end
+    return slices
+
+
+def _iter_entity_files(file_paths: List[str]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    逐个读取实体文件，合并完一个文件后再读取下一个，不同时持有所有文件的内容
+    """
+    for file_path in file_paths:
+        filename = os.path.basename(file_path)
+        try:
+            entities = load_records(file_path)
+        except Exception as e:
+            print(f"处理文件 {filename} 时出错: {e}")
+            continue
+        yield filename, entities
+
+
+def _merge_entity_files(file_paths: List[str], summary_max_chars: Optional[int] = DEFAULT_SUMMARY_MAX_CHARS) -> Dict[str, Dict[str, Any]]:
+    """
+    按顺序合并一组实体文件，得到部分知识库。
+    摘要保存为去重后的有序句子集合并限制长度，部分知识库之间的合并同样满足结合律。
+    """
+    entity_kb: Dict[str, Dict[str, Any]] = {}
+    
+    for filename, entities in _iter_entity_files(file_paths):
+        try:
+            # 处理每个实体
+            for ent in entities:
+                key = ent["entity_name"]
+                
+                if key in entity_kb:
+                    merged = entity_kb[key]
+                    # 合并实体类型
+                    merged["type"].update(ent.get("type", []))
+                    
+                    # 合并领域相关性 (新增)
+                    merged["domain_relevance"].update(ent.get("domain_relevance", []))
+                    
+                    # 合并摘要信息
+                    merged["summary"].add(ent["summary"])
+                    
+                    # 合并chunk_ids
+                    merged["chunk_ids"].update(ent.get("chunk_ids", []))
+                else:
+                    # 新增实体
+                    entity_kb[key] = {
+                        "entity_name": ent["entity_name"],
+                        "type": _OrderedUnion(ent["type"]),
+                        "domain_relevance": _OrderedUnion(ent.get("domain_relevance", [])),
+                        "summary": summary_accumulator(ent["summary"], summary_max_chars),
+                        "chunk_ids": _OrderedUnion(ent.get("chunk_ids", []))
+                    }
+                    
+        except Exception as e:
+            print(f"处理文件 {filename} 时出错: {e}")
+            continue
+
+    return entity_kb
+
+
+def _load_partial_kb(file_paths: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    进程池中执行：合并一段连续的文件，有序集合转为普通列表后返回（减少进程间序列化开销）。
+    部分知识库中的摘要不限制长度，长度上限在归并时统一施加，保证与串行合并结果一致。
+    """
+    entity_kb = _merge_entity_files(file_paths, summary_max_chars=None)
+    return {
+        key: {
+            "entity_name": merged["entity_name"],
+            "type": merged["type"].items,
+            "domain_relevance": merged["domain_relevance"].items,
+            "summary": merged["summary"].sentences,
+            "chunk_ids": merged["chunk_ids"].items
+        }
+        for key, merged in entity_kb.items()
+    }
+
+
+def _merge_partial_kbs(base: Dict[str, Dict[str, Any]], other: Dict[str, Dict[str, Any]],
+                       summary_max_chars: Optional[int] = DEFAULT_SUMMARY_MAX_CHARS) -> Dict[str, Dict[str, Any]]:
+    """
+    将 other（_load_partial_kb 的结果，对应 base 之后的文件）合并进 base。
+    other 中的列表保持首次出现顺序，逐个 update 与串行处理 other 的原始实体结果相同。
+    """
+    for key, ent in other.items():
+        if key in base:
+            merged = base[key]
+            merged["type"].update(ent["type"])
+            merged["domain_relevance"].update(ent["domain_relevance"])
+            merged["summary"].extend(ent["summary"])
+            merged["chunk_ids"].update(ent["chunk_ids"])
+        else:
+            summary = SummaryAccumulator(summary_max_chars)
+            summary.extend(ent["summary"])
+            base[key] = {
+                "entity_name": ent["entity_name"],
+                "type": _OrderedUnion(ent["type"]),
+                "domain_relevance": _OrderedUnion(ent["domain_relevance"]),
+                "summary": summary,
+                "chunk_ids": _OrderedUnion(ent["chunk_ids"])
+            }
+    return base
+
+
+def _finalize_entity_kb(entity_kb: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """转换为列表格式"""
+    for key, merged in entity_kb.items():
+        entity_kb[key] = {
+            "entity_name": merged["entity_name"],
+            "type": merged["type"].items,
+            "domain_relevance": merged["domain_relevance"].items,
+            "summary": merged["summary"].value(),
+            "chunk_ids": merged["chunk_ids"].items
+        }
+    return entity_kb
+
+
+def merge_entity_knowledge_base(input_dir: str, output_file: str, workers: int = 1,
+                                summary_max_chars: Optional[int] = DEFAULT_SUMMARY_MAX_CHARS,
+                                summary_consolidator: Optional[Any] = None, compact: bool = False) -> Dict[str, Any]:
     """
     合并多个实体文件，构建统一的实体知识库
     
     Args:
         input_dir: 包含实体JSON文件的目录
-        output_file: 输出合并后的知识库文件路径
+        output_file: 输出合并后的知识库文件路径，扩展名为 .jsonl 时输出JSONL
+        workers: 解析文件的进程数；大于1时每个进程合并一段连续的文件，再按顺序归并，结果与串行合并一致
+        summary_max_chars: 每个实体摘要的最大字符数（保留去重后的句子），None 表示不限制
+        summary_consolidator: 可选的 summary_consolidation.LLMSummaryConsolidator，保存前用LLM归纳摘要
+        compact: 输出紧凑格式（每个实体一行），否则与原来的 indent=4 格式相同
         
     Returns:
         合并后的实体知识库字典
     """
     
-    # 初始化实体知识库
-    entity_kb: Dict[str, Dict[str, Any]] = {}
+    file_paths = sorted_range_files(input_dir, prefix="entities_")
     
-    # 遍历目录中的所有JSON文件
-    for filename in os.listdir(input_dir):
-        if filename.startswith("entities_") and filename.endswith(".json"):
-            file_path = os.path.join(input_dir, filename)
-            
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    entities = json.load(f)
-                
-                # 处理每个实体
-                for ent in entities:
-                    key = ent["entity_name"]
-                    
-                    if key in entity_kb:
-                        # 合并实体类型
-                        for type_item in ent.get("type", []):
-                            if type_item not in entity_kb[key]["type"]:
-                                entity_kb[key]["type"].append(type_item)
-                        
-                        # 合并领域相关性 (新增)
-                        for relevance in ent.get("domain_relevance", []):
-                            if relevance not in entity_kb[key]["domain_relevance"]:
-                                entity_kb[key]["domain_relevance"].append(relevance)
-                        
-                        # 合并摘要信息
-                        old_summary = entity_kb[key]["summary"]
-                        new_summary = ent["summary"]
-                        if old_summary != new_summary:
-                            entity_kb[key]["summary"] = f"{old_summary} | {new_summary}".strip()
-                        
-                        # 合并chunk_ids
-                        for chunk_id in ent.get("chunk_ids", []):
-                            if chunk_id not in entity_kb[key]["chunk_ids"]:
-                                entity_kb[key]["chunk_ids"].append(chunk_id)
-                    else:
-                        # 新增实体
-                        entity_kb[key] = {
-                            "entity_name": ent["entity_name"],
-                            "type": ent["type"][:], 
-                            "domain_relevance": ent.get("domain_relevance", [])[:],
-                            "summary": ent["summary"],
-                            "chunk_ids": ent.get("chunk_ids", [])[:]
-                        }
-                        
-            except Exception as e:
-                print(f"处理文件 {filename} 时出错: {e}")
-                continue
+    if workers > 1 and len(file_paths) > 1:
+        # 切片数多于进程数，避免某个进程分到的文件特别大时其余进程空闲
+        slices = split_contiguous(file_paths, workers * 4)
+        entity_kb: Dict[str, Dict[str, Any]] = {}
+        with multiprocessing.Pool(processes=workers) as pool:
+            # imap 按切片顺序返回，归并顺序与文件顺序一致
+            for partial_kb in pool.imap(_load_partial_kb, slices):
+                _merge_partial_kbs(entity_kb, partial_kb, summary_max_chars)
+    else:
+        entity_kb = _merge_entity_files(file_paths, summary_max_chars)
     
-    # 转换为列表格式
+    _finalize_entity_kb(entity_kb)
     final_entities = list(entity_kb.values())
     
+    if summary_consolidator is not None:
+        updated = summary_consolidator.consolidate(final_entities)
+        print(f"LLM 归纳了 {updated} 个实体的摘要")
+    
     # 保存到文件
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(final_entities, f, ensure_ascii=False, indent=4)
+    write_records(output_file, final_entities, compact=compact, indent=4)
     
     print(f"合并完成，共处理 {len(final_entities)} 个唯一实体")
     print(f"结果已保存至: {output_file}")
@@ -92,12 +241,37 @@ def query_entity(entity_kb: Dict[str, Dict[str, Any]], entity_name: str) -> Dict
 
 # 使用示例
 if __name__ == "__main__":
-    # 合并所有实体文件
-    input_directory = "./entities_output"
-    output_file = "./kg_output/entities_kb.json"
+    parser = argparse.ArgumentParser(description='Merge entity files into the entity knowledge base')
+    parser.add_argument('--input_dir', type=str, default="./entities_output", help='Directory of entities_*.json / *.jsonl files')
+    parser.add_argument('--output_file', type=str, default="./kg_output/entities_kb.json",
+                        help='Output knowledge base path (.json, .jsonl or a .kbc columnar directory)')
+    parser.add_argument('--compact', action='store_true', help='Write one compact record per line instead of indented JSON')
+    parser.add_argument('--workers', type=int, default=1, help='Processes used to parse and merge files')
+    parser.add_argument('--summary-max-chars', type=int, default=DEFAULT_SUMMARY_MAX_CHARS,
+                        help='Max summary length per entity (0 = unlimited)')
+    parser.add_argument('--llm-summarize', action='store_true', help='Summarize long entity summaries with the LLM')
+    parser.add_argument('--summary-min-sentences', type=int, default=4,
+                        help='Only summarize entities with at least this many summary sentences')
+    parser.add_argument('--concurrency', type=int, default=4, help='Max concurrent LLM requests for --llm-summarize')
+    parser.add_argument('--endpoints', type=str, default=None, help='Comma-separated vLLM base URLs to load-balance across')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the on-disk LLM response cache')
+    args = parser.parse_args()
+    
+    summary_consolidator = None
+    if args.llm_summarize:
+        from summary_consolidation import LLMSummaryConsolidator
+        summary_consolidator = LLMSummaryConsolidator(
+            max_chars=args.summary_max_chars or DEFAULT_SUMMARY_MAX_CHARS,
+            min_sentences=args.summary_min_sentences,
+            concurrency=args.concurrency,
+            use_cache=not args.no_cache,
+            endpoints=args.endpoints.split(',') if args.endpoints else None,
+        )
     
     # 构建实体知识库
-    entity_knowledge_base = merge_entity_knowledge_base(input_directory, output_file)
+    entity_knowledge_base = merge_entity_knowledge_base(args.input_dir, args.output_file, workers=args.workers,
+                                                        summary_max_chars=args.summary_max_chars or None,
+                                                        summary_consolidator=summary_consolidator, compact=args.compact)
     
     # 示例查询
     test_entities = ["水"]
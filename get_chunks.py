@@ -1,12 +1,18 @@
+import argparse
 import json
 import re
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 from langchain_community.document_loaders import DirectoryLoader
 from langchain_community.document_loaders import UnstructuredMarkdownLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+from token_utils import get_token_counter
+
+# Placeholders produced by ProtectedMarkdownTextSplitter._protect_content
+_PLACEHOLDER_PATTERN = re.compile(r"__(?:FORMULA|TABLE)_\d+__")
+
 
 class ProtectedMarkdownTextSplitter(RecursiveCharacterTextSplitter):
     """
@@ -18,65 +24,120 @@ class ProtectedMarkdownTextSplitter(RecursiveCharacterTextSplitter):
         self,
         protect_formulas: bool = True,
         protect_tables: bool = True,
+        measure_restored: bool = False,
         **kwargs: Any
     ):
         """
         :param protect_formulas: Whether to protect LaTeX formulas ($...$ and $$...$$)
         :param protect_tables: Whether to protect HTML tables (<table>...</table>)
+        :param measure_restored: Measure chunk length on the restored content instead of the placeholders.
+            Required when the length is a token budget, since a short placeholder may stand for a large table.
         :param kwargs: Arguments passed to RecursiveCharacterTextSplitter (e.g., chunk_size, separators)
         """
         super().__init__(**kwargs)
         self.protect_formulas = protect_formulas
         self.protect_tables = protect_tables
+        self._protect_regex = self._build_protect_pattern()
+        self.measure_restored = measure_restored
+        # placeholders of the text currently being split, used by the restored length function
+        self._active_placeholders: Dict[str, str] = {}
+        if measure_restored:
+            base_length_function = self._length_function
+            self._length_function = lambda text: base_length_function(
+                self._restore_content(text, self._active_placeholders)
+            )
 
-    def _protect_content(self, text: str) -> Tuple[str, Dict[str, str]]:
-        """Replace sensitive content with placeholders and return a mapping dict"""
-        placeholders: Dict[str, str] = {}
-        counter = 0
+    @classmethod
+    def from_token_budget(
+        cls,
+        context_window: int,
+        max_output_tokens: int,
+        prompts: Optional[List[Any]] = None,
+        reserve_tokens: int = 0,
+        safety_margin: float = 0.05,
+        tokenizer_path: Optional[str] = None,
+        **kwargs: Any
+    ) -> "ProtectedMarkdownTextSplitter":
+        """
+        Build a splitter whose chunk_size is a token budget.
 
-        def _make_replacer(tag: str):
-            def replacer(match):
-                nonlocal counter
-                key = f"__{tag.upper()}_{counter}__"
-                placeholders[key] = match.group(0)
-                counter += 1
-                return key
-            return replacer
+        chunk_size = context_window - max_output_tokens - max(prompt overhead) - reserve_tokens,
+        shrunk by safety_margin. The prompt overhead is the token count of each template
+        rendered with an empty text, so every chunk fits into any of the given prompts.
 
-        protected_text = text
+        :param context_window: Model context length in tokens (vLLM --max-model-len)
+        :param max_output_tokens: Tokens reserved for the model output
+        :param prompts: PromptTemplates the chunks are sent to; defaults to all extraction prompts
+        :param reserve_tokens: Extra tokens reserved per prompt, e.g. the entity list of the relation prompt
+        :param safety_margin: Fraction of the remaining budget kept free for tokenizer differences
+        :param tokenizer_path: Local tokenizer.json or model directory; falls back to estimation
+        :param kwargs: Arguments passed to the constructor (e.g., chunk_overlap, separators)
+        :return: Splitter with the budget and prompt overhead in token_budget / prompt_overhead_tokens
+        """
+        token_counter = get_token_counter(tokenizer_path)
+        if prompts is None:
+            from prompts import Prompts
+            prompts = [
+                Prompts.get_entity_extraction_prompt()[0],
+                Prompts.get_relation_extraction_prompt()[0],
+                Prompts.get_triple_extraction_prompt()[0],
+            ]
 
-        # 1. Protect LaTeX display formulas $$...$$ (handle first to avoid conflict with inline)
-        if self.protect_formulas:
-            protected_text = re.sub(
-                r'\$\$(.*?)\$\$',
-                _make_replacer("formula"),
-                protected_text,
-                flags=re.DOTALL
-            )
-            # 2. Protect LaTeX inline formulas $...$
-            protected_text = re.sub(
-                r'\$(.*?)\$',
-                _make_replacer("formula"),
-                protected_text
+        overhead = max((cls.prompt_overhead(prompt, token_counter) for prompt in prompts), default=0)
+        budget = int((context_window - max_output_tokens - overhead - reserve_tokens) * (1 - safety_margin))
+        if budget <= 0:
+            raise ValueError(
+                f"No token budget left for chunks: context_window={context_window}, "
+                f"max_output_tokens={max_output_tokens}, prompt overhead={overhead}, reserve={reserve_tokens}"
             )
 
-        # 3. Protect HTML tables
+        kwargs.setdefault("chunk_overlap", min(50, budget // 10))
+        splitter = cls(chunk_size=budget, length_function=token_counter, measure_restored=True, **kwargs)
+        # kept for callers that report how the budget was derived
+        splitter.token_budget = budget
+        splitter.prompt_overhead_tokens = overhead
+        return splitter
+
+    @staticmethod
+    def prompt_overhead(prompt: Any, token_counter: Any) -> int:
+        """Token count of a prompt template rendered with empty variables (fixed cost per call)"""
+        values = {name: "" for name in prompt.input_variables}
+        values.update(chunk_id=0)
+        return token_counter(prompt.format(**values))
+
+    def _build_protect_pattern(self) -> Optional["re.Pattern[str]"]:
+        """Combined pattern of all enabled protected regions, matched in a single left-to-right pass"""
+        parts = []
+        if self.protect_formulas:
+            # display formulas first so that $$...$$ is not taken as an empty inline formula;
+            # inline formulas do not span lines
+            parts.append(r'\$\$.*?\$\$')
+            parts.append(r'\$[^\n]*?\$')
         if self.protect_tables:
-            protected_text = re.sub(
-                r'<table\b[^>]*>.*?</table>',
-                _make_replacer("table"),
-                protected_text,
-                flags=re.DOTALL | re.IGNORECASE
-            )
+            parts.append(r'<table\b[^>]*>.*?</table>')
+        return re.compile("|".join(parts), flags=re.DOTALL | re.IGNORECASE) if parts else None
 
-        return protected_text, placeholders
+    def _protect_content(self, text: str) -> Tuple[str, Dict[str, str]]:
+        """Replace sensitive content with placeholders and return a mapping dict"""
+        placeholders: Dict[str, str] = {}
+        if self._protect_regex is None:
+            return text, placeholders
+
+        # A table is kept verbatim together with the formulas inside it, so restoring never nests
+        def replacer(match):
+            original = match.group(0)
+            tag = "FORMULA" if original.startswith("$") else "TABLE"
+            key = f"__{tag}_{len(placeholders)}__"
+            placeholders[key] = original
+            return key
+
+        return self._protect_regex.sub(replacer, text), placeholders
 
     def _restore_content(self, text: str, placeholders: Dict[str, str]) -> str:
         """Restore placeholders back to the original content"""
-        restored = text
-        for placeholder, original in placeholders.items():
-            restored = restored.replace(placeholder, original)
-        return restored
+        if not placeholders or "__" not in text:
+            return text
+        return _PLACEHOLDER_PATTERN.sub(lambda m: placeholders.get(m.group(0), m.group(0)), text)
 
     def split_text(self, text: str) -> List[str]:
         """
@@ -86,7 +147,13 @@ class ProtectedMarkdownTextSplitter(RecursiveCharacterTextSplitter):
         clean_text, placeholders = self._protect_content(text)
 
         # 2. Use parent class logic to split the cleaned text
-        clean_chunks = super().split_text(clean_text)
+        # split_documents calls split_text on already protected text, keep the outer placeholders visible
+        outer_placeholders = self._active_placeholders
+        self._active_placeholders = {**outer_placeholders, **placeholders}
+        try:
+            clean_chunks = super().split_text(clean_text)
+        finally:
+            self._active_placeholders = outer_placeholders
 
         # 3. Restore each chunk
         restored_chunks = [
@@ -103,7 +170,11 @@ class ProtectedMarkdownTextSplitter(RecursiveCharacterTextSplitter):
         for doc in documents:
             clean_text, placeholders = self._protect_content(doc.page_content)
             temp_doc = Document(page_content=clean_text, metadata=doc.metadata)
-            clean_chunks = super().split_documents([temp_doc])
+            self._active_placeholders = placeholders
+            try:
+                clean_chunks = super().split_documents([temp_doc])
+            finally:
+                self._active_placeholders = {}
             for chunk in clean_chunks:
                 restored_content = self._restore_content(chunk.page_content, placeholders)
                 chunks.append(Document(
@@ -113,8 +184,22 @@ class ProtectedMarkdownTextSplitter(RecursiveCharacterTextSplitter):
         return chunks
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Split Markdown documents into chunks')
+    parser.add_argument('--input_dir', type=str, default="./data", help='Directory of Markdown documents')
+    parser.add_argument('--output_file', type=str, default="./chunks_output/relation_chunks.jsonl", help='Output JSONL file path')
+    parser.add_argument('--chunk-size', type=int, default=512, help='Chunk size in characters (ignored with --context-window)')
+    parser.add_argument('--chunk-overlap', type=int, default=None, help='Chunk overlap (characters, or tokens with --context-window)')
+    parser.add_argument('--context-window', type=int, default=None,
+                        help='Model context length in tokens; enables token-budget chunking')
+    parser.add_argument('--max-output-tokens', type=int, default=2048, help='Tokens reserved for the model output')
+    parser.add_argument('--entity-token-budget', type=int, default=0,
+                        help='Tokens reserved for the entity list of the relation prompt')
+    parser.add_argument('--tokenizer', type=str, default=None,
+                        help='Local tokenizer.json or model directory (default: $QWEN_TOKENIZER_PATH, else estimation)')
+    args = parser.parse_args()
+
     loader = DirectoryLoader(
-        path="./data",
+        path=args.input_dir,
         glob="**/*.md",
         loader_cls=UnstructuredMarkdownLoader,
         loader_kwargs={"encoding": "utf-8"}
@@ -124,28 +209,43 @@ if __name__ == "__main__":
     print(f"共加载 {len(docs)} 个文档")
 
     # 2. Use RecursiveCharacterTextSplitter with separators optimized for Markdown
-    splitter = ProtectedMarkdownTextSplitter(
-        chunk_size=512,
-        chunk_overlap=50,
-        separators=[
-            "\n\n",        
-            "\n# ", "\n## ", "\n### ", "\n####",
-            "\n",
-            "。", "！", "？", "；",        
-            " ",           
-            ""             
-        ],
-        length_function=len,
-        is_separator_regex=False
-    )
+    separators = [
+        "\n\n",        
+        "\n# ", "\n## ", "\n### ", "\n####",
+        "\n",
+        "。", "！", "？", "；",        
+        " ",           
+        ""             
+    ]
+    if args.context_window:
+        # chunk_size is a token budget derived from the context window and the prompt templates
+        overlap_kwargs = {} if args.chunk_overlap is None else {"chunk_overlap": args.chunk_overlap}
+        splitter = ProtectedMarkdownTextSplitter.from_token_budget(
+            context_window=args.context_window,
+            max_output_tokens=args.max_output_tokens,
+            reserve_tokens=args.entity_token_budget,
+            tokenizer_path=args.tokenizer,
+            separators=separators,
+            is_separator_regex=False,
+            **overlap_kwargs
+        )
+        print(f"Token budget per chunk: {splitter.token_budget} "
+              f"(prompt overhead {splitter.prompt_overhead_tokens}, reserve {args.entity_token_budget})")
+    else:
+        splitter = ProtectedMarkdownTextSplitter(
+            chunk_size=args.chunk_size,
+            chunk_overlap=50 if args.chunk_overlap is None else args.chunk_overlap,
+            separators=separators,
+            length_function=len,
+            is_separator_regex=False
+        )
 
     # 3. Split documents
     chunks = splitter.split_documents(docs)
 
     # 4. Get JSON output
-    output_dir = Path("./chunks_output")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    output_file = output_dir / "relation_chunks.jsonl"
+    output_file = Path(args.output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
     
     with output_file.open("w", encoding="utf-8") as f:
         for index, chunk in enumerate(chunks):
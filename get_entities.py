@@ -11,7 +11,11 @@ from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableSequence
 
 from prompts import Prompts, Entity
-from llm_model import VLLMModel
+from llm_model import ADAPTIVE_CLIENT_MAX_RETRIES, VLLMModel, AdaptiveConcurrencyController
+from llm_cache import build_llm_cache, DEFAULT_CACHE_FILE
+from async_runner import iter_chain_results
+from chunk_journal import load_range_journal, range_file, remove_superseded_range_files
+from summary_consolidation import summary_accumulator, finalize_summaries, DEFAULT_SUMMARY_MAX_CHARS
 from tqdm import tqdm
 
 class EntityExtractor:
@@ -21,12 +25,28 @@ class EntityExtractor:
     Output: entities for knowledge graph construction.
     """
     
-    def __init__(self, log_dir: str = "logs", log_level: int = logging.INFO):
-        self.model = VLLMModel().get_local_model()
+    def __init__(self, log_dir: str = "logs", log_level: int = logging.INFO, use_cache: bool = True,
+                 cache_file: str = DEFAULT_CACHE_FILE, refresh_cache: bool = False,
+                 endpoints: Optional[List[str]] = None, summary_max_chars: Optional[int] = DEFAULT_SUMMARY_MAX_CHARS,
+                 llm_max_retries: Optional[int] = None):
         self.log_dir = log_dir
+        self.summary_max_chars = summary_max_chars
         os.makedirs(log_dir, exist_ok=True)
         self._setup_logger(log_level)
         
+        self.llm_cache = build_llm_cache(use_cache, cache_file, refresh_cache)
+        # 在自适应并发控制器下运行时传入 ADAPTIVE_CLIENT_MAX_RETRIES，不传时使用客户端的默认重试次数
+        retry_kwargs = {} if llm_max_retries is None else {"max_retries": llm_max_retries}
+        if endpoints:
+            # 多个vLLM副本时使用负载均衡连接池
+            self.model = VLLMModel().get_pooled_model(endpoints, cache=self.llm_cache, **retry_kwargs)
+        else:
+            self.model = VLLMModel().get_local_model(cache=self.llm_cache, **retry_kwargs)
+        
+        # 最近一次调用中处理完成/失败的chunk，供批处理驱动记录进度
+        self.completed_chunks: List[int] = []
+        self.failed_chunks: List[Dict[str, Any]] = []
+        
         self.prompt, self.parser = Prompts.get_entity_extraction_prompt()
         self.entity_extraction_chain: RunnableSequence = self.prompt | self.model
         
@@ -116,12 +136,41 @@ class EntityExtractor:
                 continue
                 
         return entities
+    
+    def _merge_entities(self, entity_kb: Dict[str, Dict[str, Any]], cleaned_entities: List[Dict[str, Any]], meta_data: Any) -> None:
+        """
+        Merge the entities extracted from one chunk into entity_kb.
+        Summaries stay SummaryAccumulator objects until finalize_summaries is called on output.
+        """
+        for ent in cleaned_entities:
+            key = ent["entity_name"]
+            if key in entity_kb:
+                if ent["type"] not in entity_kb[key]["type"]:
+                    entity_kb[key]["type"].append(ent["type"])
+                new_relevance = ent["domain_relevance"]
+                # 去重后的句子集合，长度有上限
+                entity_kb[key]["summary"].add(ent["summary"])
+                if meta_data not in entity_kb[key]["chunk_ids"]:
+                    entity_kb[key]["chunk_ids"].append(meta_data)
+                if new_relevance not in entity_kb[key]["domain_relevance"]:
+                    entity_kb[key]["domain_relevance"].append(new_relevance)
+            else:
+                entity_kb[key] = {
+                    "entity_name": ent["entity_name"],
+                    "type": [ent["type"]],
+                    "domain_relevance": [ent["domain_relevance"]],
+                    "summary": summary_accumulator(ent["summary"], self.summary_max_chars),
+                    "chunk_ids": [meta_data],
+                }
+    
     def extract_entities_from_range(
         self,
         input_file: str,
         output_dir: Optional[str] = None,
         start_index: int = 0,
-        end_index: Optional[int] = None
+        end_index: Optional[int] = None,
+        concurrency: int = 1,
+        controller: Optional[AdaptiveConcurrencyController] = None
     ) -> List[Dict[str, Any]]:
         """
         Extract entities from a specified range of chunks in the input JSONL file.
@@ -131,14 +180,22 @@ class EntityExtractor:
             output_dir (Optional[str]): Directory to save the extracted entities.
             start_index (int): Starting chunk index (inclusive).
             end_index (Optional[int]): Ending chunk index (exclusive).
+            concurrency (int): Max number of in-flight LLM requests. Results are
+                still merged in chunk order, so the output matches a sequential run.
+            controller (Optional[AdaptiveConcurrencyController]): If given, the number of
+                in-flight requests follows the controller's AIMD window instead of concurrency.
+        
+        Per-chunk results are appended to a JSONL journal in output_dir and the
+        merged JSON is written once at the end. Re-running replays the journal of
+        this range and of any overlapping earlier range (e.g. a different end_index
+        or batch size) and skips chunks that were already processed; earlier output
+        files fully covered by this range are removed.
         """
         
         self.logger.info(f"Loading chunks from {input_file}")
         if not os.path.exists(input_file):
             raise FileNotFoundError(f"Input file {input_file} does not exist.")
         
-        previous_entities_file = None
-        
         # 读取指定范围的chunks
         chunks = []
         with jsonlines.open(input_file, mode='r') as reader:
@@ -158,85 +215,85 @@ class EntityExtractor:
         
         # 初始化结果存储
         entity_kb: Dict[str, Dict[str, Any]] = {}
+        self.completed_chunks = []
+        self.failed_chunks = []
         
-        # 处理chunks
-        for index_in_range, chunk in enumerate(tqdm(chunks, desc=f"Processing chunks {start_index}-{actual_end_index}", unit="chunk")):
+        # 过滤空chunk，构造LLM输入
+        tasks = []
+        for index_in_range, chunk in enumerate(chunks):
             global_index = start_index + index_in_range
             content = chunk.get("chunk_content", "").strip()
             meta_data = chunk.get("metadata", global_index)
-            source = chunk.get("source", "")
             
             if not content:
                 self.logger.warning(f"Chunk {global_index} is empty, skipping.")
+                self.completed_chunks.append(global_index)
                 continue
+            
+            tasks.append(((global_index, meta_data), {"text": content, "chunk_id": meta_data}))
+        
+        # 回放预写日志，已完成的chunk不再请求LLM
+        journal = None
+        completed: Dict[int, Dict[str, Any]] = {}
+        if output_dir:
+            journal, completed = load_range_journal(output_dir, "entities", start_index, actual_end_index)
+            if completed:
+                self.logger.info(f"Resuming from {journal.journal_file}: {len(completed)} chunks already processed")
+        
+        if controller is not None:
+            self.logger.info(f"Running with adaptive concurrency (window {controller.window}, max {controller.max_limit})")
+        elif concurrency > 1:
+            self.logger.info(f"Running with concurrency {concurrency}")
+        
+        # 处理chunks，结果按chunk顺序返回
+        pending = [task for task in tasks if task[0][0] not in completed]
+        results = iter_chain_results(self.entity_extraction_chain, pending, concurrency, controller)
+        try:
+            for (global_index, meta_data), _ in tqdm(tasks, desc=f"Processing chunks {start_index}-{actual_end_index}", unit="chunk"):
+                if global_index in completed:
+                    self._merge_entities(entity_kb, completed[global_index]["entities"], meta_data)
+                    self.completed_chunks.append(global_index)
+                    continue
                 
-            try:
-                raw_output = self.entity_extraction_chain.invoke(
-                    {"text": content, "chunk_id": meta_data}
-                )
-                
-                cleaned_entities = self._cleaned_parser(raw_output.content, str(meta_data))
-                self.logger.info(f"Chunk {global_index} extracted {len(cleaned_entities)} entities.")
-                
-                # 处理实体
-                for ent in cleaned_entities:
-                    key = ent["entity_name"]
-                    if key in entity_kb:
-                        if ent["type"] not in entity_kb[key]["type"]:
-                            entity_kb[key]["type"].append(ent["type"])
-                        old_summary = entity_kb[key]["summary"]
-                        new_summary = ent["summary"]
-                        new_relevance = ent["domain_relevance"]
-                        if old_summary != new_summary:
-                            entity_kb[key]["summary"] = f"{old_summary} | {new_summary}".strip()
-                        if meta_data not in entity_kb[key]["chunk_ids"]:
-                            entity_kb[key]["chunk_ids"].append(meta_data)
-                        if new_relevance not in entity_kb[key]["domain_relevance"]:
-                            entity_kb[key]["domain_relevance"].append(new_relevance)
-                    else:
-                        entity_kb[key] = {
-                            "entity_name": ent["entity_name"],
-                            "type": [ent["type"]],
-                            "domain_relevance": [ent["domain_relevance"]],
-                            "summary": ent["summary"],
-                            "chunk_ids": [meta_data],
-                        }
-                
-                self.logger.debug(f"Chunk {global_index} processed successfully.")
-                
-                # 保存中间结果
-                if output_dir:
-                    os.makedirs(output_dir, exist_ok=True)
-                    current_entities_file = os.path.join(output_dir, f"entities_{start_index}_{global_index}.json")
+                _, raw_output, error = next(results)
+                try:
+                    if error is not None:
+                        raise error
                     
-                    current_entities = list(entity_kb.values())
+                    cleaned_entities = self._cleaned_parser(raw_output.content, str(meta_data))
+                    self.logger.info(f"Chunk {global_index} extracted {len(cleaned_entities)} entities.")
                     
-                    with open(current_entities_file, "w", encoding="utf-8") as f:
-                        json.dump(current_entities, f, ensure_ascii=False, indent=4)
-                        
-                    # 删除上一个保存的文件
-                    if previous_entities_file and os.path.exists(previous_entities_file):
-                        os.remove(previous_entities_file)
-                        self.logger.debug(f"Removed previous entities file: {previous_entities_file}")
+                    # 先写日志再合并，崩溃后可从日志恢复
+                    if journal:
+                        journal.append({"index": global_index, "chunk_id": meta_data, "entities": cleaned_entities})
                     
-                    # 更新previous文件名
-                    previous_entities_file = current_entities_file
-                    self.logger.debug(f"Saved current results to {current_entities_file}")
-                
-            except Exception as e:
-                self.logger.error(f"Error processing chunk {global_index}: {e}")
-                continue
+                    # 处理实体
+                    self._merge_entities(entity_kb, cleaned_entities, meta_data)
+                    self.completed_chunks.append(global_index)
+                    
+                    self.logger.debug(f"Chunk {global_index} processed successfully.")
+                    
+                except Exception as e:
+                    self.logger.error(f"Error processing chunk {global_index}: {e}")
+                    self.failed_chunks.append({"index": global_index, "chunk_id": meta_data, "error": repr(e)})
+                    continue
+        finally:
+            if journal:
+                journal.close()
         
-        final_entities = list(entity_kb.values())
+        final_entities = finalize_summaries(entity_kb.values())
         self.logger.info(f"Extracted total {len(final_entities)} unique entities from chunks {start_index}-{actual_end_index}.")
         
         # 保存结果，文件名包含处理的chunk范围
         if output_dir:
             os.makedirs(output_dir, exist_ok=True)
-            entities_file = os.path.join(output_dir, f"entities_{start_index}_{actual_end_index}.json")
+            entities_file = range_file(output_dir, "entities", start_index, actual_end_index, ".json")
             
             with open(entities_file, "w", encoding="utf-8") as f:
                 json.dump(final_entities, f, ensure_ascii=False, indent=4)
+            
+            # 之前用较小范围写出的结果已全部包含在本文件中
+            remove_superseded_range_files(output_dir, "entities", start_index, actual_end_index, self.completed_chunks)
         
         return final_entities
 
@@ -257,6 +314,16 @@ class EntityExtractor:
                 count += 1
         return count
 
+
+def add_entity_arguments(parser: Any) -> None:
+    """
+    实体抽取特有的命令行参数，get_entities.py 与 batch_driver.py 共用。
+    parser 可以是 ArgumentParser 或 argument group。
+    """
+    parser.add_argument('--summary-max-chars', type=int, default=DEFAULT_SUMMARY_MAX_CHARS,
+                        help='Max merged summary length per entity (0 = unlimited)')
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Extract entities from text chunks')
     parser.add_argument('--start', type=int, default=0, help='Start chunk index (inclusive)')
@@ -266,10 +333,23 @@ if __name__ == "__main__":
     parser.add_argument('--output_dir', type=str, default="./entities_output", 
                        help='Output directory path')
     parser.add_argument('--batch-size', type=int, default=10, help='Batch size for processing')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the on-disk LLM response cache')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached responses and overwrite them with fresh ones')
+    parser.add_argument('--cache_file', type=str, default=DEFAULT_CACHE_FILE, help='LLM response cache file path')
+    parser.add_argument('--endpoints', type=str, default=None, help='Comma-separated vLLM base URLs to load-balance across')
+    parser.add_argument('--concurrency', type=int, default=1, help='Max concurrent LLM requests (1 = sequential)')
+    add_entity_arguments(parser)
+    parser.add_argument('--adaptive', action='store_true', help='Adapt concurrency to server load, starting from --concurrency')
+    parser.add_argument('--max-concurrency', type=int, default=64, help='Upper bound of the adaptive concurrency window')
     
     args = parser.parse_args()
     
-    extractor = EntityExtractor(log_level=logging.INFO)
+    extractor = EntityExtractor(log_level=logging.INFO, use_cache=not args.no_cache, cache_file=args.cache_file, refresh_cache=args.refresh, endpoints=args.endpoints.split(',') if args.endpoints else None, summary_max_chars=args.summary_max_chars or None,
+                                llm_max_retries=ADAPTIVE_CLIENT_MAX_RETRIES if args.adaptive else None)
+
+    controller = None
+    if args.adaptive:
+        controller = VLLMModel().get_concurrency_controller(initial_limit=args.concurrency, max_limit=args.max_concurrency)
 
     # 如果没有指定end参数，则处理从start开始的batch-size个chunks
     if args.end is None:
@@ -279,8 +359,14 @@ if __name__ == "__main__":
         input_file=args.input_file,
         output_dir=args.output_dir,
         start_index=args.start,
-        end_index=args.end
+        end_index=args.end,
+        concurrency=args.concurrency,
+        controller=controller
     )
     
     extractor.logger.info(f"Entity extraction completed for chunks {args.start}-{args.end-1}.")
-    extractor.logger.info(f"Extracted {len(entities)} entities.")
\ No newline at end of file
+    extractor.logger.info(f"Extracted {len(entities)} entities.")
+    if extractor.llm_cache is not None:
+        extractor.logger.info(f"LLM cache stats: {extractor.llm_cache.stats()}")
+    if controller is not None:
+        extractor.logger.info(f"Concurrency controller stats: {controller.stats()}")
\ No newline at end of file
@@ -14,9 +14,13 @@ from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableSequence
 
 from prompts import Prompts, Triple
-from llm_model import VLLMModel
+from llm_model import ADAPTIVE_CLIENT_MAX_RETRIES, VLLMModel, AdaptiveConcurrencyController
+from llm_cache import build_llm_cache, DEFAULT_CACHE_FILE
 from tqdm import tqdm
-from ac_automaton import ACEntityMatcher
+from ac_automaton import ACEntityMatcher, ENTITY_CONTEXT_MODES, ENTITY_MATCH_MODES, ENTITY_RANK_MODES, check_mention_index, load_mention_index
+from token_utils import count_tokens
+from async_runner import iter_chain_results
+from chunk_journal import load_range_journal, range_file, remove_superseded_range_files
 
 class RelationExtractor:
     """
@@ -25,17 +29,50 @@ class RelationExtractor:
     Output: triples for knowledge graph construction.
     """
     
-    def __init__(self, log_dir: str = "logs", log_level: int = logging.INFO, entities_file: str="./kg_output/entities_kb.json"):
-        self.model = VLLMModel().get_local_model()
-        # self.model = VLLMModel().get_model()
+    def __init__(self, log_dir: str = "logs", log_level: int = logging.INFO, entities_file: str="./kg_output/entities_kb.json",
+                 use_cache: bool = True, cache_file: str = DEFAULT_CACHE_FILE, refresh_cache: bool = False,
+                 endpoints: Optional[List[str]] = None, entity_context: str = "full", entity_summary_chars: int = 100,
+                 entity_token_budget: Optional[int] = None, automaton_cache: bool = True,
+                 entity_match_mode: str = "all", entity_rank: str = "first", mention_index: Optional[str] = None,
+                 llm_max_retries: Optional[int] = None):
         self.log_dir = log_dir
         os.makedirs(log_dir, exist_ok=True)
         self._setup_logger(log_level)
         
+        self.llm_cache = build_llm_cache(use_cache, cache_file, refresh_cache)
+        # 在自适应并发控制器下运行时传入 ADAPTIVE_CLIENT_MAX_RETRIES，不传时使用客户端的默认重试次数
+        retry_kwargs = {} if llm_max_retries is None else {"max_retries": llm_max_retries}
+        if endpoints:
+            # 多个vLLM副本时使用负载均衡连接池
+            self.model = VLLMModel().get_pooled_model(endpoints, cache=self.llm_cache, **retry_kwargs)
+        else:
+            self.model = VLLMModel().get_local_model(cache=self.llm_cache, **retry_kwargs)
+        # self.model = VLLMModel().get_model(cache=self.llm_cache)
+        
         self.prompt, self.parser = Prompts.get_relation_extraction_prompt()
         self.extraction_chain: RunnableSequence = self.prompt | self.model
         
-        self.entity_matcher = ACEntityMatcher(entities_file=entities_file)
+        # 实体库未变化时从磁盘缓存载入AC自动机，见 ACEntityMatcher._load_cache
+        self.entity_matcher = ACEntityMatcher(entities_file=entities_file, use_cache=automaton_cache)
+        # 注入prompt的实体上下文渲染方式，见 ACEntityMatcher.render_entity_context
+        if entity_context not in ENTITY_CONTEXT_MODES:
+            raise ValueError(f"Unknown entity context mode: {entity_context}")
+        self.entity_context = entity_context
+        self.entity_summary_chars = entity_summary_chars
+        self.entity_token_budget = entity_token_budget
+        # 实体匹配与排序方式，见 ACEntityMatcher.match_entities
+        if entity_match_mode not in ENTITY_MATCH_MODES:
+            raise ValueError(f"Unknown entity match mode: {entity_match_mode}")
+        if entity_rank not in ENTITY_RANK_MODES:
+            raise ValueError(f"Unknown entity rank mode: {entity_rank}")
+        self.entity_match_mode = entity_match_mode
+        self.entity_rank = entity_rank
+        # 预先生成的 chunk -> 实体提及 索引（python ac_automaton.py --mention-index），提供时不再逐chunk匹配
+        self.mention_index = mention_index
+        # 最近一次调用中处理完成/失败的chunk，供批处理驱动记录进度
+        self.completed_chunks: List[int] = []
+        self.failed_chunks: List[Dict[str, Any]] = []
+        self.prompt_token_stats: Dict[str, int] = {"before": 0, "after": 0}
         
         
     def _setup_logger(self, level: int):
@@ -122,13 +159,38 @@ class RelationExtractor:
                 
         return triples
     
+    def _render_entities(self, content: str, meta_data: Any, entities_data: List[Dict[str, Any]], global_index: int) -> Any:
+        """
+        Render matched entities for the {entities} prompt variable and log the
+        prompt token count before (full entity dicts) and after compaction.
+        """
+        if self.entity_context == "full" and self.entity_token_budget is None:
+            # 保持与原来完全相同的prompt
+            return entities_data
+        
+        entities_context = self.entity_matcher.render_entity_context(
+            entities_data,
+            mode=self.entity_context,
+            summary_chars=self.entity_summary_chars,
+            max_tokens=self.entity_token_budget
+        )
+        
+        tokens_before = count_tokens(self.prompt.format(text=content, chunk_id=meta_data, entities=entities_data))
+        tokens_after = count_tokens(self.prompt.format(text=content, chunk_id=meta_data, entities=entities_context))
+        self.prompt_token_stats["before"] += tokens_before
+        self.prompt_token_stats["after"] += tokens_after
+        self.logger.info(f"Chunk {global_index} prompt tokens: {tokens_before} -> {tokens_after}")
+        return entities_context
+    
     def extract_relations_from_range(
         self,
         input_file: str,
         entities_file: str,
         output_dir: Optional[str] = None,
         start_index: int = 0,
-        end_index: Optional[int] = None
+        end_index: Optional[int] = None,
+        concurrency: int = 1,
+        controller: Optional[AdaptiveConcurrencyController] = None
     ) -> List[Dict[str, Any]]:
         """
         Extract triples from a specified range of chunks using pre-extracted entities.
@@ -139,6 +201,16 @@ class RelationExtractor:
             output_dir (Optional[str]): Directory to save the extracted triples.
             start_index (int): Starting chunk index (inclusive).
             end_index (Optional[int]): Ending chunk index (exclusive).
+            concurrency (int): Max number of in-flight LLM requests. Triples are
+                still collected in chunk order; failed chunks are kept in self.failed_chunks.
+            controller (Optional[AdaptiveConcurrencyController]): If given, the number of
+                in-flight requests follows the controller's AIMD window instead of concurrency.
+        
+        Per-chunk results are appended to a JSONL journal in output_dir and the
+        merged JSON is written once at the end. Re-running replays the journal of
+        this range and of any overlapping earlier range (e.g. a different end_index
+        or batch size) and skips chunks that were already processed; earlier output
+        files fully covered by this range are removed.
         """
         
         self.logger.info(f"Loading chunks from {input_file}")
@@ -149,15 +221,8 @@ class RelationExtractor:
         if not os.path.exists(entities_file):
             raise FileNotFoundError(f"Entities file {entities_file} does not exist.")
         
-        # 加载预提取的实体
-        with open(entities_file, "r", encoding="utf-8") as f:
-            entities_data = json.load(f)
-        
-        # 创建实体字典以便快速查找
-        entity_dict = {entity["entity_name"]: entity for entity in entities_data}
-        self.logger.info(f"Loaded {len(entity_dict)} entities for relation extraction")
-        
-        previous_triples_file = None
+        # 实体已在初始化时加载到AC自动机中，这里不再重复读取实体文件
+        self.logger.info(f"Using {len(self.entity_matcher.entity_dict)} entities for relation extraction")
         
         # 读取指定范围的chunks
         chunks = []
@@ -178,80 +243,168 @@ class RelationExtractor:
         
         # 初始化结果存储
         triple_kb: List[Dict[str, Any]] = []
+        self.completed_chunks = []
+        self.failed_chunks = []
+        self.prompt_token_stats = {"before": 0, "after": 0}
         
-        # 处理chunks
-        for index_in_range, chunk in enumerate(tqdm(chunks, desc=f"Processing chunks {start_index}-{actual_end_index} for relations", unit="chunk")):
+        # 回放预写日志，已完成的chunk不再请求LLM
+        journal = None
+        completed: Dict[int, Dict[str, Any]] = {}
+        if output_dir:
+            journal, completed = load_range_journal(output_dir, "triples", start_index, actual_end_index)
+            if completed:
+                self.logger.info(f"Resuming from {journal.journal_file}: {len(completed)} chunks already processed")
+        
+        mentions: Optional[Dict[int, List[str]]] = None
+        if self.mention_index:
+            # 索引与当前的 chunks 文件、实体库或匹配参数不一致时重新生成，不使用过期的实体
+            reason = check_mention_index(self.mention_index, input_file, self.entity_matcher.entities_file,
+                                         self.entity_match_mode, self.entity_rank)
+            if reason:
+                self.logger.warning(f"Mention index {self.mention_index} cannot be used ({reason}); rebuilding it")
+                self.entity_matcher.build_mention_index(input_file, self.mention_index, mode=self.entity_match_mode,
+                                                        rank=self.entity_rank)
+            _, mentions = load_mention_index(self.mention_index, start_index, start_index + len(chunks))
+            self.logger.info(f"Loaded entity mentions for {len(mentions)} chunks from {self.mention_index}")
+        
+        # 匹配实体并构造LLM输入
+        tasks = []
+        for index_in_range, chunk in enumerate(chunks):
             global_index = start_index + index_in_range
             content = chunk.get("chunk_content", "").strip()
             meta_data = chunk.get("metadata", global_index)
-            source = chunk.get("source", "")
             
             if not content:
                 self.logger.warning(f"Chunk {global_index} is empty, skipping.")
+                self.completed_chunks.append(global_index)
                 continue
+            
+            if global_index in completed:
+                tasks.append(((global_index, meta_data), None))
+                continue
+            
+            if mentions is not None and global_index in mentions:
+                entity_dict = self.entity_matcher.entity_dict
+                entities_data = [entity_dict[name] for name in mentions[global_index] if name in entity_dict]
+            else:
+                entities_data = self.entity_matcher.match_entities(content, mode=self.entity_match_mode, rank=self.entity_rank)
+            self.logger.info(f"Chunk {global_index} matched {len(entities_data)} entities.")
+            entities_context = self._render_entities(content, meta_data, entities_data, global_index)
+            tasks.append(((global_index, meta_data), {"text": content, "chunk_id": meta_data, "entities": entities_context}))
+        
+        if self.prompt_token_stats["before"]:
+            before, after = self.prompt_token_stats["before"], self.prompt_token_stats["after"]
+            self.logger.info(f"Entity context '{self.entity_context}' prompt tokens: {before} -> {after} "
+                             f"({(1 - after / before) * 100:.1f}% saved)")
+        
+        if controller is not None:
+            self.logger.info(f"Running with adaptive concurrency (window {controller.window}, max {controller.max_limit})")
+        elif concurrency > 1:
+            self.logger.info(f"Running with concurrency {concurrency}")
+        
+        # 处理chunks，结果按chunk顺序返回
+        pending = [task for task in tasks if task[0][0] not in completed]
+        results = iter_chain_results(self.extraction_chain, pending, concurrency, controller)
+        try:
+            for (global_index, meta_data), _ in tqdm(tasks, desc=f"Processing chunks {start_index}-{actual_end_index} for relations", unit="chunk"):
+                if global_index in completed:
+                    triple_kb.extend(completed[global_index]["triples"])
+                    self.completed_chunks.append(global_index)
+                    continue
                 
-            try:
-                entities_data = self.entity_matcher.match_entities(content)
-                self.logger.info(f"Chunk {global_index} matched {len(entities_data)} entities.")
-                
-                raw_output = self.extraction_chain.invoke(
-                    {"text": content, "chunk_id": meta_data, "entities": entities_data}
-                )
-                
-                cleaned_triples = self._cleaned_parser(raw_output.content, str(meta_data))
-                self.logger.info(f"Chunk {global_index} extracted {len(cleaned_triples)} triples.")
-                
-                # 收集三元组
-                triple_kb.extend(cleaned_triples)
-                
-                # 保存中间结果
-                if output_dir:
-                    os.makedirs(output_dir, exist_ok=True)
-                    current_triples_file = os.path.join(output_dir, f"triples_{start_index}_{global_index}.json")
+                _, raw_output, error = next(results)
+                try:
+                    if error is not None:
+                        raise error
                     
-                    with open(current_triples_file, "w", encoding="utf-8") as f:
-                        json.dump(triple_kb, f, ensure_ascii=False, indent=4)
-                        
-                    # 删除上一个保存的文件
-                    if previous_triples_file and os.path.exists(previous_triples_file):
-                        os.remove(previous_triples_file)
-                        self.logger.debug(f"Removed previous triples file: {previous_triples_file}")
+                    cleaned_triples = self._cleaned_parser(raw_output.content, str(meta_data))
+                    self.logger.info(f"Chunk {global_index} extracted {len(cleaned_triples)} triples.")
                     
-                    # 更新previous文件名
-                    previous_triples_file = current_triples_file
-                    self.logger.debug(f"Saved current results to {current_triples_file}")
-                
-            except Exception as e:
-                self.logger.error(f"Error processing chunk {global_index}: {e}")
-                continue
+                    # 先写日志再收集，崩溃后可从日志恢复
+                    if journal:
+                        journal.append({"index": global_index, "chunk_id": meta_data, "triples": cleaned_triples})
+                    
+                    # 收集三元组
+                    triple_kb.extend(cleaned_triples)
+                    self.completed_chunks.append(global_index)
+                    
+                except Exception as e:
+                    self.logger.error(f"Error processing chunk {global_index}: {e}")
+                    self.failed_chunks.append({"index": global_index, "chunk_id": meta_data, "error": repr(e)})
+                    continue
+        finally:
+            if journal:
+                journal.close()
+        
+        if self.failed_chunks:
+            failed_indexes = [item["index"] for item in self.failed_chunks]
+            self.logger.warning(f"{len(self.failed_chunks)} chunks failed: {failed_indexes}")
         
         self.logger.info(f"Extracted total {len(triple_kb)} triples from chunks {start_index}-{actual_end_index}.")
         
         # 保存结果，文件名包含处理的chunk范围
         if output_dir:
             os.makedirs(output_dir, exist_ok=True)
-            triples_file = os.path.join(output_dir, f"triples_{start_index}_{actual_end_index}.json")
+            triples_file = range_file(output_dir, "triples", start_index, actual_end_index, ".json")
             
             with open(triples_file, "w", encoding="utf-8") as f:
                 json.dump(triple_kb, f, ensure_ascii=False, indent=4)
+            
+            # 之前用较小范围写出的结果已全部包含在本文件中
+            remove_superseded_range_files(output_dir, "triples", start_index, actual_end_index, self.completed_chunks)
         
         return triple_kb
 
+
+def add_relation_arguments(parser: Any) -> None:
+    """
+    关系抽取特有的命令行参数（实体库、实体匹配与提示词中的实体列表），get_relations.py 与 batch_driver.py 共用。
+    parser 可以是 ArgumentParser 或 argument group。
+    """
+    parser.add_argument('--entities_file', type=str, default="./kg_output/entities_kb.json",
+                       help='Path to pre-extracted entities file (JSON array or JSONL)')
+    parser.add_argument('--no-automaton-cache', action='store_true', help='Rebuild the entity automaton instead of loading the cached one')
+    parser.add_argument('--match-mode', type=str, default="all", choices=ENTITY_MATCH_MODES,
+                        help='Entity matching: all dictionary hits, or leftmost-longest non-overlapping spans')
+    parser.add_argument('--entity-rank', type=str, default="first", choices=ENTITY_RANK_MODES,
+                        help='Order of matched entities: first occurrence, frequency or covered characters')
+    parser.add_argument('--mention-index', type=str, default=None,
+                        help='Precomputed chunk -> entity mention index (ac_automaton.py --mention-index) used instead of inline matching')
+    parser.add_argument('--entity-context', type=str, default="full", choices=ENTITY_CONTEXT_MODES,
+                        help='How matched entities are rendered into the prompt (full / brief / names)')
+    parser.add_argument('--entity-summary-chars', type=int, default=100, help='Summary length kept per entity in brief mode')
+    parser.add_argument('--entity-token-budget', type=int, default=None, help='Max tokens spent on the entity list per prompt')
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Extract relations (triples) from text chunks using pre-extracted entities')
     parser.add_argument('--start', type=int, default=1535, help='Start chunk index (inclusive)')
     parser.add_argument('--end', type=int, default=1536, help='End chunk index (exclusive)')
     parser.add_argument('--input_file', type=str, default="./chunks_output/relation_chunks.jsonl", 
                        help='Input JSONL file path')
-    parser.add_argument('--entities_file', type=str, default="./kg_output/entities_kb.json",
-                       help='Path to pre-extracted entities JSON file')
     parser.add_argument('--output_dir', type=str, default="./triplets_output", 
                        help='Output directory path')
     parser.add_argument('--batch-size', type=int, default=10, help='Batch size for processing')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the on-disk LLM response cache')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached responses and overwrite them with fresh ones')
+    parser.add_argument('--cache_file', type=str, default=DEFAULT_CACHE_FILE, help='LLM response cache file path')
+    add_relation_arguments(parser)
+    parser.add_argument('--endpoints', type=str, default=None, help='Comma-separated vLLM base URLs to load-balance across')
+    parser.add_argument('--concurrency', type=int, default=1, help='Max concurrent LLM requests (1 = sequential)')
+    parser.add_argument('--adaptive', action='store_true', help='Adapt concurrency to server load, starting from --concurrency')
+    parser.add_argument('--max-concurrency', type=int, default=64, help='Upper bound of the adaptive concurrency window')
     
     args = parser.parse_args()
     
-    extractor = RelationExtractor(log_level=logging.INFO, entities_file=args.entities_file)
+    extractor = RelationExtractor(log_level=logging.INFO, entities_file=args.entities_file, use_cache=not args.no_cache, cache_file=args.cache_file, refresh_cache=args.refresh, endpoints=args.endpoints.split(',') if args.endpoints else None,
+                                  entity_context=args.entity_context, entity_summary_chars=args.entity_summary_chars, entity_token_budget=args.entity_token_budget,
+                                  automaton_cache=not args.no_automaton_cache, entity_match_mode=args.match_mode,
+                                  entity_rank=args.entity_rank, mention_index=args.mention_index,
+                                  llm_max_retries=ADAPTIVE_CLIENT_MAX_RETRIES if args.adaptive else None)
+
+    controller = None
+    if args.adaptive:
+        controller = VLLMModel().get_concurrency_controller(initial_limit=args.concurrency, max_limit=args.max_concurrency)
 
     # 如果没有指定end参数，则处理从start开始的batch-size个chunks
     if args.end is None:
@@ -262,8 +415,14 @@ if __name__ == "__main__":
         entities_file=args.entities_file,
         output_dir=args.output_dir,
         start_index=args.start,
-        end_index=args.end
+        end_index=args.end,
+        concurrency=args.concurrency,
+        controller=controller
     )
     
     extractor.logger.info(f"Relation extraction completed for chunks {args.start}-{args.end-1}.")
-    extractor.logger.info(f"Extracted {len(triples)} triples.")
\ No newline at end of file
+    extractor.logger.info(f"Extracted {len(triples)} triples.")
+    if extractor.llm_cache is not None:
+        extractor.logger.info(f"LLM cache stats: {extractor.llm_cache.stats()}")
+    if controller is not None:
+        extractor.logger.info(f"Concurrency controller stats: {controller.stats()}")
\ No newline at end of file
@@ -12,6 +12,8 @@ from langchain_core.runnables import RunnableSequence
 
 from prompts import Prompts, Entity, Triple
 from llm_model import VLLMModel
+from llm_cache import build_llm_cache, DEFAULT_CACHE_FILE
+from summary_consolidation import summary_accumulator, finalize_summaries, DEFAULT_SUMMARY_MAX_CHARS
 from tqdm import tqdm
 
 class TripleExtractor:
@@ -21,12 +23,21 @@ class TripleExtractor:
     Output: entities and triples for knowledge graph construction.
     """
     
-    def __init__(self, log_dir: str = "logs", log_level: int = logging.INFO):
-        self.model = VLLMModel().get_local_model()
+    def __init__(self, log_dir: str = "logs", log_level: int = logging.INFO, use_cache: bool = True,
+                 cache_file: str = DEFAULT_CACHE_FILE, refresh_cache: bool = False,
+                 endpoints: Optional[List[str]] = None, summary_max_chars: Optional[int] = DEFAULT_SUMMARY_MAX_CHARS):
         self.log_dir = log_dir
+        self.summary_max_chars = summary_max_chars
         os.makedirs(log_dir, exist_ok=True)
         self._setup_logger(log_level)
         
+        self.llm_cache = build_llm_cache(use_cache, cache_file, refresh_cache)
+        if endpoints:
+            # 多个vLLM副本时使用负载均衡连接池
+            self.model = VLLMModel().get_pooled_model(endpoints, cache=self.llm_cache)
+        else:
+            self.model = VLLMModel().get_local_model(cache=self.llm_cache)
+        
         self.prompt, self.parser = Prompts.get_triple_extraction_prompt()
         self.extraction_chain: RunnableSequence = self.prompt | self.model
         
@@ -172,17 +183,14 @@ class TripleExtractor:
                 if key in entity_kb:
                     if ent["type"] not in entity_kb[key]["type"]:
                         entity_kb[key]["type"].append(ent["type"])
-                    old_summary = entity_kb[key]["summary"]
-                    new_summary = ent["summary"]
-                    if old_summary != new_summary:
-                        entity_kb[key]["summary"] = f"{old_summary} | {new_summary}".strip()
+                    entity_kb[key]["summary"].add(ent["summary"])
                     if meta_data not in entity_kb[key]["chunk_ids"]:
                         entity_kb[key]["chunk_ids"].append(meta_data)
                 else:
                     entity_kb[key] = {
                         "entity_name": ent["entity_name"],
                         "type": [ent["type"]],
-                        "summary": ent["summary"],
+                        "summary": summary_accumulator(ent["summary"], self.summary_max_chars),
                         "chunk_ids": [meta_data],
                     }
             
@@ -195,7 +203,7 @@ class TripleExtractor:
                 entities_file = os.path.join(output_dir, f"entities_{index}.json")
                 triples_file = os.path.join(output_dir, f"triples_{index}.json")
                 
-                current_entities = list(entity_kb.values())
+                current_entities = finalize_summaries(entity_kb.values())
                 current_triples = list(triple_kb.values())
                 
                 with open(entities_file, "w", encoding="utf-8") as f:
@@ -204,7 +212,7 @@ class TripleExtractor:
                 with open(triples_file, "w", encoding="utf-8") as f:
                     json.dump(current_triples, f, ensure_ascii=False, indent=4)
         
-        final_entities = list(entity_kb.values())
+        final_entities = finalize_summaries(entity_kb.values())
         final_triples = list(triple_kb.values())
         self.logger.info(f"Extracted total {len(final_entities)} unique entities and {len(triple_kb)} triples.")
         
@@ -294,17 +302,14 @@ class TripleExtractor:
                     if key in entity_kb:
                         if ent["type"] not in entity_kb[key]["type"]:
                             entity_kb[key]["type"].append(ent["type"])
-                        old_summary = entity_kb[key]["summary"]
-                        new_summary = ent["summary"]
-                        if old_summary != new_summary:
-                            entity_kb[key]["summary"] = f"{old_summary} | {new_summary}".strip()
+                        entity_kb[key]["summary"].add(ent["summary"])
                         if meta_data not in entity_kb[key]["chunk_ids"]:
                             entity_kb[key]["chunk_ids"].append(meta_data)
                     else:
                         entity_kb[key] = {
                             "entity_name": ent["entity_name"],
                             "type": [ent["type"]],
-                            "summary": ent["summary"],
+                            "summary": summary_accumulator(ent["summary"], self.summary_max_chars),
                             "chunk_ids": [meta_data],
                         }
                 
@@ -318,7 +323,7 @@ class TripleExtractor:
                     current_entities_file = os.path.join(output_dir, f"entities_{start_index}_{global_index}.json")
                     current_triples_file = os.path.join(output_dir, f"triples_{start_index}_{global_index}.json")
                     
-                    current_entities = list(entity_kb.values())
+                    current_entities = finalize_summaries(entity_kb.values())
                     current_triples = triple_kb[:]  # 创建副本
                     
                     with open(current_entities_file, "w", encoding="utf-8") as f:
@@ -344,7 +349,7 @@ class TripleExtractor:
                 self.logger.error(f"Error processing chunk {global_index}: {e}")
                 continue
         
-        final_entities = list(entity_kb.values())
+        final_entities = finalize_summaries(entity_kb.values())
         self.logger.info(f"Extracted total {len(final_entities)} unique entities and {len(triple_kb)} triples from chunks {start_index}-{actual_end_index}.")
         
         # 保存结果，文件名包含处理的chunk范围
@@ -389,12 +394,16 @@ if __name__ == "__main__":
     parser.add_argument('--output_dir', type=str, default="./kg_output", 
                        help='Output directory path')
     parser.add_argument('--batch-size', type=int, default=10, help='Batch size for processing')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the on-disk LLM response cache')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached responses and overwrite them with fresh ones')
+    parser.add_argument('--cache_file', type=str, default=DEFAULT_CACHE_FILE, help='LLM response cache file path')
+    parser.add_argument('--endpoints', type=str, default=None, help='Comma-separated vLLM base URLs to load-balance across')
+    parser.add_argument('--summary-max-chars', type=int, default=DEFAULT_SUMMARY_MAX_CHARS,
+                        help='Max merged summary length per entity (0 = unlimited)')
     
     args = parser.parse_args()
     
-    extractor = TripleExtractor(log_level=logging.INFO)
-
-    extractor = TripleExtractor(log_level=logging.INFO)
+    extractor = TripleExtractor(log_level=logging.INFO, use_cache=not args.no_cache, cache_file=args.cache_file, refresh_cache=args.refresh, endpoints=args.endpoints.split(',') if args.endpoints else None, summary_max_chars=args.summary_max_chars or None)
 
     # 如果没有指定end参数，则处理从start开始的batch-size个chunks
     if args.end is None:
@@ -408,4 +417,6 @@ if __name__ == "__main__":
     )
     
     extractor.logger.info(f"Entity and triple extraction completed for chunks {args.start}-{args.end-1}.")
-    extractor.logger.info(f"Extracted {len(entities)} entities and {len(triples)} triples.")
\ No newline at end of file
+    extractor.logger.info(f"Extracted {len(entities)} entities and {len(triples)} triples.")
+    if extractor.llm_cache is not None:
+        extractor.logger.info(f"LLM cache stats: {extractor.llm_cache.stats()}")
\ No newline at end of file
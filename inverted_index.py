@@ -0,0 +1,331 @@
+# inverted_index.py
+# 实体 -> chunk 倒排索引
+# 用AC自动机扫描 chunks 文件（chunks.jsonl / relation_chunks.jsonl），为每个实体记录出现过的chunk序号（在文件中的行号），
+# 倒排表为升序整数序列，按“差值 + 变长整数（varint）”压缩后存为一个二进制文件，查询时内存映射、按需解码。
+#
+# 文件结构：
+#   b"KGII" | 版本(uint32) | 元信息长度(uint64) | 元信息(UTF-8 JSON) | 倒排表数据
+# 元信息中 terms 为排序后的实体名称，offsets[i]:offsets[i+1] 为第 i 个实体的倒排表在数据区中的范围，counts[i] 为其chunk数。
+
+import bisect
+import heapq
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import jsonlines
+
+INDEX_MAGIC = b"KGII"
+INDEX_VERSION = 1
+_HEADER = struct.Struct("<4sIQ")
+
+
+def encode_postings(postings: Iterable[int]) -> bytes:
+    """
+    将升序且不重复的非负整数序列编码为 差值 + varint（每字节低7位存数据，最高位表示后面还有字节）
+    """
+    out = bytearray()
+    previous = 0
+    for value in postings:
+        delta = value - previous
+        if delta < 0:
+            raise ValueError("Postings must be sorted in ascending order")
+        previous = value
+        while delta >= 0x80:
+            out.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(data: bytes) -> List[int]:
+    """encode_postings 的逆过程"""
+    postings = []
+    value = 0
+    delta = 0
+    shift = 0
+    for byte in data:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        value += delta
+        postings.append(value)
+        delta = 0
+        shift = 0
+    return postings
+
+
+def _intersect_sorted(a: List[int], b: List[int]) -> List[int]:
+    """两个升序序列求交集；长度相差较大时对长序列二分跳跃"""
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return []
+    result = []
+    if len(b) > 8 * len(a):
+        lo = 0
+        for value in a:
+            lo = bisect.bisect_left(b, value, lo)
+            if lo == len(b):
+                break
+            if b[lo] == value:
+                result.append(value)
+        return result
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            result.append(a[i])
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def write_inverted_index(output_file: str, postings: Dict[str, List[int]], meta: Optional[Dict[str, Any]] = None) -> int:
+    """
+    写出倒排索引
+
+    Args:
+        output_file: 输出文件路径
+        postings: 实体名称 -> 升序chunk序号列表
+        meta: 额外写入元信息的字段（如 chunks_file、entities_file）
+
+    Returns:
+        实体数
+    """
+    terms = sorted(postings)
+    blobs = [encode_postings(postings[term]) for term in terms]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+
+    header_meta = dict(meta or {})
+    header_meta.update({
+        "terms": terms,
+        "offsets": offsets,
+        "counts": [len(postings[term]) for term in terms],
+    })
+    meta_bytes = json.dumps(header_meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(meta_bytes)))
+        f.write(meta_bytes)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_file, output_file)
+    return len(terms)
+
+
+def collect_postings(mentions: Iterable[List[str]]) -> Dict[str, List[int]]:
+    """
+    由按chunk顺序排列的实体名称列表构建倒排表；chunk序号递增，倒排表天然有序
+    """
+    postings: Dict[str, List[int]] = {}
+    for chunk_index, names in enumerate(mentions):
+        for name in set(names):
+            entry = postings.get(name)
+            if entry is None:
+                postings[name] = [chunk_index]
+            else:
+                entry.append(chunk_index)
+    return postings
+
+
+def build_inverted_index(entities_file: str, chunks_file: str, output_file: str, mode: str = "all",
+                         workers: int = 1) -> int:
+    """
+    用 ACEntityMatcher 扫描 chunks 文件并写出倒排索引
+
+    Args:
+        entities_file: 实体库
+        chunks_file: JSONL chunks 文件
+        output_file: 索引文件路径
+        mode: 匹配方式，见 ac_automaton.ENTITY_MATCH_MODES
+        workers: 匹配进程数，见 ACEntityMatcher.iter_batch_matches
+
+    Returns:
+        索引中的实体数
+    """
+    from ac_automaton import ACEntityMatcher
+
+    matcher = ACEntityMatcher(entities_file)
+    chunk_count = 0
+
+    def iter_contents() -> Iterator[str]:
+        nonlocal chunk_count
+        with jsonlines.open(chunks_file, mode='r') as reader:
+            for chunk in reader:
+                chunk_count += 1
+                yield chunk.get("chunk_content", "").strip()
+
+    postings = collect_postings(names for names, _ in matcher.iter_batch_matches(iter_contents(), mode=mode,
+                                                                                   workers=workers))
+    meta = {"entities_file": entities_file, "chunks_file": chunks_file, "mode": mode, "chunk_count": chunk_count}
+    return write_inverted_index(output_file, postings, meta)
+
+
+def build_from_mention_index(mention_index: str, output_file: str) -> int:
+    """
+    由 ACEntityMatcher.build_mention_index 生成的提及索引构建倒排索引，不再重新匹配
+    """
+    from ac_automaton import load_mention_index
+
+    index_meta, mentions = load_mention_index(mention_index)
+    chunk_count = max(mentions) + 1 if mentions else 0
+    postings = collect_postings(mentions.get(i, []) for i in range(chunk_count))
+    meta = {
+        "entities_file": index_meta.get("entities_file"),
+        "chunks_file": index_meta.get("chunks_file"),
+        "mode": index_meta.get("mode"),
+        "chunk_count": chunk_count,
+    }
+    return write_inverted_index(output_file, postings, meta)
+
+
+class InvertedIndex:
+    """
+    只读的倒排索引。打开时只读取元信息，倒排表数据通过内存映射按需解码。
+
+    用法：
+        index = InvertedIndex("./kg_output/entity_index.bin")
+        index.postings("焊接")                 # 出现“焊接”的chunk序号
+        index.intersect("焊接", "钢板")         # 同时出现两个实体的chunk
+        index.union("焊接", "切割")             # 出现任一实体的chunk
+    """
+
+    def __init__(self, index_file: str):
+        self.index_file = index_file
+        self._file = open(index_file, "rb")
+        try:
+            magic, version, meta_length = _HEADER.unpack(self._file.read(_HEADER.size))
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"{index_file} is not an inverted index file")
+            if version != INDEX_VERSION:
+                raise ValueError(f"Unsupported inverted index version {version} in {index_file}")
+            self.meta = json.loads(self._file.read(meta_length).decode("utf-8"))
+            self._data_start = _HEADER.size + meta_length
+            data_size = os.fstat(self._file.fileno()).st_size - self._data_start
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if data_size > 0 else b""
+        except Exception:
+            self._file.close()
+            raise
+
+        self.terms: List[str] = self.meta.pop("terms")
+        self._offsets: List[int] = self.meta.pop("offsets")
+        self._counts: List[int] = self.meta.pop("counts")
+        self._term_ids = {term: i for i, term in enumerate(self.terms)}
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self) -> "InvertedIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self._term_ids
+
+    def document_frequency(self, term: str) -> int:
+        """实体出现的chunk数，不需要解码倒排表"""
+        term_id = self._term_ids.get(term)
+        return 0 if term_id is None else self._counts[term_id]
+
+    def postings(self, term: str) -> List[int]:
+        """实体出现的chunk序号（升序），实体不在索引中时返回空列表"""
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            return []
+        start = self._data_start + self._offsets[term_id]
+        end = self._data_start + self._offsets[term_id + 1]
+        return decode_postings(self._data[start:end])
+
+    def intersect(self, *terms: str) -> List[int]:
+        """同时出现所有实体的chunk序号；从chunk数最少的实体开始求交，结果为空时提前结束"""
+        if not terms:
+            return []
+        ordered = sorted(set(terms), key=self.document_frequency)
+        result = self.postings(ordered[0])
+        for term in ordered[1:]:
+            if not result:
+                break
+            result = _intersect_sorted(result, self.postings(term))
+        return result
+
+    def union(self, *terms: str) -> List[int]:
+        """出现任一实体的chunk序号（升序、去重）"""
+        result = []
+        for value in heapq.merge(*(self.postings(term) for term in set(terms))):
+            if not result or result[-1] != value:
+                result.append(value)
+        return result
+
+    def cooccurrence(self, term: str, min_count: int = 1) -> List[tuple]:
+        """
+        与某实体在同一chunk中出现过的实体及共现chunk数，按共现次数降序。
+        遍历全部倒排表，适合离线分析。
+        """
+        base = self.postings(term)
+        if not base:
+            return []
+        pairs = []
+        for other in self.terms:
+            if other == term:
+                continue
+            count = len(_intersect_sorted(base, self.postings(other)))
+            if count >= min_count:
+                pairs.append((other, count))
+        pairs.sort(key=lambda pair: -pair[1])
+        return pairs
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build or query the entity -> chunk inverted index')
+    parser.add_argument('--index_file', type=str, default="./kg_output/entity_index.bin", help='Inverted index file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Scan chunks with the entity automaton and write the index')
+    build_parser.add_argument('--entities_file', type=str, default="./kg_output/entities_kb.json", help='Entity knowledge base')
+    build_parser.add_argument('--chunks_file', type=str, default="./chunks_output/relation_chunks.jsonl", help='Input JSONL chunks')
+    build_parser.add_argument('--mention-index', type=str, default=None,
+                              help='Build from a precomputed mention index (ac_automaton.py --mention-index) instead of matching')
+    build_parser.add_argument('--match-mode', type=str, default="all", choices=["all", "longest"], help='Entity matching mode')
+    build_parser.add_argument('--workers', type=int, default=1, help='Matching processes')
+
+    query_parser = subparsers.add_parser('query', help='Look up chunks mentioning entities')
+    query_parser.add_argument('entities', nargs='+', help='Entity names')
+    query_parser.add_argument('--any', action='store_true', help='Union (chunks mentioning any entity) instead of intersection')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if args.mention_index:
+            term_count = build_from_mention_index(args.mention_index, args.index_file)
+        else:
+            term_count = build_inverted_index(args.entities_file, args.chunks_file, args.index_file,
+                                              mode=args.match_mode, workers=args.workers)
+        print(f"倒排索引已保存到 {args.index_file}，共 {term_count} 个实体，文件大小 {os.path.getsize(args.index_file)} 字节")
+    else:
+        with InvertedIndex(args.index_file) as index:
+            for entity in args.entities:
+                print(f"{entity}: {index.document_frequency(entity)} 个chunk")
+            chunk_ids = index.union(*args.entities) if args.any else index.intersect(*args.entities)
+            print(f"{'任一' if args.any else '全部'}实体出现的chunk ({len(chunk_ids)}): {chunk_ids}")
@@ -0,0 +1,383 @@
+# kb_columnar.py
+# 实体库 / 三元组库的列式二进制存储（numpy .npy 文件，可内存映射）
+#
+# 目录结构（如 kg_output/entities_kb.kbc/）：
+#   manifest.json          记录数、字段顺序与各字段的存储类型
+#   strings.npy            去重并排序后的字符串表（UTF-8 字节拼接，uint8）
+#   string_offsets.npy     字符串表偏移（int64，长度为字符串数+1）
+#   col{i}.values.npy      第 i 个字段的值：字符串字段存字符串表ID，整数字段存整数
+#   col{i}.offsets.npy     列表字段的 CSR 偏移（int64，长度为记录数+1）
+#   col{i}.present.npy     仅当有记录缺少该字段时存在（bool）
+#
+# 所有数组以 mmap_mode='r' 打开，打开时只读取 manifest，记录在访问时才解码；
+# 多个进程打开同一个库时共享操作系统的页缓存。
+
+import bisect
+import json
+import os
+import shutil
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from kb_io import COLUMNAR_MANIFEST
+
+FORMAT_NAME = "kb_columnar"
+FORMAT_VERSION = 1
+
+# 字段存储类型；无法归入前四类的字段（混合类型、嵌套对象等）按紧凑JSON字符串存储
+COLUMN_KINDS = ("str", "int", "str_list", "int_list", "json")
+
+_MISSING = object()
+# 迭代时每次解码的记录数
+_ITER_BLOCK = 4096
+
+
+def _infer_kind(values: List[Any]) -> str:
+    scalar_types = set()
+    item_types = set()
+    for value in values:
+        if value is _MISSING:
+            continue
+        if isinstance(value, list):
+            scalar_types.add(list)
+            item_types.update(type(item) for item in value)
+        else:
+            scalar_types.add(type(value))
+
+    if scalar_types <= {str}:
+        return "str"
+    if scalar_types == {int}:
+        return "int"
+    if scalar_types == {list}:
+        if item_types <= {str}:
+            return "str_list"
+        if item_types == {int}:
+            return "int_list"
+    return "json"
+
+
+def write_columnar(path: str, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    将记录写为列式存储目录；已存在的同名目录会被替换。
+    字段顺序按首次出现的顺序保存，读取时按该顺序重建记录。
+
+    Args:
+        path: 输出目录
+        records: 记录（可以是生成器）
+
+    Returns:
+        写出的记录数
+    """
+    columns: Dict[str, List[Any]] = {}
+    count = 0
+    for record in records:
+        for name, value in record.items():
+            values = columns.get(name)
+            if values is None:
+                values = columns[name] = []
+            if len(values) < count:
+                values.extend([_MISSING] * (count - len(values)))
+            values.append(value)
+        count += 1
+    for values in columns.values():
+        values.extend([_MISSING] * (count - len(values)))
+
+    kinds = {name: _infer_kind(values) for name, values in columns.items()}
+    for name, kind in kinds.items():
+        if kind == "json":
+            columns[name] = [v if v is _MISSING else json.dumps(v, ensure_ascii=False, separators=(",", ":"))
+                             for v in columns[name]]
+
+    # 所有字段共用一张排序后的字符串表，按码点排序与按 UTF-8 字节排序一致，可直接二分查找
+    strings = set()
+    for name, kind in kinds.items():
+        if kind in ("str", "json"):
+            strings.update(v for v in columns[name] if v is not _MISSING)
+        elif kind == "str_list":
+            for value in columns[name]:
+                if value is not _MISSING:
+                    strings.update(value)
+    strings = sorted(strings)
+    string_ids = {s: i for i, s in enumerate(strings)}
+    encoded = [s.encode("utf-8") for s in strings]
+
+    tmp_path = path.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(tmp_path, "strings.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(tmp_path, "string_offsets.npy"), offsets)
+
+    manifest_columns = []
+    for index, (name, values) in enumerate(columns.items()):
+        kind = kinds[name]
+        prefix = os.path.join(tmp_path, f"col{index}")
+        present = np.array([v is not _MISSING for v in values], dtype=bool)
+        if kind in ("str", "json"):
+            data = np.array([string_ids[v] if v is not _MISSING else -1 for v in values], dtype=np.int32)
+        elif kind == "int":
+            data = np.array([v if v is not _MISSING else 0 for v in values], dtype=np.int64)
+        else:
+            lists = [v if v is not _MISSING else [] for v in values]
+            list_offsets = np.zeros(count + 1, dtype=np.int64)
+            if lists:
+                np.cumsum([len(v) for v in lists], out=list_offsets[1:])
+            if kind == "str_list":
+                data = np.array([string_ids[item] for v in lists for item in v], dtype=np.int32)
+            else:
+                data = np.array([item for v in lists for item in v], dtype=np.int64)
+            np.save(prefix + ".offsets.npy", list_offsets)
+        np.save(prefix + ".values.npy", data)
+        if not present.all():
+            np.save(prefix + ".present.npy", present)
+        manifest_columns.append({"name": name, "kind": kind, "optional": bool(not present.all())})
+
+    manifest = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "count": count,
+        "strings": len(strings),
+        "columns": manifest_columns,
+    }
+    with open(os.path.join(tmp_path, COLUMNAR_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # 写完后再替换，读者不会看到写了一半的目录
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return count
+
+
+def _load_array(path: str) -> np.ndarray:
+    # np.asarray 去掉 memmap 子类，数据仍在映射的页上，但下标访问开销小得多
+    return np.asarray(np.load(path, mmap_mode="r"))
+
+
+class _Column:
+    __slots__ = ("name", "kind", "values", "offsets", "present")
+
+    def __init__(self, path: str, index: int, spec: Dict[str, Any]):
+        prefix = os.path.join(path, f"col{index}")
+        self.name = spec["name"]
+        self.kind = spec["kind"]
+        if self.kind not in COLUMN_KINDS:
+            raise ValueError(f"Unknown column kind {self.kind!r} for field {self.name!r}")
+        self.values = _load_array(prefix + ".values.npy")
+        self.offsets = _load_array(prefix + ".offsets.npy") if self.kind.endswith("_list") else None
+        self.present = _load_array(prefix + ".present.npy") if spec.get("optional") else None
+
+
+class ColumnarKB(Sequence):
+    """
+    以内存映射方式打开的列式知识库，可按下标随机访问记录（返回新建的 dict），
+    也可以只读取某个字段而不解码整条记录。
+    """
+
+    def __init__(self, path: str, string_cache_size: int = 65536):
+        """
+        Args:
+            path: write_columnar 生成的目录
+            string_cache_size: 解码后字符串的缓存条数（类型、关系名等重复较多）
+        """
+        self.path = path
+        with open(os.path.join(path, COLUMNAR_MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT_NAME:
+            raise ValueError(f"{path} is not a {FORMAT_NAME} directory")
+        if self.manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported {FORMAT_NAME} version {self.manifest.get('version')} in {path}")
+
+        self._count = self.manifest["count"]
+        self._data = memoryview(_load_array(os.path.join(path, "strings.npy")))
+        self._offsets = _load_array(os.path.join(path, "string_offsets.npy"))
+        self.columns = {spec["name"]: _Column(path, i, spec) for i, spec in enumerate(self.manifest["columns"])}
+        self._optional = any(column.present is not None for column in self.columns.values())
+        self.string = lru_cache(maxsize=string_cache_size)(self._decode_string)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("record index out of range")
+        return self._record(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        # 按块把数组切片转成 Python 列表，避免逐个访问 numpy 标量
+        names = list(self.columns)
+        for start in range(0, self._count, _ITER_BLOCK):
+            stop = min(start + _ITER_BLOCK, self._count)
+            decoded = [self._decode_block(self.columns[name], start, stop) for name in names]
+            if not self._optional:
+                for values in zip(*decoded):
+                    yield dict(zip(names, values))
+                continue
+            for row in range(stop - start):
+                record = {}
+                for name, values in zip(names, decoded):
+                    value = values[row]
+                    if value is not _MISSING:
+                        record[name] = value
+                yield record
+
+    @property
+    def string_count(self) -> int:
+        return len(self._offsets) - 1
+
+    def _decode_string(self, string_id: int) -> str:
+        return str(self._data[self._offsets[string_id]:self._offsets[string_id + 1]], "utf-8")
+
+    def _decode_strings(self, string_ids: np.ndarray) -> List[str]:
+        """批量解码，偏移一次性取出；块内重复的字符串（关系名、类型等）只解码一次"""
+        unique_ids, inverse = np.unique(string_ids, return_inverse=True)
+        starts = self._offsets[unique_ids].tolist()
+        ends = self._offsets[unique_ids + 1].tolist()
+        data = self._data
+        decoded = [str(data[start:end], "utf-8") for start, end in zip(starts, ends)]
+        return [decoded[i] for i in inverse.tolist()]
+
+    def string_id(self, value: str) -> Optional[int]:
+        """在字符串表中二分查找字符串，不存在时返回 None"""
+        index = bisect.bisect_left(range(self.string_count), value, key=self.string)
+        if index < self.string_count and self.string(index) == value:
+            return index
+        return None
+
+    def _decode_value(self, column: _Column, row: int) -> Any:
+        if column.present is not None and not column.present[row]:
+            return _MISSING
+        if column.kind == "str":
+            return self.string(int(column.values[row]))
+        if column.kind == "int":
+            return int(column.values[row])
+        if column.kind == "json":
+            return json.loads(self.string(int(column.values[row])))
+        items = column.values[int(column.offsets[row]):int(column.offsets[row + 1])].tolist()
+        return [self.string(i) for i in items] if column.kind == "str_list" else items
+
+    def _decode_block(self, column: _Column, start: int, stop: int) -> List[Any]:
+        present = column.present[start:stop].tolist() if column.present is not None else None
+        if column.kind.endswith("_list"):
+            offsets = column.offsets[start:stop + 1].tolist()
+            items = column.values[offsets[0]:offsets[-1]]
+            items = self._decode_strings(items) if column.kind == "str_list" else items.tolist()
+            base = offsets[0]
+            values = [items[offsets[i] - base:offsets[i + 1] - base] for i in range(stop - start)]
+        else:
+            values = column.values[start:stop]
+            if column.kind == "int":
+                values = values.tolist()
+            else:
+                # 缺失值的字符串ID为 -1，按 0 解码后再由 present 掩码去掉
+                values = self._decode_strings(np.maximum(values, 0))
+                if column.kind == "json":
+                    values = [json.loads(v) for v in values]
+        if present is not None:
+            values = [v if p else _MISSING for v, p in zip(values, present)]
+        return values
+
+    def _record(self, row: int) -> Dict[str, Any]:
+        record = {}
+        for name, column in self.columns.items():
+            value = self._decode_value(column, row)
+            if value is not _MISSING:
+                record[name] = value
+        return record
+
+    def get(self, row: int, field: str, default: Any = None) -> Any:
+        """读取单条记录的单个字段"""
+        value = self._decode_value(self.columns[field], row)
+        return default if value is _MISSING else value
+
+    def iter_column(self, field: str) -> Iterator[Any]:
+        """按记录顺序迭代单个字段的值（缺失时为 None）"""
+        column = self.columns[field]
+        for start in range(0, self._count, _ITER_BLOCK):
+            for value in self._decode_block(column, start, min(start + _ITER_BLOCK, self._count)):
+                yield None if value is _MISSING else value
+
+    def keyed(self, field: str) -> "KeyedView":
+        """以某个字符串字段为键的只读映射，如 kb.keyed("entity_name")"""
+        return KeyedView(self, field)
+
+
+class KeyedView(Mapping):
+    """
+    ColumnarKB 上以字符串字段为键的只读映射。键重复时与构建 dict 相同，取最后一条记录。
+    第一次查找时对键列做一次 argsort，之后每次查找为两次二分。
+    """
+
+    def __init__(self, kb: ColumnarKB, field: str):
+        column = kb.columns[field]
+        if column.kind != "str":
+            raise ValueError(f"Field {field!r} is not a string column")
+        self.kb = kb
+        self.field = field
+        self._ids = column.values
+        self._order = None
+        self._sorted_ids = None
+        self._len = None
+
+    def _ensure_index(self) -> None:
+        if self._order is None:
+            self._order = np.argsort(self._ids, kind="stable")
+            self._sorted_ids = self._ids[self._order]
+
+    def row_of(self, key: str) -> Optional[int]:
+        """返回键对应的记录下标，不存在时返回 None"""
+        string_id = self.kb.string_id(key)
+        if string_id is None:
+            return None
+        self._ensure_index()
+        end = int(np.searchsorted(self._sorted_ids, string_id, side="right"))
+        if end == 0 or self._sorted_ids[end - 1] != string_id:
+            return None
+        return int(self._order[end - 1])
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        row = self.row_of(key)
+        if row is None:
+            raise KeyError(key)
+        return self.kb[row]
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.row_of(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        seen = set()
+        for key in self.kb.iter_column(self.field):
+            if key is not None and key not in seen:
+                seen.add(key)
+                yield key
+
+    def __len__(self) -> int:
+        if self._len is None:
+            ids = np.asarray(self._ids)
+            self._len = int(np.unique(ids[ids >= 0]).size)
+        return self._len
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from kb_io import iter_records, write_records
+
+    parser = argparse.ArgumentParser(description='Convert a knowledge base between JSON/JSONL and the columnar format')
+    parser.add_argument('--input', type=str, required=True, help='Input knowledge base (.json, .jsonl or .kbc directory)')
+    parser.add_argument('--output', type=str, required=True, help='Output knowledge base (.json, .jsonl or .kbc directory)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = write_records(args.output, iter_records(args.input))
+    print(f"已将 {count} 条记录从 {args.input} 转换为 {args.output}，耗时 {time.perf_counter() - start:.2f} s")
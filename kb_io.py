@@ -0,0 +1,201 @@
+# kb_io.py
+# 实体库 / 三元组库的读写工具
+# 支持 JSON 数组与 JSONL 两种格式（按扩展名区分）；JSON 数组逐条增量解析，不一次性载入整个文件；
+# 写出时可选紧凑格式，安装了 orjson 时用于紧凑格式和 JSONL 的序列化
+# 以 .kbc 结尾的目录为列式存储（见 kb_columnar.py，需要 numpy），读写时自动识别
+
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+COLUMNAR_SUFFIX = ".kbc"
+COLUMNAR_MANIFEST = "manifest.json"
+
+# 增量解析 JSON 数组时每次读取的字符数
+_READ_BLOCK = 1 << 20
+_WHITESPACE = " \t\n\r"
+_NUMBER_TERMINATORS = _WHITESPACE + ",]"
+
+
+def is_jsonl(path: str) -> bool:
+    return path.lower().endswith(JSONL_SUFFIXES)
+
+
+def is_columnar(path: str) -> bool:
+    """列式存储目录：已存在且包含 manifest.json 的目录，或以 .kbc 结尾的路径"""
+    if os.path.isdir(path):
+        return os.path.exists(os.path.join(path, COLUMNAR_MANIFEST))
+    return path.rstrip("/\\").lower().endswith(COLUMNAR_SUFFIX)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _loads(text: str) -> Any:
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def _dumps_compact(record: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(record).decode("utf-8")
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+def _iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield _loads(line)
+            except ValueError as e:
+                raise ValueError(f"Invalid JSON on line {line_no} of {path}: {e}") from e
+
+
+def _iter_json_array(path: str, block_size: int = _READ_BLOCK) -> Iterator[Dict[str, Any]]:
+    """
+    逐条解析顶层为数组的 JSON 文件，内存中只保留当前读取块和当前元素
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(block_size)
+        eof = len(buffer) < block_size
+        pos = 0
+
+        def skip_whitespace(p: int) -> int:
+            while p < len(buffer) and buffer[p] in _WHITESPACE:
+                p += 1
+            return p
+
+        pos = skip_whitespace(pos)
+        if buffer[pos:pos + 1] == "\ufeff":
+            pos = skip_whitespace(pos + 1)
+        if buffer[pos:pos + 1] != "[":
+            raise ValueError(f"{path} is not a JSON array")
+        pos += 1
+        expect_comma = False
+
+        while True:
+            pos = skip_whitespace(pos)
+            if pos >= len(buffer):
+                if eof:
+                    raise ValueError(f"Unexpected end of file in {path}")
+                more = f.read(block_size)
+                eof = len(more) < block_size
+                buffer = more
+                pos = 0
+                continue
+
+            char = buffer[pos]
+            if char == "]":
+                return
+            if expect_comma:
+                if char != ",":
+                    raise ValueError(f"Expected ',' or ']' in {path}")
+                pos += 1
+                expect_comma = False
+                continue
+
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                # 数字在块末尾被截断时（如 1.5e3 只读到 1.），raw_decode 会返回其中能解析的前缀；
+                # 数字后面必须已经读到分隔符才算完整，否则读入更多内容再解析
+                complete = eof or end < len(buffer) and (
+                    not _is_number(record) or buffer[end] in _NUMBER_TERMINATORS)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+
+            if not complete:
+                more = f.read(block_size)
+                eof = len(more) < block_size
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+
+            yield record
+            pos = end
+            expect_comma = True
+            # 已解析的部分不再保留
+            if pos > block_size:
+                buffer = buffer[pos:]
+                pos = 0
+
+
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    逐条读取知识库文件中的记录，支持 JSON 数组、JSONL 和列式存储目录
+    """
+    if is_columnar(path):
+        from kb_columnar import ColumnarKB
+        return iter(ColumnarKB(path))
+    if is_jsonl(path):
+        return _iter_jsonl(path)
+    return _iter_json_array(path)
+
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    """读取知识库文件中的全部记录"""
+    return list(iter_records(path))
+
+
+def open_records(path: str) -> Sequence[Dict[str, Any]]:
+    """
+    以可随机访问的序列打开知识库：列式存储目录以内存映射方式打开（不解码全部记录），
+    其余格式读取为列表
+    """
+    if is_columnar(path):
+        from kb_columnar import ColumnarKB
+        return ColumnarKB(path)
+    return load_records(path)
+
+
+def write_records(path: str, records: Iterable[Dict[str, Any]], compact: bool = False, indent: int = 4) -> int:
+    """
+    逐条写出记录，不在内存中拼接整个文件。
+
+    Args:
+        path: 输出路径，扩展名为 .jsonl/.ndjson 时写 JSONL，以 .kbc 结尾时写列式存储目录，否则写 JSON 数组
+        records: 记录（可以是生成器）
+        compact: JSON 数组每条记录占一行且不缩进；为 False 时与 json.dump(..., indent=indent) 的输出相同
+        indent: 非紧凑格式的缩进
+
+    Returns:
+        写出的记录数
+    """
+    output_dir = os.path.dirname(path.rstrip("/\\"))
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if is_columnar(path):
+        from kb_columnar import write_columnar
+        return write_columnar(path, records)
+
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        if is_jsonl(path):
+            for record in records:
+                f.write(_dumps_compact(record) + "\n")
+                count += 1
+            return count
+
+        prefix = "\n" if compact else "\n" + " " * indent
+        f.write("[")
+        for record in records:
+            if compact:
+                item = _dumps_compact(record)
+            else:
+                item = json.dumps(record, ensure_ascii=False, indent=indent).replace("\n", prefix)
+            f.write(("," if count else "") + prefix + item)
+            count += 1
+        f.write("\n]" if count else "]")
+    return count
@@ -0,0 +1,169 @@
+# llm_cache.py
+# 基于SQLite的LLM响应持久化缓存，挂在各抽取器的ChatOpenAI下面
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+
+DEFAULT_CACHE_FILE = "./cache/llm_cache.sqlite"
+
+
+def _llm_identity(llm_string: str) -> str:
+    """
+    从 LangChain 生成的 llm_string 中提取影响输出的参数：模型名、temperature、extra_body 以及调用参数。
+    timeout、max_retries、base_url 等不影响输出的参数不参与缓存键计算。
+    解析失败时直接使用完整的 llm_string。
+    """
+    serialized, sep, call_params = llm_string.rpartition("---")
+    if not sep:
+        return llm_string
+    try:
+        kwargs = json.loads(serialized).get("kwargs", {})
+    except (json.JSONDecodeError, AttributeError):
+        return llm_string
+
+    identity = {
+        "model": kwargs.get("model_name", kwargs.get("model")),
+        "temperature": kwargs.get("temperature"),
+        "extra_body": kwargs.get("extra_body"),
+        "call_params": call_params,
+    }
+    return json.dumps(identity, ensure_ascii=False, sort_keys=True)
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    内容寻址的 LLM 响应缓存。
+    键为 sha256(模型名, temperature, extra_body, 渲染后的prompt)，值为 LangChain 序列化后的生成结果。
+    超过 max_entries 时按最近访问时间淘汰（LRU）。
+    """
+
+    def __init__(self, cache_file: str = DEFAULT_CACHE_FILE, max_entries: int = 100_000, refresh: bool = False):
+        """
+        Args:
+            cache_file: SQLite 数据库文件路径
+            max_entries: 最多保留的缓存条数
+            refresh: 为 True 时不读取已有缓存，但仍写入新结果（用于强制刷新）
+        """
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        # 异步调用时 LangChain 会在线程池中执行 lookup/update，因此允许跨线程并加锁
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON llm_cache (last_access)")
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        self.logger.info(f"LLM cache loaded from {cache_file} ({self._entries} entries, refresh={refresh})")
+
+    @staticmethod
+    def _make_key(prompt: str, llm_string: str) -> str:
+        payload = f"{_llm_identity(llm_string)}\x00{prompt}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.refresh:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        key = self._make_key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+        # 反序列化放在锁外；无法解析的记录按未命中处理，重新请求后由 update 覆盖
+        try:
+            value = loads(row[0])
+        except Exception as e:
+            self.logger.warning(f"Failed to deserialize cached response, ignoring: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return value
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self._make_key(prompt, llm_string)
+        value = dumps(return_val)
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, last_access) VALUES (?, ?, ?)",
+                (key, value, time.time())
+            )
+            if not exists:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        """淘汰最久未访问的条目，额外多删10%以免每次写入都触发淘汰"""
+        target = int(self.max_entries * 0.9)
+        excess = self._entries - target
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE key IN "
+            "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+            (excess,)
+        )
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        self.logger.info(f"LLM cache evicted {excess} least recently used entries")
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._entries = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存命中统计信息
+        """
+        with self._lock:
+            hits, misses, entries = self.hits, self.misses, self._entries
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def build_llm_cache(use_cache: bool = True, cache_file: str = DEFAULT_CACHE_FILE, refresh: bool = False) -> Optional[SQLiteLLMCache]:
+    """
+    根据命令行开关创建缓存，use_cache 为 False 时返回 None（不使用缓存）
+    """
+    if not use_cache:
+        return None
+    return SQLiteLLMCache(cache_file=cache_file, refresh=refresh)
@@ -1,15 +1,29 @@
 # llm_model.py
 import os
 from dotenv import load_dotenv
+import asyncio
 import logging
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Optional
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
 
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
 from langchain_openai import ChatOpenAI
+from pydantic import PrivateAttr
 
 load_dotenv()
 
+# 在自适应并发控制器下运行的客户端不自行重试：429/503/超时要交给控制器缩小窗口，
+# 否则 openai 客户端内部的重试会把过载信号吞掉；重新排队由 async_runner 负责
+ADAPTIVE_CLIENT_MAX_RETRIES = 0
+
 class BaseModel(ABC):
     """
     LLM 模型的抽象基类。
@@ -48,28 +62,432 @@ class VLLMModel(BaseModel):
         self.api_key = api_key
         self.logger.info(f"Initialize VLLM Model: {model_name} @ {base_url}")
 
-    def get_model(self) -> ChatOpenAI:
+    def get_model(self, cache: Optional[BaseCache] = None, max_retries: int = 3) -> ChatOpenAI:
         return ChatOpenAI(
             base_url=self.base_url,
             api_key=self.api_key,
             model=self.model_name,
             temperature=0.1,
             request_timeout=120,
-            max_retries=3,
-            extra_body={"enable_thinking": False}
+            max_retries=max_retries,
+            extra_body={"enable_thinking": False},
+            cache=cache
         )
     
-    def get_local_model(self) -> ChatOpenAI:
+    def get_local_model(self, cache: Optional[BaseCache] = None, max_retries: int = 3) -> ChatOpenAI:
         return ChatOpenAI(
             base_url= "http://202.120.59.70:1234/v1/",
             api_key= "wcf0326",
             model= "Qwen3-8B",
             temperature=0.1,
             request_timeout=180,
-            max_retries=3,
-            extra_body={"enable_thinking": False}
+            max_retries=max_retries,
+            extra_body={"enable_thinking": False},
+            cache=cache
         )
-        
+    
+    def get_pooled_model(self, base_urls: Optional[List[str]] = None, cache: Optional[BaseCache] = None,
+                         max_retries: int = 3) -> "PooledChatModel":
+        """
+        创建多个 vLLM 副本组成的负载均衡模型。
+        base_urls 为空时从环境变量 QWEN_API_BASES（逗号分隔）读取。
+        缓存挂在连接池上，缓存键与单个 ChatOpenAI 相同，与副本地址及请求被路由到哪个副本无关，
+        改用 --endpoints 后已有的缓存条目仍可命中。
+        max_retries 为每个副本客户端的重试次数，在自适应并发控制器下使用 ADAPTIVE_CLIENT_MAX_RETRIES。
+        """
+        if not base_urls:
+            base_urls = [url.strip() for url in os.getenv("QWEN_API_BASES", "").split(",") if url.strip()]
+        if not base_urls:
+            raise ValueError("No vLLM endpoints given, pass base_urls or set QWEN_API_BASES")
+
+        models = [
+            ChatOpenAI(
+                base_url=base_url,
+                api_key=self.api_key or "wcf0326",
+                model=self.model_name or "Qwen3-8B",
+                temperature=0.1,
+                request_timeout=180,
+                max_retries=max_retries,
+                extra_body={"enable_thinking": False},
+                cache=False
+            )
+            for base_url in base_urls
+        ]
+        self.logger.info(f"Initialize pooled VLLM Model over {len(models)} endpoints: {base_urls}")
+        return PooledChatModel(models=models, cache=cache)
+    
+    def get_concurrency_controller(self, initial_limit: int = 4, max_limit: int = 64, **kwargs: Any) -> "AdaptiveConcurrencyController":
+        """
+        创建与该模型配合使用的自适应并发控制器
+        """
+        return AdaptiveConcurrencyController(initial_limit=initial_limit, max_limit=max_limit, **kwargs)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """获取 openai/httpx 异常中的 HTTP 状态码，没有时返回 None"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """
+    判断异常是否表示服务端过载：HTTP 429/503 或请求超时
+    """
+    status_code = _status_code(error)
+    if status_code in (429, 503):
+        return True
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    return "Timeout" in type(error).__name__
+
+
+class AdaptiveConcurrencyController:
+    """
+    客户端自适应并发控制器（AIMD）。
+    - 请求成功且延迟正常时，窗口加性增长（每个窗口的请求量约 +increase_step）
+    - 遇到 429/503/超时，或最近延迟的 p50 超过目标值时，窗口乘性减小
+    多个任务共用同一个 vLLM 服务时，可以尽量跑满GPU又不至于把服务压垮。
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        latency_target: Optional[float] = None,
+        latency_tolerance: float = 2.0,
+        increase_step: float = 1.0,
+        decrease_factor: float = 0.5,
+        sample_size: int = 200,
+        min_latency_sample: float = 0.05,
+        overload_retries: int = 3,
+    ):
+        """
+        Args:
+            initial_limit: 初始并发窗口
+            min_limit: 最小并发窗口
+            max_limit: 最大并发窗口
+            latency_target: p50 延迟目标（秒），为 None 时取观测到的最好 p50 的 latency_tolerance 倍
+            latency_tolerance: 自动延迟目标相对基线的倍数
+            increase_step: 每个完整窗口的请求成功后窗口增加的大小
+            decrease_factor: 过载时窗口的缩小比例
+            sample_size: 计算延迟分位数使用的最近样本数
+            min_latency_sample: 低于该耗时的请求（如缓存命中）不计入延迟样本
+            overload_retries: 请求因过载失败后重新排队的次数（客户端本身不重试，见 ADAPTIVE_CLIENT_MAX_RETRIES）
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.latency_tolerance = latency_tolerance
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.min_latency_sample = min_latency_sample
+        self.overload_retries = overload_retries
+
+        self.in_flight = 0
+        self.successes = 0
+        self.overloads = 0
+        self.errors = 0
+        self._latencies: deque = deque(maxlen=sample_size)
+        self._baseline_p50: Optional[float] = None
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def window(self) -> int:
+        """当前允许的最大在途请求数"""
+        return max(self.min_limit, int(self.limit))
+
+    def _percentile(self, q: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def _decrease(self, reason: str) -> None:
+        # 同一次拥塞只缩小一次：距上次缩小至少间隔一个 p50 延迟
+        now = time.monotonic()
+        cooldown = self._percentile(0.5) or 1.0
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        old_window = self.window
+        self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+        self.logger.info(f"Concurrency window {old_window} -> {self.window} ({reason})")
+
+    def _on_success(self, latency: float) -> None:
+        self.successes += 1
+        if latency >= self.min_latency_sample:
+            self._latencies.append(latency)
+
+        p50 = self._percentile(0.5)
+        if len(self._latencies) >= 20:
+            if self._baseline_p50 is None or p50 < self._baseline_p50:
+                self._baseline_p50 = p50
+
+        target = self.latency_target
+        if target is None and self._baseline_p50 is not None:
+            target = self._baseline_p50 * self.latency_tolerance
+
+        if target is not None and p50 is not None and p50 > target:
+            self._decrease(f"p50 latency {p50:.1f}s > target {target:.1f}s")
+        else:
+            self.limit = min(float(self.max_limit), self.limit + self.increase_step / self.limit)
+
+    @staticmethod
+    def is_overload(error: BaseException) -> bool:
+        return is_overload_error(error)
+
+    def _on_error(self, error: BaseException) -> None:
+        if is_overload_error(error):
+            self.overloads += 1
+            self._decrease(type(error).__name__)
+        else:
+            self.errors += 1
+
+    async def _notify(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        获取一个请求名额，退出时根据耗时和异常调整窗口
+
+        用法:
+            async with controller.slot():
+                await chain.ainvoke(...)
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.window)
+            self.in_flight += 1
+
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._on_error(e)
+            raise
+        else:
+            self._on_success(time.monotonic() - start)
+        finally:
+            self.in_flight -= 1
+            await self._notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取当前窗口与最近的延迟分位数
+        """
+        return {
+            "window": self.window,
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "errors": self.errors,
+            "latency_p50": self._percentile(0.5),
+            "latency_p90": self._percentile(0.9),
+            "latency_p99": self._percentile(0.99),
+        }
+
+
+_pool_logger = logging.getLogger("PooledChatModel")
+
+
+class _EndpointState:
+    """单个 vLLM 副本的运行状态"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.probing = False
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > 0
+
+
+def _is_endpoint_failure(error: BaseException) -> bool:
+    """
+    连接错误、超时和 5xx 视为副本故障；429 表示副本繁忙，需要换副本但不计入故障；
+    其他 4xx（如上下文超长）与副本无关，直接抛出
+    """
+    status_code = _status_code(error)
+    return status_code is None or status_code >= 500
+
+
+class PooledChatModel(BaseChatModel):
+    """
+    多个 vLLM 副本的负载均衡封装，对外表现为普通的 ChatModel，可直接用于 prompt | model。
+    - 按在途请求数最少的副本路由
+    - 副本连续失败 failure_threshold 次后被摘除，probe_interval 秒后放行一个探测请求，成功即恢复
+    - 单个副本失败时自动切换到其他副本重试
+    """
+
+    models: List[BaseChatModel]
+    failure_threshold: int = 3
+    probe_interval: float = 30.0
+
+    _states: List[_EndpointState] = PrivateAttr(default_factory=list)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _next: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        self._states = [
+            _EndpointState(str(getattr(model, "openai_api_base", None) or f"endpoint_{i}"))
+            for i, model in enumerate(self.models)
+        ]
+
+    @property
+    def _llm_type(self) -> str:
+        return "vllm-pool"
+
+    def _get_llm_string(self, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        # 缓存键使用第一个副本客户端（ChatOpenAI）的 llm_string，与单个 ChatOpenAI 的缓存条目通用；
+        # base_url、timeout、max_retries 等与输出无关的参数由 llm_cache 忽略，因此与副本地址和数量无关
+        return self.models[0]._get_llm_string(stop=stop, **kwargs)
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        # 与具体副本无关，用于回调与追踪
+        first = self.models[0]
+        return {
+            "model_name": getattr(first, "model_name", None),
+            "temperature": getattr(first, "temperature", None),
+            "extra_body": getattr(first, "extra_body", None),
+        }
+
+    def _acquire(self, tried: set) -> int:
+        """选择在途请求最少的可用副本，并占用一个名额"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for i, state in enumerate(self._states):
+                if i in tried:
+                    continue
+                if not state.ejected:
+                    candidates.append(i)
+                elif state.ejected_until <= now and not state.probing:
+                    # 摘除时间已过，放行一个探测请求
+                    candidates.append(i)
+
+            if not candidates:
+                # 全部副本都不可用时，选择最早可以恢复的副本兜底
+                remaining = [i for i in range(len(self._states)) if i not in tried]
+                if not remaining:
+                    raise RuntimeError("All vLLM endpoints have been tried")
+                candidates = [min(remaining, key=lambda i: self._states[i].ejected_until)]
+
+            # 在途请求数相同时轮询，避免总是压在第一个副本上
+            offset = self._next
+            self._next = (self._next + 1) % len(self._states)
+            index = min(candidates, key=lambda i: (self._states[i].outstanding, (i - offset) % len(self._states)))
+
+            state = self._states[index]
+            if state.ejected:
+                state.probing = True
+            state.outstanding += 1
+            state.requests += 1
+            return index
+
+    def _release(self, index: int, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            state = self._states[index]
+            state.outstanding -= 1
+            was_probe = state.probing
+            state.probing = False
+
+            if error is None:
+                if state.ejected:
+                    _pool_logger.info(f"Endpoint {state.base_url} re-admitted after successful probe")
+                state.consecutive_failures = 0
+                state.ejected_until = 0.0
+                return
+
+            if not _is_endpoint_failure(error):
+                return
+            state.failures += 1
+            state.consecutive_failures += 1
+            # 已摘除副本上残留的在途请求失败时不重复摘除
+            if was_probe or (not state.ejected and state.consecutive_failures >= self.failure_threshold):
+                state.ejected_until = time.monotonic() + self.probe_interval
+                _pool_logger.warning(f"Endpoint {state.base_url} ejected for {self.probe_interval}s "
+                                    f"after {state.consecutive_failures} consecutive failures: {error}")
+
+    def _should_failover(self, error: BaseException) -> bool:
+        return _is_endpoint_failure(error) or _status_code(error) == 429
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tried: set = set()
+        while True:
+            index = self._acquire(tried)
+            try:
+                result = self.models[index]._generate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                self._release(index, e)
+                tried.add(index)
+                if not self._should_failover(e) or len(tried) >= len(self.models):
+                    raise
+                continue
+            self._release(index)
+            return result
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tried: set = set()
+        while True:
+            index = self._acquire(tried)
+            try:
+                result = await self.models[index]._agenerate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                self._release(index, e)
+                tried.add(index)
+                if not self._should_failover(e) or len(tried) >= len(self.models):
+                    raise
+                continue
+            self._release(index)
+            return result
+
+    def endpoint_stats(self) -> List[Dict[str, Any]]:
+        """
+        获取各副本的在途请求数、健康状态与失败次数
+        """
+        with self._lock:
+            return [
+                {
+                    "base_url": state.base_url,
+                    "outstanding": state.outstanding,
+                    "healthy": not state.ejected,
+                    "consecutive_failures": state.consecutive_failures,
+                    "requests": state.requests,
+                    "failures": state.failures,
+                }
+                for state in self._states
+            ]
+
+
 if __name__ == "__main__":
     model_wrapper = VLLMModel()
     llm = model_wrapper.get_local_model()
@@ -39,14 +39,25 @@
 """
 
 import pandas as pd
+import csv
+import gzip
+import hashlib
 import json
 import os
+import shlex
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 import logging
-from typing import List, Dict, Any
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+from typing import Callable, List, Dict, Any, Optional
 import re
 
+from kb_io import iter_records, open_records
+
 # 加载环境变量
 load_dotenv()
 
@@ -103,6 +114,13 @@ class Neo4jLabelCleaner:
             print("清理后的标签分布:")
             print(df[':LABEL'].value_counts())
 
+def stable_entity_id(entity_name: str) -> str:
+    """
+    由实体名称得到实体ID。ID只取决于名称，增删实体不会改变其他实体的ID，增量同步（--delta）依赖这一点
+    """
+    return f"entity_{hashlib.sha1(str(entity_name).encode('utf-8')).hexdigest()[:16]}"
+
+
 class KnowledgeGraphProcessor:
     def __init__(self, uri=None, username="neo4j", password=None):
         """
@@ -136,20 +154,12 @@ class KnowledgeGraphProcessor:
         导入实体和三元组JSON文件，转换为类的实例变量
         
         Args:
-            entities_json_path (str): 实体JSON文件路径
-            triples_json_path (str): 三元组JSON文件路径
+            entities_json_path (str): 实体JSON或JSONL文件路径，或列式存储目录（.kbc）
+            triples_json_path (str): 三元组JSON或JSONL文件路径，或列式存储目录（.kbc，以内存映射方式打开，不整体载入）
         """
-        # 读取实体JSON文件
-        with open(entities_json_path, 'r', encoding='utf-8') as f:
-            entities_data = json.load(f)
-        
-        # 读取三元组JSON文件
-        with open(triples_json_path, 'r', encoding='utf-8') as f:
-            triples_data = json.load(f)
-        
-        # 转换实体数据为字典格式，以entity_name为key
-        for entity in entities_data:
-            entity_copy = entity.copy()
+        # 逐条读取实体，转换为字典格式，以entity_name为key
+        for entity in iter_records(entities_json_path):
+            entity_copy = entity
             # 将原始chunk_ids重命名为entity_chunk_id
             if 'chunk_ids' in entity_copy:
                 entity_copy['entity_chunk_id'] = entity_copy.pop('chunk_ids')
@@ -161,8 +171,8 @@ class KnowledgeGraphProcessor:
             
             self.entities[entity_copy['entity_name']] = entity_copy
         
-        # 保存三元组数据
-        self.triples = triples_data
+        # 读取并保存三元组数据
+        self.triples = open_records(triples_json_path)
         
         print(f"加载了 {len(self.entities)} 个实体和 {len(self.triples)} 个三元组")
     
@@ -174,7 +184,8 @@ class KnowledgeGraphProcessor:
         """
         # 遍历三元组，查找缺失的实体
         for triple in self.triples:
-            chunk_id = triple.get('chunk_id', 'unknown')
+            # 去重后的三元组（triple_db.py --dedup）带有聚合后的 chunk_ids
+            chunk_ids = triple.get('chunk_ids') or [triple.get('chunk_id', 'unknown')]
             
             # 合并处理subject和object
             for entity_name in [triple['subject'], triple['object']]:
@@ -187,12 +198,13 @@ class KnowledgeGraphProcessor:
                         "domain_relevance": ["unknown"],
                         "summary": "信息待补充",
                         "entity_chunk_id": [],
-                        "relation_chunk_id": [chunk_id]
+                        "relation_chunk_id": []
                     }
-                else:
-                    # 在实体库中，将chunk_id添加到relation_chunk_id（避免重复添加）
-                    if chunk_id not in self.entities[entity_name]['relation_chunk_id']:
-                        self.entities[entity_name]['relation_chunk_id'].append(chunk_id)
+                # 将chunk_id添加到relation_chunk_id（避免重复添加）
+                relation_chunk_ids = self.entities[entity_name]['relation_chunk_id']
+                for chunk_id in chunk_ids:
+                    if chunk_id not in relation_chunk_ids:
+                        relation_chunk_ids.append(chunk_id)
         
         print(f"扩充后共有 {len(self.entities)} 个实体")
     
@@ -209,9 +221,9 @@ class KnowledgeGraphProcessor:
         entities_list = []
         entity_id_map = {}  # 用于映射实体名称到实体ID
         
-        # 为每个实体分配ID
-        for i, (entity_name, entity) in enumerate(self.entities.items(), 1):
-            entity_id = f"entity_{i}"
+        # 为每个实体分配ID（由名称得到，不依赖实体的顺序）
+        for entity_name, entity in self.entities.items():
+            entity_id = stable_entity_id(entity_name)
             entity_id_map[entity_name] = entity_id
             
             # 分别处理entity_chunk_id和relation_chunk_id
@@ -260,6 +272,450 @@ class KnowledgeGraphProcessor:
         
         return entities_csv_path, triples_csv_path
     
+    def to_admin_import(self, output_dir: str = './admin_import', database: str = 'neo4j', part_rows: int = 100000,
+                        compress: bool = True, array_delimiter: str = '|', neo4j_admin: str = 'neo4j-admin') -> str:
+        """
+        导出 neo4j-admin database import 使用的表头文件和分片数据文件，并生成导入命令。
+        用于全新建库：离线导入比通过 Bolt 逐批 MERGE 快几个数量级。
+        
+        与 to_csv 的区别：
+        - 表头与数据分开，数据按 part_rows 行分片，可选 gzip 压缩
+        - 与 Bolt 导入（MERGE）相同，同一 (主语, 关系, 宾语) 只生成一条关系，合并其 chunk_ids 并累加 support
+        - 关系类型同为 RELATION，关系名称存于 type 属性，实体ID与 to_csv 相同（stable_entity_id），
+          因此 create_indexes 建立的索引同样适用
+        
+        属性表示与 Bolt 导入（to_csv + import_from_csv_files）不同，两种方式建出的库不能混用同一套查询：
+        - 实体的 type、domain_relevance、entity_chunk_id、relation_chunk_id 与关系的 chunk_ids 为字符串数组，
+          Bolt 导入为 '|' 拼接的字符串；support 为整数，Bolt 导入为CSV读入的字符串
+        - 每个实体类型是一个单独的标签，Bolt 导入把 '|' 拼接的全部类型作为一个标签
+        - 不写同步清单，--delta 会拒绝在这样的库上执行；需要增量同步时请用 Bolt 全量导入（会写入清单）
+        
+        Args:
+            output_dir (str): 输出目录
+            database (str): 导入的目标数据库名
+            part_rows (int): 每个数据分片的行数
+            compress (bool): 数据分片是否gzip压缩
+            array_delimiter (str): 数组元素分隔符；元素中出现的分隔符替换为空格
+            neo4j_admin (str): neo4j-admin 可执行文件路径
+            
+        Returns:
+            str: 导入命令，同时写入 output_dir/import_command.sh
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        output_dir = os.path.abspath(output_dir)
+        suffix = '.csv.gz' if compress else '.csv'
+        
+        def to_array(values) -> str:
+            return array_delimiter.join(str(value).replace(array_delimiter, ' ') for value in values)
+        
+        def write_parts(prefix: str, header: List[str], rows) -> List[str]:
+            """写表头文件和分片数据文件，返回按顺序排列的文件路径"""
+            header_file = os.path.join(output_dir, f"{prefix}_header.csv")
+            with open(header_file, 'w', encoding='utf-8', newline='') as f:
+                csv.writer(f).writerow(header)
+            files = [header_file]
+            
+            part = None
+            writer = None
+            for i, row in enumerate(rows):
+                if i % part_rows == 0:
+                    if part:
+                        part.close()
+                    part_file = os.path.join(output_dir, f"{prefix}_part{len(files):04d}{suffix}")
+                    if compress:
+                        part = gzip.open(part_file, 'wt', encoding='utf-8', newline='')
+                    else:
+                        part = open(part_file, 'w', encoding='utf-8', newline='')
+                    writer = csv.writer(part)
+                    files.append(part_file)
+                writer.writerow(row)
+            if part:
+                part.close()
+            return files
+        
+        # 删除上一次导出的分片，避免命令中漏掉或多出文件
+        for name in os.listdir(output_dir):
+            if name.startswith(('nodes_part', 'relationships_part')):
+                os.remove(os.path.join(output_dir, name))
+        
+        entity_id_map = {entity_name: stable_entity_id(entity_name) for entity_name in self.entities}
+        
+        def entity_rows():
+            for entity_name, entity in self.entities.items():
+                types = entity.get("type") or ["Unknown"]
+                yield [
+                    entity_id_map[entity_name],
+                    entity_name,
+                    entity.get("summary", "信息待补充"),
+                    to_array(types),
+                    to_array(entity.get("domain_relevance") or ["unknown"]),
+                    to_array(entity.get("entity_chunk_id", [])),
+                    to_array(entity.get("relation_chunk_id", [])),
+                    to_array(["Entity"] + [t for t in types if t != "Entity"]),
+                ]
+        
+        def relationship_rows():
+            # (start_id, relation, end_id) -> [chunk_ids（保持首次出现的顺序）, support]
+            grouped: Dict[tuple, list] = {}
+            for triple in self.triples:
+                start_id = entity_id_map.get(triple["subject"])
+                end_id = entity_id_map.get(triple["object"])
+                # 与 to_csv 相同，跳过端点不在实体列表中的三元组
+                if start_id is None or end_id is None:
+                    continue
+                chunk_ids = triple.get('chunk_ids') or [triple.get('chunk_id', 'unknown')]
+                entry = grouped.setdefault((start_id, triple["relation"], end_id), [{}, 0])
+                entry[0].update(dict.fromkeys(map(str, chunk_ids)))
+                entry[1] += triple.get('support', 1)
+            for (start_id, relation, end_id), (chunk_ids, support) in grouped.items():
+                yield [start_id, end_id, 'RELATION', relation, to_array(chunk_ids), support]
+        
+        node_files = write_parts('nodes', [
+            'id:ID', 'name', 'summary', 'type:string[]', 'domain_relevance:string[]',
+            'entity_chunk_id:string[]', 'relation_chunk_id:string[]', ':LABEL'
+        ], entity_rows())
+        relationship_files = write_parts('relationships', [
+            ':START_ID', ':END_ID', ':TYPE', 'type', 'chunk_ids:string[]', 'support:int'
+        ], relationship_rows())
+        
+        command = " ".join([
+            shlex.quote(neo4j_admin), "database", "import", "full", shlex.quote(database),
+            "--overwrite-destination=true",
+            "--multiline-fields=true",
+            f"--array-delimiter={shlex.quote(array_delimiter)}",
+            f"--nodes={shlex.quote(','.join(node_files))}",
+            f"--relationships={shlex.quote(','.join(relationship_files))}",
+        ])
+        
+        command_file = os.path.join(output_dir, "import_command.sh")
+        with open(command_file, 'w', encoding='utf-8') as f:
+            f.write("#!/bin/bash\n")
+            f.write("# 需要先停止目标数据库（neo4j stop 或 STOP DATABASE），导入会覆盖已有数据\n")
+            f.write(command + "\n")
+        os.chmod(command_file, 0o755)
+        
+        print(f"neo4j-admin 导入文件已保存至: {output_dir} "
+              f"({len(node_files) - 1} 个实体分片, {len(relationship_files) - 1} 个关系分片)")
+        print(f"导入命令（已写入 {command_file}）:\n{command}")
+        return command
+    
+
+# 批量导入的Cypher语句
+ENTITY_IMPORT_QUERY = """
+UNWIND $entities AS entity
+MERGE (n:Entity {id: entity.id})
+SET n += entity.properties
+WITH n, entity
+CALL apoc.create.addLabels(n, entity.labels) YIELD node
+RETURN count(n)
+"""
+
+RELATION_IMPORT_QUERY = """
+UNWIND $relations AS rel
+MATCH (start:Entity {id: rel.start_id})
+MATCH (end:Entity {id: rel.end_id})
+MERGE (start)-[r:RELATION {type: rel.type}]->(end)
+RETURN count(r)
+"""
+
+# 增量同步时更新实体：属性和标签整体替换，旧版本中有、新版本中没有的属性和类型标签会被去掉
+ENTITY_UPSERT_QUERY = """
+UNWIND $entities AS entity
+MERGE (n:Entity {id: entity.id})
+SET n = entity.properties, n.id = entity.id
+WITH n, entity
+CALL apoc.create.setLabels(n, ['Entity'] + entity.labels) YIELD node
+RETURN count(n)
+"""
+
+# 增量同步的删除语句，须在自动提交事务中执行（CALL {} IN TRANSACTIONS 不能用于事务函数）
+ENTITY_DELETE_QUERY = """
+UNWIND $ids AS entity_id
+CALL {{
+    WITH entity_id
+    MATCH (n:Entity {{id: entity_id}})
+    DETACH DELETE n
+}} IN TRANSACTIONS OF {batch_size} ROWS
+"""
+
+RELATION_DELETE_QUERY = """
+UNWIND $relations AS rel
+CALL {{
+    WITH rel
+    MATCH (:Entity {{id: rel.start_id}})-[r:RELATION {{type: rel.type}}]->(:Entity {{id: rel.end_id}})
+    DELETE r
+}} IN TRANSACTIONS OF {batch_size} ROWS
+"""
+
+# 增量同步清单的默认路径，记录上一次推送到数据库的实体/关系及其内容哈希
+DEFAULT_SYNC_MANIFEST = "./CSV_output/neo4j_sync_manifest.json"
+SYNC_MANIFEST_VERSION = 2
+# 旧版 to_csv 按顺序编号的实体ID（entity_1, entity_2, ...）；stable_entity_id 生成的ID固定为16位十六进制
+LEGACY_ENTITY_ID_PATTERN = "entity_[0-9]{1,15}"
+
+# 可重试的错误：死锁、锁等待超时等瞬时错误，以及连接中断
+RETRYABLE_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)
+
+
+class _DisjointBatchQueue:
+    """
+    并行写入关系时的批次队列，保证同时执行的批次没有公共节点。
+    
+    MERGE (start)-[r]->(end) 会锁住两个端点，只按起点分区时，不同线程的事务仍会争用共同的终点（如“船舶”这类高频实体）。
+    取批次时跳过端点正被其他批次占用的关系，留给之后的批次；一个可取的关系也没有时，等待正在执行的批次完成。
+    """
+    
+    def __init__(self, rows: List[Dict[str, Any]], scan_factor: int = 4):
+        """
+        Args:
+            rows: 关系参数行
+            scan_factor: 取一个批次时最多检查 批次大小 * scan_factor 行，避免每次都扫描整个队列
+        """
+        self._pending = deque(rows)
+        self._locked: set = set()
+        self._scan_factor = scan_factor
+        self._condition = threading.Condition()
+    
+    @staticmethod
+    def _endpoints(row: Dict[str, Any]) -> set:
+        return {str(row["start_id"]), str(row["end_id"])}
+    
+    def take(self, size: int):
+        """
+        取出最多 size 行，其端点不在其他执行中的批次里
+        
+        Returns:
+            (批次, 批次占用的节点)；队列为空时返回 None
+        """
+        with self._condition:
+            while True:
+                if not self._pending:
+                    return None
+                batch, nodes, skipped = [], set(), []
+                examined = 0
+                while self._pending and len(batch) < size and examined < size * self._scan_factor:
+                    row = self._pending.popleft()
+                    examined += 1
+                    endpoints = self._endpoints(row)
+                    if endpoints & self._locked:
+                        skipped.append(row)
+                    else:
+                        batch.append(row)
+                        nodes |= endpoints
+                # 跳过的行放回队首，保持原来的顺序
+                self._pending.extendleft(reversed(skipped))
+                if batch:
+                    self._locked |= nodes
+                    return batch, nodes
+                # 没有执行中的批次时不会有被占用的节点，这里一定有其他批次在执行
+                self._condition.wait()
+    
+    def release(self, nodes: set, requeue: Optional[List[Dict[str, Any]]] = None) -> None:
+        """批次结束后释放其节点；写入失败的批次通过 requeue 放回队首"""
+        with self._condition:
+            self._locked -= nodes
+            if requeue:
+                self._pending.extendleft(reversed(requeue))
+            self._condition.notify_all()
+
+
+class Neo4jBatchLoader:
+    """
+    基于事务函数（session.execute_write）的批量写入器
+    
+    - 每个批次在一个写事务中执行，瞬时错误按指数退避重试，重试用尽后把批次减半再试，仍失败则抛出异常
+    - 批次大小自适应：单批耗时低于目标的一半时加倍，超过目标时减半
+    - 关系由多个线程并行写入，同时执行的批次互不共享节点（起点和终点都算），并行的事务不会争用同一节点上的锁
+    - driver 可以注入，便于连接本地容器或使用测试用的假 driver
+    """
+    
+    def __init__(
+        self,
+        driver,
+        database: Optional[str] = None,
+        batch_size: int = 1000,
+        min_batch_size: int = 100,
+        max_batch_size: int = 10000,
+        adaptive: bool = True,
+        target_seconds: float = 2.0,
+        workers: int = 4,
+        max_retries: int = 5,
+        retry_backoff: float = 0.5,
+        logger: Optional[logging.Logger] = None,
+    ):
+        """
+        Args:
+            driver: neo4j.Driver（或实现 session().execute_write 的对象）
+            database: 数据库名，默认使用服务器的默认数据库
+            batch_size: 初始批次大小
+            min_batch_size: 自适应调整及失败拆分时的最小批次
+            max_batch_size: 自适应调整时的最大批次
+            adaptive: 是否根据单批耗时调整批次大小
+            target_seconds: 单批的目标耗时（秒）
+            workers: 写入关系的并行线程数
+            max_retries: 单个批次遇到瞬时错误时的最大重试次数
+            retry_backoff: 第一次重试前的等待时间（秒），之后每次加倍
+            logger: 日志记录器
+        """
+        self.driver = driver
+        self.database = database
+        self.batch_size = batch_size
+        self.min_batch_size = max(1, min(min_batch_size, batch_size))
+        self.max_batch_size = max(max_batch_size, batch_size)
+        self.adaptive = adaptive
+        self.target_seconds = target_seconds
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.logger = logger or logging.getLogger(__name__)
+    
+    @staticmethod
+    def _run_batch(tx, query: str, param_name: str, rows: List[Dict[str, Any]]) -> int:
+        record = tx.run(query, **{param_name: rows}).single()
+        return record[0] if record else 0
+    
+    def delete_in_transactions(self, query: str, param_name: str, rows: List[Dict[str, Any]]) -> None:
+        """
+        在自动提交事务中执行 CALL {} IN TRANSACTIONS 删除语句，服务端按批提交，不会在一个事务中累积全部删除
+        
+        Args:
+            query: 含 {batch_size} 占位符的删除语句
+            param_name: 参数名
+            rows: 参数
+        """
+        if not rows:
+            return
+        query = query.format(batch_size=self.batch_size)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.driver.session(database=self.database) as session:
+                    session.run(query, **{param_name: rows}).consume()
+                    return
+            except RETRYABLE_ERRORS as e:
+                # 已提交的批次重试时匹配不到，删除语句可以安全地重复执行
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                self.logger.warning(f"删除失败，{delay:.1f} 秒后第 {attempt + 1} 次重试: {e}")
+                time.sleep(delay)
+    
+    def write_batch(self, query: str, param_name: str, rows: List[Dict[str, Any]]) -> int:
+        """
+        在一个写事务中执行一个批次，瞬时错误按指数退避重试
+        
+        Returns:
+            语句返回的计数
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.driver.session(database=self.database) as session:
+                    return session.execute_write(self._run_batch, query, param_name, rows)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                self.logger.warning(f"批次写入失败（{len(rows)} 行），{delay:.1f} 秒后第 {attempt + 1} 次重试: {e}")
+                time.sleep(delay)
+    
+    def _next_batch_size(self, size: int, elapsed: float) -> int:
+        if not self.adaptive:
+            return size
+        if elapsed < self.target_seconds / 2:
+            return min(self.max_batch_size, size * 2)
+        if elapsed > self.target_seconds:
+            return max(self.min_batch_size, size // 2)
+        return size
+    
+    def load(self, query: str, param_name: str, rows: List[Dict[str, Any]],
+             progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        按（自适应的）批次依次写入全部行
+        
+        Args:
+            query: 以 UNWIND ${param_name} 开头的Cypher语句
+            param_name: 批次参数名
+            rows: 参数行
+            progress: 每写完一个批次调用一次，参数为该批次的行数
+            
+        Returns:
+            语句返回的计数之和
+        """
+        size = self.batch_size
+        loaded = 0
+        position = 0
+        while position < len(rows):
+            batch = rows[position:position + size]
+            start = time.perf_counter()
+            try:
+                loaded += self.write_batch(query, param_name, batch)
+            except RETRYABLE_ERRORS:
+                if size <= self.min_batch_size:
+                    raise
+                size = max(self.min_batch_size, size // 2)
+                self.logger.warning(f"批次重试用尽，减小批次为 {size} 行后继续")
+                continue
+            position += len(batch)
+            size = self._next_batch_size(size, time.perf_counter() - start)
+            if progress:
+                progress(len(batch))
+        return loaded
+    
+    def _progress_logger(self, total: int, label: str) -> Callable[[int], None]:
+        lock = threading.Lock()
+        done = 0
+        
+        def progress(count: int) -> None:
+            nonlocal done
+            with lock:
+                done += count
+                self.logger.info(f"已导入 {done}/{total} 个{label}")
+        return progress
+    
+    def load_entities(self, entities: List[Dict[str, Any]]) -> int:
+        """写入实体（KGCSVImporter._entity_batch_params 的输出），单线程"""
+        return self.load(ENTITY_IMPORT_QUERY, "entities", entities, self._progress_logger(len(entities), "实体"))
+    
+    def _load_disjoint(self, queue: _DisjointBatchQueue, progress: Callable[[int], None]) -> int:
+        """从共享队列中取批次写入关系，直到队列为空；批次大小的调整与重试同 load"""
+        size = self.batch_size
+        loaded = 0
+        while True:
+            item = queue.take(size)
+            if item is None:
+                return loaded
+            batch, nodes = item
+            start = time.perf_counter()
+            try:
+                loaded += self.write_batch(RELATION_IMPORT_QUERY, "relations", batch)
+            except RETRYABLE_ERRORS:
+                queue.release(nodes, requeue=batch)
+                if size <= self.min_batch_size:
+                    raise
+                size = max(self.min_batch_size, size // 2)
+                self.logger.warning(f"批次重试用尽，减小批次为 {size} 行后继续")
+                continue
+            except Exception:
+                queue.release(nodes)
+                raise
+            queue.release(nodes)
+            size = self._next_batch_size(size, time.perf_counter() - start)
+            progress(len(batch))
+    
+    def load_relations(self, relations: List[Dict[str, Any]]) -> int:
+        """
+        写入关系（KGCSVImporter._relation_batch_params 的输出）。
+        workers > 1 时多线程并行，同时执行的批次互不共享起点或终点，见 _DisjointBatchQueue
+        """
+        progress = self._progress_logger(len(relations), "关系")
+        workers = min(self.workers, len(relations))
+        if workers <= 1:
+            return self.load(RELATION_IMPORT_QUERY, "relations", relations, progress)
+        
+        queue = _DisjointBatchQueue(relations)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._load_disjoint, queue, progress) for _ in range(workers)]
+            return sum(future.result() for future in futures)
+
 
 class KGCSVImporter:
     """
@@ -267,7 +723,8 @@ class KGCSVImporter:
     专门用于将实体和关系CSV文件导入到Neo4j数据库中
     """
     
-    def __init__(self, uri: str = None, username: str = "neo4j", password: str = None):
+    def __init__(self, uri: str = None, username: str = "neo4j", password: str = None, driver=None,
+                 workers: int = 4, batch_size: int = 1000, adaptive_batch: bool = True):
         """
         初始化知识图谱CSV导入器
         
@@ -275,6 +732,10 @@ class KGCSVImporter:
             uri (str): Neo4j数据库URI
             username (str): 数据库用户名
             password (str): 数据库密码
+            driver: 已创建的 driver（如测试用的假 driver），提供时不再读取连接配置
+            workers (int): 并行写入关系的线程数
+            batch_size (int): 初始批次大小
+            adaptive_batch (bool): 是否根据单批耗时自动调整批次大小
         """
         # 设置日志
         self.logger = logging.getLogger(__name__)
@@ -285,12 +746,18 @@ class KGCSVImporter:
         self.username = username
         self.password = password or os.getenv("NEO4J_PASSWORD")
         
-        # 验证必要参数
-        if not self.uri or not self.password:
-            raise ValueError("请确保设置NEO4J_URI和NEO4J_PASSWORD环境变量")
-            
-        # 初始化数据库驱动
-        self.driver = GraphDatabase.driver(self.uri, auth=(self.username, self.password))
+        if driver is not None:
+            self.driver = driver
+        else:
+            # 验证必要参数
+            if not self.uri or not self.password:
+                raise ValueError("请确保设置NEO4J_URI和NEO4J_PASSWORD环境变量")
+                
+            # 初始化数据库驱动
+            self.driver = GraphDatabase.driver(self.uri, auth=(self.username, self.password))
+        
+        self.loader = Neo4jBatchLoader(self.driver, batch_size=batch_size, adaptive=adaptive_batch,
+                                       workers=workers, logger=self.logger)
         
         # 测试连接
         self._test_connection()
@@ -325,151 +792,316 @@ class KGCSVImporter:
             self.logger.error("CSV文件缺少:LABEL列")
             return 0
         
-        total_count = 0
-        batch_size = 1000
-        
-        for i in range(0, len(df), batch_size):
-            batch = df.iloc[i:i+batch_size]
-            count = self._import_entity_batch(batch)
-            total_count += count
-            self.logger.info(f"已导入 {min(i+batch_size, len(df))}/{len(df)} 个实体")
+        # 写入失败（重试用尽）时抛出异常，不再按0条计入
+        total_count = self.loader.load_entities(self._entity_batch_params(df))
         
         self.logger.info(f"成功导入 {total_count} 个实体")
         return total_count
     
-    def _import_entity_batch(self, batch_df: pd.DataFrame) -> int:
-        """批量导入实体"""
-        query = """
-        UNWIND $entities AS entity
-        MERGE (n:Entity {id: entity.id})
-        SET n += entity.properties
-        WITH n, entity
-        CALL apoc.create.addLabels(n, entity.labels) YIELD node
-        RETURN count(n)
-        """
-        
-        entities_data = []
-        for _, row in batch_df.iterrows():
-            # 准备属性（排除ID和LABEL列）
-            properties = {}
-            for col in row.index:
-                if col not in [':ID', ':LABEL'] and pd.notna(row[col]):
-                    properties[col] = row[col]
-            
-            # 处理标签
-            labels = [label.strip() for label in str(row[':LABEL']).split(';') if label.strip()]
-            
-            entity_data = {
-                "id": row['id:ID'],
-                "properties": properties,
-                "labels": labels
-            }
-            entities_data.append(entity_data)
+    @staticmethod
+    def _entity_batch_params(batch_df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """
+        将实体DataFrame转换为Cypher参数，按列整体处理，不逐行 iterrows
         
-        try:
-            with self.driver.session() as session:
-                result = session.run(query, entities=entities_data)
-                return result.single()[0]
-        except Exception as e:
-            self.logger.error(f"批量导入实体时出错: {e}")
-            return 0
+        Returns:
+            [{"id": ..., "properties": {列名: 值（不含空值）}, "labels": [...]}]
+        """
+        # 属性排除ID和LABEL列；空值先统一替换为 None，to_dict 得到 Python 原生类型
+        property_columns = [col for col in batch_df.columns if col not in (':ID', ':LABEL')]
+        properties_df = batch_df[property_columns].astype(object)
+        properties_df = properties_df.where(properties_df.notna(), None)
+        properties = [
+            {col: value for col, value in row.items() if value is not None}
+            for row in properties_df.to_dict('records')
+        ]
+        
+        # 处理标签
+        labels = [
+            [label.strip() for label in str(value).split(';') if label.strip()]
+            for value in batch_df[':LABEL'].tolist()
+        ]
+        
+        return [
+            {"id": entity_id, "properties": entity_properties, "labels": entity_labels}
+            for entity_id, entity_properties, entity_labels in zip(batch_df['id:ID'].tolist(), properties, labels)
+        ]
+    
+    @staticmethod
+    def _relation_batch_params(batch_df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """将关系DataFrame转换为Cypher参数：[{"start_id": ..., "end_id": ..., "type": ...}]"""
+        return [
+            {"start_id": start_id, "end_id": end_id, "type": rel_type}
+            for start_id, end_id, rel_type in zip(batch_df[':START_ID'].tolist(), batch_df[':END_ID'].tolist(),
+                                                  batch_df[':TYPE'].tolist())
+        ]
     
     def import_relations_from_csv(self, csv_path: str) -> int:
         """使用Python批量导入关系"""
         self.logger.info(f"开始导入关系数据: {csv_path}")
         
         df = pd.read_csv(csv_path, encoding='utf-8')
-        total_count = 0
-        batch_size = 1000
-        
-        for i in range(0, len(df), batch_size):
-            batch = df.iloc[i:i+batch_size]
-            count = self._import_relation_batch(batch)
-            total_count += count
-            self.logger.info(f"已导入 {min(i+batch_size, len(df))}/{len(df)} 个关系")
+        # 多线程并行写入，同时执行的批次互不共享节点
+        total_count = self.loader.load_relations(self._relation_batch_params(df))
         
         self.logger.info(f"成功导入 {total_count} 个关系")
         return total_count
     
-    def _import_relation_batch(self, batch_df: pd.DataFrame) -> int:
-        """批量导入关系"""
-        query = """
-        UNWIND $relations AS rel
-        MATCH (start:Entity {id: rel.start_id})
-        MATCH (end:Entity {id: rel.end_id})
-        MERGE (start)-[r:RELATION {type: rel.type}]->(end)
-        RETURN count(r)
-        """
-        
-        relations_data = []
-        for _, row in batch_df.iterrows():
-            relation_data = {
-                "start_id": row[':START_ID'],
-                "end_id": row[':END_ID'],
-                "type": row[':TYPE']
-            }
-            relations_data.append(relation_data)
-        
-        try:
-            with self.driver.session() as session:
-                result = session.run(query, relations=relations_data)
-                return result.single()[0]
-        except Exception as e:
-            self.logger.error(f"批量导入关系时出错: {e}")
-            return 0
-    
-    def import_from_csv_files(self, entities_csv_path: str, relations_csv_path: str) -> Dict[str, int]:
+    def import_from_csv_files(self, entities_csv_path: str, relations_csv_path: str,
+                              create_indexes: bool = True) -> Dict[str, Any]:
         """
         从CSV文件导入实体和关系数据
         
+        导入前先创建 Entity.id 唯一约束并等待其上线，实体的 MERGE 和关系端点的 MATCH 都走索引查找；
+        name/type 等其他索引在数据导入完成后再创建，避免导入期间逐条维护。
+        
         Args:
             entities_csv_path (str): 实体CSV文件路径
             relations_csv_path (str): 关系CSV文件路径
+            create_indexes (bool): 导入完成后是否创建其他索引
             
         Returns:
-            Dict[str, int]: 导入统计信息
+            Dict[str, Any]: 导入统计信息，phase_seconds 为各阶段耗时（秒）
         """
         self.logger.info("开始批量导入实体和关系数据")
+        phase_seconds: Dict[str, float] = {}
+        
+        def run_phase(name, func, *args):
+            start = time.perf_counter()
+            result = func(*args)
+            phase_seconds[name] = round(time.perf_counter() - start, 3)
+            self.logger.info(f"阶段 {name} 耗时 {phase_seconds[name]:.2f} 秒")
+            return result
+        
+        # 创建唯一约束
+        run_phase("constraints", self.create_constraints)
         
         # 导入实体
-        entity_count = self.import_entities_from_csv(entities_csv_path)
+        entity_count = run_phase("entities", self.import_entities_from_csv, entities_csv_path)
         
         # 导入关系
-        relation_count = self.import_relations_from_csv(relations_csv_path)
+        relation_count = run_phase("relations", self.import_relations_from_csv, relations_csv_path)
+        
+        # 导入完成后再创建其他索引
+        if create_indexes:
+            run_phase("indexes", self.create_indexes)
         
         # 返回统计信息
         stats = {
             "entities_imported": entity_count,
-            "relations_imported": relation_count
+            "relations_imported": relation_count,
+            "phase_seconds": phase_seconds
         }
         
         self.logger.info(f"批量导入完成: {stats}")
         return stats
     
-    def clear_database(self):
+    @staticmethod
+    def _content_hash(value: Any) -> str:
+        return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    def _sync_state(self, entities_csv_path: str, relations_csv_path: str):
+        """
+        读取CSV并计算增量同步所需的状态。实体以名称为键，关系以 (起点名称, 关系类型, 终点名称) 为键，
+        不依赖CSV中实体的顺序和ID。
+        
+        Returns:
+            (实体名称 -> 参数, 实体名称 -> [ID, 哈希], 关系键 -> 参数, 关系键 -> [起点ID, 终点ID, 哈希])；
+            关系键为 [起点名称, 关系类型, 终点名称] 的JSON字符串
+        """
+        entities = {}
+        for entity in self._entity_batch_params(pd.read_csv(entities_csv_path, encoding='utf-8')):
+            # 没有 name 列的CSV退回以ID为键
+            entities[str(entity["properties"].get("name", entity["id"]))] = entity
+        id_names = {str(entity["id"]): name for name, entity in entities.items()}
+        
+        relations = {}
+        for relation in self._relation_batch_params(pd.read_csv(relations_csv_path, encoding='utf-8')):
+            start_id, end_id = str(relation["start_id"]), str(relation["end_id"])
+            key = json.dumps([id_names.get(start_id, start_id), relation["type"], id_names.get(end_id, end_id)],
+                             ensure_ascii=False, default=str)
+            relations[key] = relation
+        
+        entity_state = {name: [str(entity["id"]), self._content_hash(entity)] for name, entity in entities.items()}
+        relation_state = {key: [str(relation["start_id"]), str(relation["end_id"]), self._content_hash(relation)]
+                          for key, relation in relations.items()}
+        return entities, entity_state, relations, relation_state
+    
+    @staticmethod
+    def _load_sync_manifest(manifest_file: str) -> Dict[str, Dict[str, List[str]]]:
+        if not os.path.exists(manifest_file):
+            return {"entities": {}, "relations": {}}
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SYNC_MANIFEST_VERSION:
+            raise ValueError(f"同步清单 {manifest_file} 的版本不受支持，请先全量导入")
+        return manifest
+    
+    @staticmethod
+    def _save_sync_manifest(manifest_file: str, entity_state: Dict[str, List[str]],
+                            relation_state: Dict[str, List[str]]):
+        """先写临时文件再替换，同步中途失败时保留上一次的清单"""
+        manifest_dir = os.path.dirname(manifest_file)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        tmp_file = f"{manifest_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"version": SYNC_MANIFEST_VERSION, "entities": entity_state, "relations": relation_state},
+                      f, ensure_ascii=False)
+        os.replace(tmp_file, manifest_file)
+    
+    def write_sync_manifest(self, entities_csv_path: str, relations_csv_path: str,
+                            manifest_file: str = DEFAULT_SYNC_MANIFEST):
+        """将CSV的当前内容记为已推送到数据库（全量导入后调用）"""
+        _, entity_state, _, relation_state = self._sync_state(entities_csv_path, relations_csv_path)
+        self._save_sync_manifest(manifest_file, entity_state, relation_state)
+        self.logger.info(f"同步清单已保存: {manifest_file}")
+    
+    def sync_from_csv_files(self, entities_csv_path: str, relations_csv_path: str,
+                            manifest_file: str = DEFAULT_SYNC_MANIFEST, rebuild_manifest: bool = False) -> Dict[str, Any]:
+        """
+        增量同步：与同步清单中上一次推送的内容哈希比较，只写入新增/修改的实体与新增的关系，删除已不存在的实体与关系。
+        耗时与变化量成正比，而不是与整个图的大小成正比。
+        
+        实体按名称、关系按 (起点名称, 关系类型, 终点名称) 比较，CSV 需由 to_csv 生成（实体ID由名称得到，见 stable_entity_id）。
+        同名实体的ID发生变化时（如旧版按顺序编号的CSV），删除旧节点后重新写入，其关系也随之重新写入。
+        
+        没有清单时无法知道数据库中已有哪些数据，默认拒绝执行，应先全量导入（import_from_csv_files 后调用 write_sync_manifest）。
+        rebuild_manifest=True 时把CSV中的全部实体和关系按新增写入（MERGE）并重新生成清单：只有数据库为空，
+        或由当前版本的 to_csv 导入（ID与 stable_entity_id 一致）时才不会产生重复节点；数据库中有旧版按顺序编号的
+        实体时仍然拒绝执行。这种情况下数据库中多出的实体和关系不会被删除。
+        
+        清单只在全部写入成功后更新，中途失败时重新运行即可（写入与删除均可重复执行）。
+        
+        Args:
+            entities_csv_path (str): 实体CSV文件路径
+            relations_csv_path (str): 关系CSV文件路径
+            manifest_file (str): 同步清单路径
+            rebuild_manifest (bool): 清单不存在时仍然执行，并重新生成清单
+            
+        Returns:
+            Dict[str, Any]: 各类变化的数量与各阶段耗时
+        """
+        self.logger.info("开始增量同步实体和关系数据")
+        phase_seconds: Dict[str, float] = {}
+        start = time.perf_counter()
+        
+        if not os.path.exists(manifest_file):
+            if not rebuild_manifest:
+                raise ValueError(f"同步清单 {manifest_file} 不存在，无法确定数据库中已有的数据。请先全量导入（不加 --delta），"
+                                 f"或在确认数据库为空或由当前版本的 to_csv 导入后使用 --rebuild-manifest")
+            legacy_count = self.count_legacy_entities()
+            if legacy_count:
+                raise ValueError(f"数据库中有 {legacy_count} 个按顺序编号的实体（旧版导入），"
+                                 f"按新的实体ID同步会产生重复节点，请先全量导入")
+            self.logger.warning(f"同步清单 {manifest_file} 不存在，全部实体和关系按新增写入并重新生成清单")
+        
+        manifest = self._load_sync_manifest(manifest_file)
+        entities, entity_state, relations, relation_state = self._sync_state(entities_csv_path, relations_csv_path)
+        old_entities, old_relations = manifest["entities"], manifest["relations"]
+        
+        upsert_entities = [entity for name, entity in entities.items() if old_entities.get(name) != entity_state[name]]
+        # 已不存在的实体，以及ID发生变化的实体的旧节点
+        delete_entity_ids = [old_id for name, (old_id, _) in old_entities.items()
+                             if name not in entity_state or entity_state[name][0] != old_id]
+        insert_relations = [relation for key, relation in relations.items()
+                            if old_relations.get(key) != relation_state[key]]
+        # 被删除的实体上的关系由 DETACH DELETE 一并删除
+        deleted_ids = set(delete_entity_ids)
+        delete_relations = []
+        for key, (start_id, end_id, old_hash) in old_relations.items():
+            if relation_state.get(key) == [start_id, end_id, old_hash]:
+                continue
+            if start_id in deleted_ids or end_id in deleted_ids:
+                continue
+            delete_relations.append({"start_id": start_id, "end_id": end_id, "type": json.loads(key)[1]})
+        phase_seconds["diff"] = round(time.perf_counter() - start, 3)
+        
+        stats = {
+            "entities_upserted": len(upsert_entities),
+            "entities_deleted": len(delete_entity_ids),
+            "relations_inserted": len(insert_relations),
+            "relations_deleted": len(delete_relations),
+            "entities_unchanged": len(entities) - len(upsert_entities),
+            "relations_unchanged": len(relations) - len(insert_relations),
+        }
+        self.logger.info(f"变化: {stats}")
+        
+        def run_phase(name, func, *args):
+            phase_start = time.perf_counter()
+            func(*args)
+            phase_seconds[name] = round(time.perf_counter() - phase_start, 3)
+        
+        run_phase("constraints", self.create_constraints)
+        run_phase("delete_relations", self.loader.delete_in_transactions, RELATION_DELETE_QUERY, "relations", delete_relations)
+        run_phase("delete_entities", self.loader.delete_in_transactions, ENTITY_DELETE_QUERY, "ids", delete_entity_ids)
+        run_phase("upsert_entities", self.loader.load, ENTITY_UPSERT_QUERY, "entities", upsert_entities)
+        run_phase("insert_relations", self.loader.load_relations, insert_relations)
+        
+        self._save_sync_manifest(manifest_file, entity_state, relation_state)
+        stats["phase_seconds"] = phase_seconds
+        self.logger.info(f"增量同步完成: {stats}")
+        return stats
+    
+    def count_legacy_entities(self) -> int:
+        """数据库中ID为旧版顺序编号（entity_1, entity_2, ...）的实体数"""
+        with self.driver.session() as session:
+            record = session.run(
+                "MATCH (n:Entity) WHERE n.id =~ $pattern RETURN count(n) AS count",
+                pattern=LEGACY_ENTITY_ID_PATTERN
+            ).single()
+        return record[0] if record else 0
+    
+    def clear_database(self, batch_size: int = 10000, manifest_file: Optional[str] = DEFAULT_SYNC_MANIFEST):
         """
         清空数据库中的所有实体和关系
+        
+        Args:
+            batch_size (int): 每个事务删除的节点数（DETACH DELETE 同时删除其关系）
+            manifest_file (str): 清空后同时删除的增量同步清单
         """
         self.logger.warning("正在清空数据库...")
         
         with self.driver.session() as session:
-            # 删除所有关系
-            session.run("MATCH ()-[r]->() DELETE r")
-            self.logger.info("已删除所有关系")
-            
-            # 删除所有节点
-            session.run("MATCH (n) DELETE n")
-            self.logger.info("已删除所有节点")
+            # 分批删除所有节点及其关系，避免在一个事务中删除整个图
+            session.run(
+                f"MATCH (n) CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF {int(batch_size)} ROWS"
+            ).consume()
+            self.logger.info("已删除所有节点和关系")
             
             # 删除所有约束
             session.run("DROP CONSTRAINT entity_id_unique IF EXISTS")
             self.logger.info("已删除所有约束")
+            
+            # 删除其他索引，重新导入时在数据导入完成后再创建
+            for index_name in ("entity_name_index", "entity_type_index", "relation_type_index"):
+                session.run(f"DROP INDEX {index_name} IF EXISTS")
+            self.logger.info("已删除所有索引")
+        
+        # 数据库已清空，清单中记录的内容不再有效
+        if manifest_file and os.path.exists(manifest_file):
+            os.remove(manifest_file)
         
         self.logger.info("数据库清空完成")
     
-    def create_indexes(self):
+    def create_constraints(self, timeout: int = 300):
         """
-        创建数据库索引以提高查询性能
+        创建 Entity.id 唯一约束（同时生成 id 上的索引），并等待索引上线后再返回
+        
+        Args:
+            timeout (int): 等待索引上线的最长时间（秒）
+        """
+        with self.driver.session() as session:
+            session.run("CREATE CONSTRAINT entity_id_unique IF NOT EXISTS FOR (e:Entity) REQUIRE e.id IS UNIQUE")
+            session.run("CALL db.awaitIndexes($timeout)", timeout=timeout).consume()
+        
+        self.logger.info("Entity.id 唯一约束已就绪")
+    
+    def create_indexes(self, timeout: int = 300):
+        """
+        创建数据库索引以提高查询性能，并等待索引上线
+        
+        Args:
+            timeout (int): 等待索引上线的最长时间（秒）
         """
         with self.driver.session() as session:
             # 为实体名称创建索引
@@ -480,6 +1112,8 @@ class KGCSVImporter:
             
             # 为关系类型创建索引
             session.run("CREATE INDEX relation_type_index IF NOT EXISTS FOR ()-[r:RELATION]-() ON (r.type)")
+            
+            session.run("CALL db.awaitIndexes($timeout)", timeout=timeout).consume()
         
         self.logger.info("数据库索引创建完成")
 
@@ -487,9 +1121,31 @@ class KGCSVImporter:
 
 # 使用示例
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Import entity and relation CSV files into Neo4j')
+    parser.add_argument('--entities_csv', type=str, default="./CSV_output/nodes.csv", help='Entity CSV file')
+    parser.add_argument('--relations_csv', type=str, default="./CSV_output/triples.csv", help='Relation CSV file')
+    parser.add_argument('--delta', action='store_true',
+                        help='Only push changes since the last import (see --manifest) instead of clearing and reimporting')
+    parser.add_argument('--manifest', type=str, default=DEFAULT_SYNC_MANIFEST, help='Delta sync manifest path')
+    parser.add_argument('--rebuild-manifest', action='store_true',
+                        help='With --delta and no manifest: MERGE every row and write a new manifest '
+                             '(only safe on an empty database or one imported by the current to_csv)')
+    parser.add_argument('--workers', type=int, default=4, help='Parallel relation writers')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Initial rows per transaction')
+    args = parser.parse_args()
+    
     # 创建导入器实例
-    importer = KGCSVImporter()
-    importer.clear_database()
-    importer.import_from_csv_files(entities_csv_path="./CSV_output/nodes.csv", relations_csv_path="./CSV_output/triples.csv")
+    importer = KGCSVImporter(workers=args.workers, batch_size=args.batch_size)
+    if args.delta:
+        importer.sync_from_csv_files(args.entities_csv, args.relations_csv, manifest_file=args.manifest,
+                                     rebuild_manifest=args.rebuild_manifest)
+    else:
+        importer.clear_database(manifest_file=args.manifest)
+        importer.import_from_csv_files(entities_csv_path=args.entities_csv, relations_csv_path=args.relations_csv)
+        # 记录本次导入的内容，之后可以用 --delta 增量同步
+        importer.write_sync_manifest(args.entities_csv, args.relations_csv, manifest_file=args.manifest)
+    importer.close()
     print("导入完毕")
     
\ No newline at end of file
@@ -32,6 +32,9 @@ class EntityWithTriples(BaseModel):
     entities: List[Entity] = Field(description="从文本中抽取到的实体列表")
     triples: List[Triple] = Field(description="从文本中抽取到的三元组列表")
 
+class EntitySummary(BaseModel):
+    summary: str = Field(description="归纳后的实体摘要")
+
 
 class QwenSafeJsonParser(PydanticOutputParser):
     def parse(self, text: str) -> dict:
@@ -259,6 +262,30 @@ def _make_triple_extraction_prompt() -> tuple[PromptTemplate, QwenSafeJsonParser
     return prompt, parser
 
 
+def _make_summary_consolidation_prompt() -> tuple[PromptTemplate, QwenSafeJsonParser]:
+    parser = QwenSafeJsonParser(pydantic_object=EntitySummary)
+    summary_template = """
+    你是一名船舶制造领域的知识工程师。以下是实体“{entity_name}”在不同文本块中抽取到的多条摘要片段：
+    {fragments}
+
+    请将这些片段归纳为一段完整的摘要：
+    1. 只保留片段中出现的信息，不得自行编造或泛化；
+    2. 合并重复、近义的描述，保留功能、作用、结构特点、使用条件等具体信息；
+    3. 摘要不超过 {max_chars} 个字符。
+
+    {format_instructions}
+    请严格输出为json格式，不要额外文字。 /no think
+    """.strip()
+
+    prompt = PromptTemplate(
+        template=summary_template,
+        input_variables=["entity_name", "fragments", "max_chars"],
+        partial_variables={"format_instructions": parser.get_format_instructions()}
+    )
+
+    return prompt, parser
+
+
 # =========================
 # 3. Unified Access Interface: Prompts Namespace Class
 # ========================= 
@@ -281,4 +308,9 @@ class Prompts:
         """Prompt and parser for entity and triple extraction task."""
         return _make_triple_extraction_prompt()
 
-    
\ No newline at end of file
+    
+
+    @staticmethod
+    def get_summary_consolidation_prompt() -> tuple[PromptTemplate, QwenSafeJsonParser]:
+        """Prompt and parser for merging the summary fragments of one entity."""
+        return _make_summary_consolidation_prompt()
@@ -1,56 +1,27 @@
 #!/bin/bash
 
-# batch_process.sh - 分批处理chunks的脚本
+# relation_batch_process.sh - 分批处理chunks的脚本
+# 实际的分批、断点续跑由 batch_driver.py 在单个Python进程内完成，进度记录在 logs/relation_manifest.json
 
 # 配置参数
 INPUT_FILE="./chunks_output/relation_chunks.jsonl"
 OUTPUT_DIR="./triplets_output"
 ENTITY_FILE="./kg_output/entities_kb.json"
 BATCH_SIZE=50
-START_INDEX=1218
+CONCURRENCY=8
 
-# 获取总chunk数
-echo "Getting total number of chunks..."
-TOTAL_CHUNKS=$(wc -l < "$INPUT_FILE")
-echo "Total chunks: $TOTAL_CHUNKS"
-
-# 创建输出目录
-mkdir -p "$OUTPUT_DIR"
+echo "========================================"
+echo "Relation extraction: $INPUT_FILE -> $OUTPUT_DIR"
+echo "========================================"
 
-# 计算需要处理的批次数
-TOTAL_BATCHES=$(( (TOTAL_CHUNKS + BATCH_SIZE - 1) / BATCH_SIZE ))
-echo "Total batches to process: $TOTAL_BATCHES"
+python batch_driver.py --task relation --resume --input_file "$INPUT_FILE" --output_dir "$OUTPUT_DIR" --entities_file "$ENTITY_FILE" --batch-size $BATCH_SIZE --concurrency $CONCURRENCY "$@"
 
-# 分批处理
-batch_num=1
-for ((start=$START_INDEX; start<TOTAL_CHUNKS; start+=BATCH_SIZE)); do
-    end=$((start + BATCH_SIZE))
-    if [ $end -gt $TOTAL_CHUNKS ]; then
-        end=$TOTAL_CHUNKS
-    fi
-    
+if [ $? -eq 0 ]; then
     echo "========================================"
-    echo "Processing batch $batch_num of $TOTAL_BATCHES"
-    echo "Chunks: $start to $((end-1))"
+    echo "Batch processing completed!"
+    echo "Results saved to: $OUTPUT_DIR"
     echo "========================================"
-    
-    # 运行Python脚本
-    python get_relations.py --start $start --end $end --input_file "$INPUT_FILE" --output_dir "$OUTPUT_DIR" --entities_file "$ENTITY_FILE"
-    
-    if [ $? -eq 0 ]; then
-        echo "✓ Batch $batch_num completed successfully"
-    else
-        echo "✗ Error in batch $batch_num"
-        echo "Continuing with next batch..."
-    fi
-    
-    batch_num=$((batch_num + 1))
-    
-    # 添加延迟避免过载
-    sleep 2
-done
-
-echo "========================================"
-echo "Batch processing completed!"
-echo "Results saved to: $OUTPUT_DIR"
-echo "========================================"
\ No newline at end of file
+else
+    echo "✗ Batch processing stopped, rerun this script to resume"
+    exit 1
+fi
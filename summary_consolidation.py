@@ -0,0 +1,192 @@
+# summary_consolidation.py
+# 实体摘要合并：保留去重后的句子并限制总长度，替代无限增长的 "old | new" 拼接
+# 可选调用LLM，将句子较多的摘要批量归纳为一段（经 llm_cache 缓存）
+
+import logging
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+SUMMARY_SEPARATOR = " | "
+DEFAULT_SUMMARY_MAX_CHARS = 300
+
+# 句子以中英文句末标点结尾，标点保留在句子中
+_SENTENCE_PATTERN = re.compile(r"[^。！？；!?;\n]+[。！？；!?;]*")
+_TRAILING_PUNCTUATION = "。！？；!?;.，,、 "
+
+logger = logging.getLogger(__name__)
+
+
+def split_sentences(summary: str) -> List[str]:
+    """
+    将摘要拆分为句子；已合并过的摘要先按 " | " 拆开
+    """
+    sentences = []
+    for fragment in (summary or "").split(SUMMARY_SEPARATOR):
+        for match in _SENTENCE_PATTERN.finditer(fragment):
+            sentence = match.group(0).strip()
+            if sentence.strip(_TRAILING_PUNCTUATION):
+                sentences.append(sentence)
+    return sentences
+
+
+def _sentence_key(sentence: str) -> str:
+    """去重用的句子键：全角/半角统一，去掉空白与句末标点"""
+    normalized = unicodedata.normalize("NFKC", sentence)
+    return "".join(normalized.split()).rstrip(_TRAILING_PUNCTUATION)
+
+
+class SummaryAccumulator:
+    """
+    按首次出现顺序保存去重后的句子，总长度不超过 max_chars。
+    第一次放不下某个句子后即停止接收，这样两个累加器依次合并（a.extend(b.sentences)）
+    与串行处理所有片段的结果相同，可用于并行归并。
+    """
+
+    __slots__ = ("max_chars", "sentences", "seen", "length", "full")
+
+    def __init__(self, max_chars: Optional[int] = DEFAULT_SUMMARY_MAX_CHARS):
+        """
+        Args:
+            max_chars: 摘要最大字符数，None 或 0 表示不限制
+        """
+        self.max_chars = max_chars
+        self.sentences: List[str] = []
+        self.seen = set()
+        self.length = 0
+        self.full = False
+
+    def add(self, summary: str) -> None:
+        """加入一条原始摘要"""
+        self.extend(split_sentences(summary))
+
+    def extend(self, sentences: Iterable[str]) -> None:
+        """加入已拆分好的句子"""
+        for sentence in sentences:
+            if self.full:
+                return
+            key = _sentence_key(sentence)
+            if key in self.seen:
+                continue
+            extra = len(sentence) + (len(SUMMARY_SEPARATOR) if self.sentences else 0)
+            if self.max_chars and self.length + extra > self.max_chars:
+                if not self.sentences:
+                    # 第一句就超长时截断保留
+                    self.sentences.append(sentence[:self.max_chars])
+                    self.length = self.max_chars
+                self.full = True
+                return
+            self.seen.add(key)
+            self.sentences.append(sentence)
+            self.length += extra
+
+    def value(self) -> str:
+        return SUMMARY_SEPARATOR.join(self.sentences)
+
+
+def summary_accumulator(summary: str, max_chars: Optional[int] = DEFAULT_SUMMARY_MAX_CHARS) -> SummaryAccumulator:
+    """
+    以一条摘要创建累加器。逐chunk合并实体时每个实体保留一个累加器，之后的摘要用 add 加入，
+    写出结果时再用 finalize_summaries 转为字符串；不要每次合并都从截断后的字符串重建，
+    否则会丢失“已满”状态，结果与 entity_db 的合并不一致。
+    """
+    accumulator = SummaryAccumulator(max_chars)
+    accumulator.add(summary)
+    return accumulator
+
+
+def finalize_summaries(entities: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """复制实体列表，summary 中的累加器转为字符串，用于写出结果"""
+    return [dict(entity, summary=entity["summary"].value()) for entity in entities]
+
+
+def consolidate_summary(summary: str, max_chars: Optional[int] = DEFAULT_SUMMARY_MAX_CHARS) -> str:
+    """对已有摘要（如旧版本生成的实体库）去重并截断"""
+    accumulator = SummaryAccumulator(max_chars)
+    accumulator.add(summary)
+    return accumulator.value()
+
+
+class LLMSummaryConsolidator:
+    """
+    对句子数较多的实体摘要，调用LLM将至多 batch_fragments 条片段归纳为一段摘要。
+    请求经 llm_cache 缓存，重复运行不会重复调用模型；LLM调用失败时保留原摘要。
+    """
+
+    def __init__(
+        self,
+        max_chars: int = DEFAULT_SUMMARY_MAX_CHARS,
+        min_sentences: int = 4,
+        batch_fragments: int = 20,
+        concurrency: int = 4,
+        use_cache: bool = True,
+        cache_file: Optional[str] = None,
+        endpoints: Optional[List[str]] = None,
+    ):
+        """
+        Args:
+            max_chars: 归纳后摘要的最大字符数
+            min_sentences: 摘要句子数不少于该值时才调用LLM
+            batch_fragments: 每次请求最多交给LLM的片段数
+            concurrency: 最大并发请求数
+            use_cache: 是否使用LLM响应缓存
+            cache_file: 缓存文件路径，默认 llm_cache.DEFAULT_CACHE_FILE
+            endpoints: 多个vLLM地址时使用负载均衡连接池
+        """
+        # 只有启用LLM归纳时才需要 LangChain 及模型客户端
+        from llm_cache import DEFAULT_CACHE_FILE, build_llm_cache
+        from llm_model import VLLMModel
+        from prompts import Prompts
+
+        self.max_chars = max_chars
+        self.min_sentences = min_sentences
+        self.batch_fragments = batch_fragments
+        self.concurrency = concurrency
+
+        self.llm_cache = build_llm_cache(use_cache, cache_file or DEFAULT_CACHE_FILE)
+        if endpoints:
+            self.model = VLLMModel().get_pooled_model(endpoints, cache=self.llm_cache)
+        else:
+            self.model = VLLMModel().get_local_model(cache=self.llm_cache)
+        self.prompt, self.parser = Prompts.get_summary_consolidation_prompt()
+        self.chain = self.prompt | self.model
+
+    def consolidate(self, entities: List[Dict[str, Any]]) -> int:
+        """
+        原地更新实体列表中的 summary 字段
+
+        Returns:
+            被LLM重写的摘要数量
+        """
+        from async_runner import iter_chain_results
+
+        tasks = []
+        for index, entity in enumerate(entities):
+            sentences = split_sentences(entity.get("summary", ""))
+            if len(sentences) < self.min_sentences:
+                continue
+            fragments = "\n".join(f"{i}. {s}" for i, s in enumerate(sentences[:self.batch_fragments], 1))
+            tasks.append((index, {
+                "entity_name": entity["entity_name"],
+                "fragments": fragments,
+                "max_chars": self.max_chars,
+            }))
+
+        logger.info(f"Summarizing {len(tasks)} entities with the LLM")
+        updated = 0
+        for index, output, error in iter_chain_results(self.chain, tasks, self.concurrency):
+            if error is None:
+                try:
+                    summary = self.parser.parse(output.content).summary.strip()
+                except Exception as e:
+                    error = e
+            if error is not None:
+                logger.warning(f"Failed to summarize entity {entities[index]['entity_name']}: {error}")
+                continue
+            if summary:
+                entities[index]["summary"] = summary[:self.max_chars]
+                updated += 1
+
+        if self.llm_cache is not None:
+            logger.info(f"LLM cache stats: {self.llm_cache.stats()}")
+        return updated
@@ -0,0 +1,66 @@
+# test_ac_automaton.py
+# ACEntityMatcher 最左最长匹配的回归测试
+# 用法：python -m pytest -q tests
+
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ac_automaton import ACEntityMatcher
+
+
+def make_matcher(tmp_path, names):
+    entities_file = tmp_path / "entities_kb.json"
+    entities_file.write_text(json.dumps([{"entity_name": name} for name in names], ensure_ascii=False),
+                             encoding="utf-8")
+    return ACEntityMatcher(str(entities_file), use_cache=False)
+
+
+def brute_force_longest(text, names):
+    """逐个位置取最长的实体，命中后跳到其末尾"""
+    spans = []
+    pos = 0
+    while pos < len(text):
+        candidates = [name for name in names if text.startswith(name, pos)]
+        if candidates:
+            name = max(candidates, key=len)
+            spans.append((pos, pos + len(name), name))
+            pos += len(name)
+        else:
+            pos += 1
+    return spans
+
+
+def test_longest_keeps_match_after_failed_longer_prefix(tmp_path):
+    # relation_chunks 第380行末尾：“纵向钢珠滑道下水”在“滑道”后匹配失败，iter_long 会漏掉“钢珠滑道”
+    names = ["纵向钢珠滑道下水", "钢珠滑道下水", "钢珠滑道", "钢珠", "保距器", "滑道"]
+    matcher = make_matcher(tmp_path, names)
+    text = "落下的钢珠和保距器。\n\n图7-2 纵向钢珠滑道"
+    assert matcher.match_spans(text, mode="longest") == [
+        (3, 5, "钢珠"),
+        (6, 9, "保距器"),
+        (len(text) - 4, len(text), "钢珠滑道"),
+    ]
+
+
+def test_longest_resolves_overlaps_leftmost_first(tmp_path):
+    matcher = make_matcher(tmp_path, ["埋弧焊接", "焊接", "焊接工艺", "工艺"])
+    assert matcher.match_spans("埋弧焊接工艺", mode="longest") == [(0, 4, "埋弧焊接"), (4, 6, "工艺")]
+    assert [entity["entity_name"] for entity in matcher.match_entities("埋弧焊接工艺", mode="longest")] == \
+        ["埋弧焊接", "工艺"]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_longest_matches_brute_force(tmp_path, seed):
+    rng = random.Random(seed)
+    alphabet = "abc"
+    names = sorted({"".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5))) for _ in range(15)})
+    matcher = make_matcher(tmp_path, names)
+    for _ in range(300):
+        text = "".join(rng.choice(alphabet + "x") for _ in range(rng.randint(0, 30)))
+        assert matcher.match_spans(text, mode="longest") == brute_force_longest(text, names)
@@ -0,0 +1,50 @@
+# test_chunk_journal.py
+# 不同范围（--end 或批大小不同）之间复用已完成的chunk，以及删除被新范围完全覆盖的旧输出
+# 用法：python -m pytest -q tests
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_journal import ChunkJournal, load_range_journal, range_file, remove_superseded_range_files
+
+
+def write_range(output_dir, start, end, indices):
+    with ChunkJournal(range_file(output_dir, "triples", start, end, ".journal.jsonl")) as journal:
+        for index in indices:
+            journal.append({"index": index, "chunk_id": index, "triples": [f"t{index}"]})
+    with open(range_file(output_dir, "triples", start, end, ".json"), "w", encoding="utf-8") as f:
+        json.dump([f"t{index}" for index in indices], f)
+
+
+def test_new_range_reuses_chunks_of_other_ranges(tmp_path):
+    output_dir = str(tmp_path)
+    write_range(output_dir, 0, 9, range(10))
+    write_range(output_dir, 10, 19, range(10, 15))
+    # 另一个进程正在写入的日志：末尾的半行不能被截断
+    partial_file = range_file(output_dir, "triples", 30, 39, ".journal.jsonl")
+    with open(partial_file, "w", encoding="utf-8") as f:
+        f.write('{"index": 30, "triples": []}\n{"index": 31')
+
+    journal, completed = load_range_journal(output_dir, "triples", 5, 34)
+    journal.close()
+    assert sorted(completed) == list(range(5, 15)) + [30]
+    assert open(partial_file, encoding="utf-8").read().endswith('{"index": 31')
+
+    # 复用的记录已复制到新范围的日志中
+    assert sorted(ChunkJournal(journal.journal_file).load()) == sorted(completed)
+
+
+def test_remove_superseded_range_files(tmp_path):
+    output_dir = str(tmp_path)
+    write_range(output_dir, 0, 9, range(10))
+    write_range(output_dir, 10, 19, range(10, 20))
+    write_range(output_dir, 20, 29, range(20, 30))
+
+    # 10-19 中的 chunk 12 失败，旧文件保留；20-29 只部分重叠
+    removed = remove_superseded_range_files(output_dir, "triples", 0, 24, [i for i in range(25) if i != 12])
+    assert sorted(os.path.basename(path) for path in removed) == ["triples_0_9.journal.jsonl", "triples_0_9.json"]
+    assert sorted(os.listdir(output_dir)) == ["triples_10_19.journal.jsonl", "triples_10_19.json",
+                                              "triples_20_29.journal.jsonl", "triples_20_29.json"]
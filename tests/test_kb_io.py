@@ -0,0 +1,27 @@
+# test_kb_io.py
+# kb_io 增量解析 JSON 数组的回归测试：元素跨越读取块边界时的解析
+# 用法：python -m pytest -q tests
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kb_io import _iter_json_array
+
+
+@pytest.mark.parametrize("text", [
+    '[1.5e3]',
+    '[ 12345 , 6.0E+2, -7 ]',
+    '[1.5e3, -2, 3.25, true, null, "x", {"a": 10.5}, [1, 2e-3]]',
+    '[{"entity_name": "焊接", "chunk_ids": [1, 20]}, 100000]',
+    '[]',
+])
+def test_numbers_split_across_blocks(tmp_path, text):
+    path = tmp_path / "records.json"
+    path.write_text(text, encoding="utf-8")
+    for block_size in range(1, len(text) + 2):
+        assert list(_iter_json_array(str(path), block_size)) == json.loads(text), block_size
@@ -0,0 +1,33 @@
+# test_llm_cache.py
+# 缓存键只取决于模型与生成参数：单个 ChatOpenAI 与多副本连接池（不同地址、数量）共用缓存条目
+# 用法：python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+pytest.importorskip("dotenv")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_cache import SQLiteLLMCache
+from llm_model import VLLMModel
+
+
+def test_pooled_model_shares_cache_key_with_single_client():
+    vllm = VLLMModel(model_name="Qwen3-8B", base_url="http://127.0.0.1:8000/v1", api_key="test")
+    single = vllm.get_model()
+    pooled = vllm.get_pooled_model(["http://127.0.0.1:8001/v1", "http://127.0.0.1:8002/v1"])
+    other_pool = vllm.get_pooled_model(["http://127.0.0.1:8003/v1"], max_retries=0)
+
+    keys = {SQLiteLLMCache._make_key("prompt", model._get_llm_string()) for model in (single, pooled, other_pool)}
+    assert len(keys) == 1
+    # 生成参数不同则不共用
+    assert SQLiteLLMCache._make_key("prompt", pooled._get_llm_string(stop=["\n"])) not in keys
+
+
+def test_pooled_model_retries_by_default():
+    pooled = VLLMModel(model_name="Qwen3-8B", api_key="test").get_pooled_model(["http://127.0.0.1:8001/v1"])
+    assert all(model.max_retries == 3 for model in pooled.models)
@@ -0,0 +1,161 @@
+# test_neo4j_batch_loader.py
+# 用假 driver 测试 Neo4jBatchLoader：重试、失败拆分，以及并行写入关系时同时执行的批次互不共享节点
+# 用法：python -m pytest -q tests
+
+import os
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("neo4j")
+pytest.importorskip("dotenv")
+pytest.importorskip("pandas")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neo4j.exceptions import ServiceUnavailable, TransientError
+
+from neo4j_database import KGCSVImporter, Neo4jBatchLoader
+
+
+class FakeResult:
+    def __init__(self, count):
+        self.count = count
+
+    def single(self):
+        return [self.count]
+
+
+class FakeDriver:
+    """
+    模拟 execute_write：按概率抛出瞬时错误（不提交），成功时记录提交的行；
+    记录执行中的事务占用的节点，发现两个事务同时占用同一节点时记为冲突
+    """
+
+    def __init__(self, failure_rate=0.0, always_fail=False, delay=0.0, seed=0):
+        self.failure_rate = failure_rate
+        self.always_fail = always_fail
+        self.delay = delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.committed = []
+        self.active_nodes = {}
+        self.conflicts = 0
+        self.max_active = 0
+        self.legacy_entities = 0
+
+    def session(self, **kwargs):
+        return FakeSession(self)
+
+    def close(self):
+        pass
+
+
+class FakeTx:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, **params):
+        rows = next(iter(params.values()))
+        driver = self.driver
+        nodes = set()
+        for row in rows:
+            if "start_id" in row:
+                nodes |= {row["start_id"], row["end_id"]}
+        token = object()
+        with driver.lock:
+            for other in driver.active_nodes.values():
+                if other & nodes:
+                    driver.conflicts += 1
+            driver.active_nodes[token] = nodes
+            driver.max_active = max(driver.max_active, len(driver.active_nodes))
+            fail = driver.always_fail or driver.random.random() < driver.failure_rate
+        try:
+            time.sleep(driver.delay)
+            if fail:
+                raise driver.random.choice([TransientError("deadlock"), ServiceUnavailable("connection lost")])
+            with driver.lock:
+                driver.committed.extend(rows)
+            return FakeResult(len(rows))
+        finally:
+            with driver.lock:
+                del driver.active_nodes[token]
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute_write(self, func, *args):
+        return func(FakeTx(self.driver), *args)
+
+    def run(self, query, **params):
+        # 只用于 count_legacy_entities
+        return FakeResult(self.driver.legacy_entities)
+
+
+def make_relations(count, nodes, seed=0):
+    rng = random.Random(seed)
+    # 少数高频节点（如“船舶”）出现在大量关系中
+    hubs = [f"hub_{i}" for i in range(3)]
+    relations = []
+    for i in range(count):
+        start = f"entity_{rng.randrange(nodes)}"
+        end = rng.choice(hubs) if rng.random() < 0.3 else f"entity_{rng.randrange(nodes)}"
+        relations.append({"start_id": start, "end_id": end, "type": f"rel_{i}"})
+    return relations
+
+
+def make_loader(driver, **kwargs):
+    options = dict(batch_size=50, min_batch_size=10, max_batch_size=200, workers=4, retry_backoff=0.0)
+    options.update(kwargs)
+    return Neo4jBatchLoader(driver, **options)
+
+
+def test_parallel_relations_commit_once_without_shared_nodes():
+    driver = FakeDriver(failure_rate=0.1, delay=0.001)
+    relations = make_relations(3000, 500)
+    loaded = make_loader(driver).load_relations(relations)
+    assert loaded == len(relations)
+    assert sorted(r["type"] for r in driver.committed) == sorted(r["type"] for r in relations)
+    assert driver.conflicts == 0
+    assert driver.max_active > 1
+
+
+def test_entities_commit_once_with_transient_errors():
+    driver = FakeDriver(failure_rate=0.2, seed=1)
+    entities = [{"id": f"entity_{i}", "properties": {}, "labels": []} for i in range(1000)]
+    assert make_loader(driver).load_entities(entities) == len(entities)
+    assert sorted(e["id"] for e in driver.committed) == sorted(e["id"] for e in entities)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_permanent_failure_shrinks_batch_then_raises(workers):
+    driver = FakeDriver(always_fail=True)
+    loader = make_loader(driver, workers=workers, max_retries=1)
+    with pytest.raises((TransientError, ServiceUnavailable)):
+        loader.load_relations(make_relations(200, 50))
+    assert driver.committed == []
+
+
+def test_delta_sync_refuses_without_manifest(tmp_path):
+    driver = FakeDriver()
+    importer = KGCSVImporter(driver=driver, workers=1)
+    manifest = str(tmp_path / "manifest.json")
+    with pytest.raises(ValueError, match="--rebuild-manifest"):
+        importer.sync_from_csv_files("entities.csv", "relations.csv", manifest_file=manifest)
+    # 旧版按顺序编号的实体：重建清单也会产生重复节点
+    driver.legacy_entities = 3
+    with pytest.raises(ValueError, match="3"):
+        importer.sync_from_csv_files("entities.csv", "relations.csv", manifest_file=manifest, rebuild_manifest=True)
+    assert driver.committed == []
+    assert not os.path.exists(manifest)
@@ -0,0 +1,63 @@
+# test_summary_consolidation.py
+# 逐chunk合并实体摘要（get_entities / get_triplets 的做法）与 entity_db 合并实体文件的结果应一致
+# 用法：python -m pytest -q tests
+
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from entity_db import merge_entity_knowledge_base
+from summary_consolidation import SummaryAccumulator, finalize_summaries, summary_accumulator
+
+SENTENCES = ["船体分段采用埋弧焊接。", "焊缝需进行超声波探伤！", "钢珠滑道用于下水", "保距器防止钢珠脱落；",
+             "短句。", "船台倾斜度为1/20。", "焊接前需预热", "下水后检查船体变形。"]
+
+
+def make_chunk_entities(count, seed=0):
+    rng = random.Random(seed)
+    chunks = []
+    for chunk_id in range(count):
+        entities = []
+        for name in rng.sample(["焊接", "滑道", "船台"], 2):
+            summary = "".join(rng.sample(SENTENCES, rng.randint(1, 3)))
+            entities.append({"entity_name": name, "type": ["工艺"], "domain_relevance": ["高"],
+                             "summary": summary, "chunk_ids": [chunk_id]})
+        chunks.append(entities)
+    return chunks
+
+
+def test_sequential_merges_match_entity_db(tmp_path):
+    max_chars = 40
+    chunks = make_chunk_entities(200)
+
+    # 每个实体保留一个累加器，写出时再转为字符串
+    entity_kb = {}
+    for entities in chunks:
+        for ent in entities:
+            key = ent["entity_name"]
+            if key in entity_kb:
+                entity_kb[key]["summary"].add(ent["summary"])
+            else:
+                entity_kb[key] = dict(ent, summary=summary_accumulator(ent["summary"], max_chars))
+    sequential = {ent["entity_name"]: ent["summary"] for ent in finalize_summaries(entity_kb.values())}
+
+    input_dir = tmp_path / "entities"
+    input_dir.mkdir()
+    for chunk_id, entities in enumerate(chunks):
+        (input_dir / f"entities_{chunk_id}_{chunk_id}.json").write_text(
+            json.dumps(entities, ensure_ascii=False), encoding="utf-8")
+    merged = merge_entity_knowledge_base(str(input_dir), str(tmp_path / "kb.json"), summary_max_chars=max_chars)
+    assert sequential == {name: ent["summary"] for name, ent in merged.items()}
+
+    # 每次从截断后的字符串重建累加器会丢失“已满”状态，之后的短句又被加入
+    rebuilt = {}
+    for entities in chunks:
+        for ent in entities:
+            accumulator = SummaryAccumulator(max_chars)
+            accumulator.add(rebuilt.get(ent["entity_name"], ""))
+            accumulator.add(ent["summary"])
+            rebuilt[ent["entity_name"]] = accumulator.value()
+    assert rebuilt != sequential
@@ -0,0 +1,68 @@
+# test_triple_db.py
+# triple_db 去重的回归测试：按规范化的键分组，输出原始的 subject/relation/object
+# 用法：python -m pytest -q tests
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kb_io import load_records
+from triple_db import merge_all_triplets
+
+KB_NAMES = {"防护涂料（油漆）", "船体外板", "Hull Block", "分段"}
+
+
+def write_batches(input_dir, batches):
+    os.makedirs(input_dir, exist_ok=True)
+    for (start, end), triples in batches.items():
+        with open(os.path.join(input_dir, f"triples_{start}_{end}.json"), "w", encoding="utf-8") as f:
+            json.dump(triples, f, ensure_ascii=False)
+
+
+def test_dedup_keeps_original_strings(tmp_path):
+    input_dir = str(tmp_path / "triplets")
+    write_batches(input_dir, {
+        (0, 9): [
+            {"subject": "防护涂料（油漆）", "relation": "Applied_To", "object": "船体外板", "chunk_id": 1},
+            {"subject": "Hull Block", "relation": "包含", "object": "分段", "chunk_id": 2},
+        ],
+        (10, 19): [
+            # 半角括号、关系大小写和多余空白不同，规范化后与第一条相同
+            {"subject": "防护涂料(油漆)", "relation": "applied_to", "object": " 船体外板 ", "chunk_id": 11},
+            {"subject": "Hull  Block", "relation": "包含", "object": "分段", "chunk_id": 12},
+        ],
+    })
+    output_file = str(tmp_path / "triples_kb.json")
+    assert merge_all_triplets(input_dir, output_file, dedup=True, partitions=4) == 2
+
+    triples = load_records(output_file)
+    assert [(t["subject"], t["relation"], t["object"]) for t in triples] == [
+        ("防护涂料（油漆）", "Applied_To", "船体外板"),
+        ("Hull Block", "包含", "分段"),
+    ]
+    for triple in triples:
+        assert triple["subject"] in KB_NAMES and triple["object"] in KB_NAMES
+    assert [t["chunk_ids"] for t in triples] == [[1, 11], [2, 12]]
+    assert [t["support"] for t in triples] == [2, 2]
+
+
+def test_parallel_dedup_matches_serial(tmp_path):
+    input_dir = str(tmp_path / "triplets")
+    batches = {}
+    for start in range(0, 100, 10):
+        batches[(start, start + 9)] = [
+            {"subject": f"实体{(start + i) % 7}", "relation": "Part_Of" if i % 2 else "part_of",
+             "object": "分段", "chunk_id": start + i}
+            for i in range(10)
+        ]
+    write_batches(input_dir, batches)
+
+    serial_file = str(tmp_path / "serial.json")
+    parallel_file = str(tmp_path / "parallel.json")
+    merge_all_triplets(input_dir, serial_file, workers=1, dedup=True, partitions=3)
+    merge_all_triplets(input_dir, parallel_file, workers=2, dedup=True, partitions=3)
+    with open(serial_file, encoding="utf-8") as a, open(parallel_file, encoding="utf-8") as b:
+        assert a.read() == b.read()
+    assert len(load_records(serial_file)) == 7
@@ -0,0 +1,80 @@
+# token_utils.py
+# prompt token 数统计工具
+# 优先使用本地的 Qwen 分词器文件（tokenizer.json），不可用时退回到估算
+
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Optional
+
+# CJK 字符（含全角标点）在 Qwen 分词器中大致一字一 token，其余文本按约 4 个字符一个 token 估算
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+# 默认分词器路径，可以是 tokenizer.json 文件或包含该文件的模型目录
+DEFAULT_TOKENIZER_PATH = os.getenv("QWEN_TOKENIZER_PATH")
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数，用于比较 prompt 长度，不要求与分词器完全一致
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+@lru_cache(maxsize=None)
+def _load_tokenizer(tokenizer_path: str) -> Optional[Callable[[str], int]]:
+    """
+    加载分词器并返回计数函数，每个路径只加载一次；加载失败时返回 None
+    """
+    tokenizer_file = tokenizer_path
+    if os.path.isdir(tokenizer_path):
+        tokenizer_file = os.path.join(tokenizer_path, "tokenizer.json")
+
+    try:
+        from tokenizers import Tokenizer
+        tokenizer = Tokenizer.from_file(tokenizer_file)
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+    except Exception as e:
+        logger.debug(f"tokenizers failed to load {tokenizer_file}: {e}")
+
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    except Exception as e:
+        logger.warning(f"Failed to load tokenizer from {tokenizer_path}, falling back to estimation: {e}")
+        return None
+
+
+def get_token_counter(tokenizer_path: Optional[str] = None, cache_size: int = 65536) -> Callable[[str], int]:
+    """
+    获取 token 计数函数。
+    分词器不可用时退回 estimate_tokens；计数结果带 LRU 缓存，
+    文本切分时同一片段会被反复计算长度。
+
+    Args:
+        tokenizer_path: tokenizer.json 文件或模型目录，默认取环境变量 QWEN_TOKENIZER_PATH
+        cache_size: 计数结果缓存条数
+    """
+    tokenizer_path = tokenizer_path or DEFAULT_TOKENIZER_PATH
+    counter = _load_tokenizer(tokenizer_path) if tokenizer_path else None
+    return lru_cache(maxsize=cache_size)(counter or estimate_tokens)
+
+
+def count_tokens(text: str) -> int:
+    """
+    统计文本的 token 数（使用默认分词器）
+    """
+    return _default_counter()(text)
+
+
+@lru_cache(maxsize=1)
+def _default_counter() -> Callable[[str], int]:
+    return get_token_counter()
@@ -1,20 +1,247 @@
+import argparse
+import heapq
+import itertools
 import json
+import multiprocessing
 import os
+import shutil
+import tempfile
+import unicodedata
+import zlib
 
-def merge_all_triplets(json_directory, output_file):
+from entity_db import sorted_range_files, split_contiguous
+from kb_io import iter_records, load_records, write_records
+
+
+def normalize_triple_text(text, casefold=False):
+    """
+    三元组字段规范化：全角/半角统一（NFKC），去掉首尾空白并将连续空白压缩为一个空格
+    """
+    normalized = " ".join(unicodedata.normalize("NFKC", str(text)).split())
+    return normalized.casefold() if casefold else normalized
+
+
+class TripleDeduplicator:
+    """
+    按规范化后的 (subject, relation, object) 对三元组去重，聚合 chunk_ids 并统计支持数（support）。
+    规范化只用于分组，输出的 subject/relation/object 为该组首次出现时的原始字符串，与实体库中的名称保持一致。
+
+    三元组先按键的哈希写入 partitions 个临时分区文件，每次只在内存中聚合一个分区，
+    各分区按首次出现顺序排序后用 heapq.merge 归并输出，因此内存占用与分区大小相关，
+    输出顺序与三元组首次出现的顺序一致。
+
+    分区文件中的每条记录是一个部分聚合结果 [序号, 键, 原始三元组, chunk_ids, support]，序号为 [段号, 段内序号]。
+    串行时每个三元组一条记录（段号0）；并行时每个进程先在内存中聚合一段连续的文件（add_file_slices），
+    只把部分结果写入自己的分区文件，不再把三元组传回主进程。部分结果的合并满足结合律，
+    按序号合并后与串行结果相同。
+    """
+
+    def __init__(self, partitions=16, tmp_dir=None):
+        """
+        Args:
+            partitions (int): 分区数，三元组数量超过内存容量时调大
+            tmp_dir (str): 临时文件目录，默认使用系统临时目录
+        """
+        self.partitions = max(1, partitions)
+        self.work_dir = tempfile.mkdtemp(prefix="triple_dedup_", dir=tmp_dir)
+        self._files = [
+            open(self._part_file(self.work_dir, i, 0), "w", encoding="utf-8")
+            for i in range(self.partitions)
+        ]
+        self.total = 0
+
+    @staticmethod
+    def _part_file(work_dir, partition, slice_index):
+        return os.path.join(work_dir, f"part_{partition}_{slice_index}.jsonl")
+
+    @staticmethod
+    def _partition_of(key, partitions):
+        return zlib.crc32("\x00".join(key).encode("utf-8")) % partitions
+
+    @staticmethod
+    def triple_key(triple):
+        return (
+            normalize_triple_text(triple["subject"]),
+            normalize_triple_text(triple["relation"], casefold=True),
+            normalize_triple_text(triple["object"]),
+        )
+
+    def add_all(self, triplets):
+        """写入一批三元组（按输入顺序编号）"""
+        for triple in triplets:
+            key = self.triple_key(triple)
+            original = [triple["subject"], triple["relation"], triple["object"]]
+            chunk_id = triple.get("chunk_id")
+            record = [[0, self.total], key, original, [] if chunk_id is None else [chunk_id], 1]
+            self._files[self._partition_of(key, self.partitions)].write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.total += 1
+
+    def add_file_slices(self, pool, slices):
+        """
+        在进程池中聚合各段连续的文件（段号从1开始，排在串行写入的记录之后）
+
+        Yields:
+            按文件顺序的 (文件名, 三元组数, 错误信息)
+        """
+        tasks = [(index, paths, self.work_dir, self.partitions) for index, paths in enumerate(slices, 1)]
+        for file_results, count in pool.imap(_aggregate_slice, tasks):
+            self.total += count
+            yield from file_results
+
+    def _aggregate_partition(self, index):
+        """聚合一个分区，返回按首次出现顺序排序的 (序号, 三元组) 列表"""
+        records = []
+        prefix = f"part_{index}_"
+        for name in os.listdir(self.work_dir):
+            if name.startswith(prefix):
+                with open(os.path.join(self.work_dir, name), "r", encoding="utf-8") as f:
+                    records.extend(json.loads(line) for line in f)
+        # 按序号合并部分结果：首次出现的原始三元组在前，chunk_ids 保持出现顺序
+        records.sort(key=lambda record: record[0])
+
+        merged = {}
+        for seq, key, original, chunk_ids, support in records:
+            key = tuple(key)
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [seq, original, dict.fromkeys(chunk_ids), support]
+            else:
+                entry[2].update(dict.fromkeys(chunk_ids))
+                entry[3] += support
+
+        aggregated = []
+        for seq, (subject, relation, obj), chunk_ids, support in merged.values():
+            chunk_ids = list(chunk_ids)
+            aggregated.append((seq, {
+                "subject": subject,
+                "relation": relation,
+                "object": obj,
+                # 保留 chunk_id 字段（首次出现的chunk），兼容只读取单个 chunk_id 的代码
+                "chunk_id": chunk_ids[0] if chunk_ids else "unknown",
+                "chunk_ids": chunk_ids,
+                "support": support,
+            }))
+        aggregated.sort(key=lambda item: item[0])
+        return aggregated
+
+    def _iter_sorted_run(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                seq, triple = json.loads(line)
+                yield seq, triple
+
+    def write(self, output_file, compact=False):
+        """
+        输出去重后的三元组（默认为JSON数组，格式与 json.dump(..., indent=2) 相同；扩展名为 .jsonl 时输出JSONL）
+
+        Returns:
+            int: 去重后的三元组数量
+        """
+        for f in self._files:
+            f.close()
+
+        # 每个分区聚合后写成一个按序号排序的有序段
+        run_files = []
+        for index in range(self.partitions):
+            run_file = os.path.join(self.work_dir, f"run_{index}.jsonl")
+            with open(run_file, "w", encoding="utf-8") as f:
+                for seq, triple in self._aggregate_partition(index):
+                    f.write(json.dumps([seq, triple], ensure_ascii=False) + "\n")
+            prefix = f"part_{index}_"
+            for name in os.listdir(self.work_dir):
+                if name.startswith(prefix):
+                    os.remove(os.path.join(self.work_dir, name))
+            run_files.append(run_file)
+
+        runs = [self._iter_sorted_run(path) for path in run_files]
+        merged = (triple for _, triple in heapq.merge(*runs, key=lambda item: item[0]))
+        return write_records(output_file, merged, compact=compact, indent=2)
+
+    def close(self):
+        for f in self._files:
+            if not f.closed:
+                f.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def _load_triplet_file(file_path):
+    """
+    读取单个三元组文件，返回 (文件名, 三元组列表, 错误信息)；可在进程池中执行
+    """
+    filename = os.path.basename(file_path)
+    try:
+        return filename, load_records(file_path), None
+    except ValueError as e:
+        return filename, None, f"警告: 文件 {filename} 不是有效的JSON格式，已跳过"
+    except Exception as e:
+        return filename, None, f"警告: 处理文件 {filename} 时出错: {e}"
+
+
+def _aggregate_slice(task):
+    """
+    在进程池中执行：读取一段连续的文件并在内存中按键聚合，部分结果按分区写入 part_{分区}_{段号}.jsonl
+
+    Returns:
+        ([(文件名, 三元组数, 错误信息), ...], 读取的三元组总数)
+    """
+    slice_index, file_paths, work_dir, partitions = task
+    merged = {}
+    file_results = []
+    seq = 0
+    for file_path in file_paths:
+        filename, triplets, error = _load_triplet_file(file_path)
+        if error:
+            file_results.append((filename, 0, error))
+            continue
+        for triple in triplets:
+            key = TripleDeduplicator.triple_key(triple)
+            entry = merged.get(key)
+            if entry is None:
+                original = [triple["subject"], triple["relation"], triple["object"]]
+                entry = merged[key] = [[slice_index, seq], original, {}, 0]
+            chunk_id = triple.get("chunk_id")
+            if chunk_id is not None:
+                entry[2][chunk_id] = None
+            entry[3] += 1
+            seq += 1
+        file_results.append((filename, len(triplets), None))
+
+    files = {}
+    try:
+        for key, (first_seq, original, chunk_ids, support) in merged.items():
+            partition = TripleDeduplicator._partition_of(key, partitions)
+            f = files.get(partition)
+            if f is None:
+                f = files[partition] = open(TripleDeduplicator._part_file(work_dir, partition, slice_index), "w",
+                                            encoding="utf-8")
+            f.write(json.dumps([first_seq, key, original, list(chunk_ids), support], ensure_ascii=False) + "\n")
+    finally:
+        for f in files.values():
+            f.close()
+    return file_results, seq
+
+
+def merge_all_triplets(json_directory, output_file, workers=1, dedup=False, partitions=16, compact=False):
     """
     合并指定目录下的所有三元组JSON文件并保存到新文件
     
     Args:
         json_directory (str): 包含JSON文件的目录路径
         output_file (str): 合并后输出文件的路径
+        workers (int): 进程数；文件按chunk范围排序后切成连续的段。去重时每个进程在内存中聚合自己的段，
+            只把部分结果写入分区文件，主进程按顺序合并；不去重时合并就是按顺序拼接，进程只负责解析文件，
+            三元组仍需传回主进程，收益取决于解析与传输的开销之比。两种情况的结果都与串行一致
+        dedup (bool): 是否按规范化的 (subject, relation, object) 去重，聚合 chunk_ids 与 support
+        partitions (int): 去重时的哈希分区数
+        compact (bool): 输出紧凑格式（每个三元组一行）；output_file 扩展名为 .jsonl 时输出JSONL
         
     Returns:
-        int: 合并的三元组总数
+        int: 合并的三元组总数（去重时为去重后的数量）
     """
     
-    # 存储所有三元组的列表
+    # 存储所有三元组的列表；去重时三元组直接写入分区文件，不在内存中累积
     all_triplets = []
+    deduplicator = None
     
     # 检查目录是否存在
     if not os.path.exists(json_directory):
@@ -23,25 +250,45 @@ def merge_all_triplets(json_directory, output_file):
     # 遍历目录中的所有JSON文件
     print(f"开始扫描目录: {json_directory}")
     file_count = 0
+    if dedup:
+        # 临时分区文件放在输出目录下，避免系统临时目录空间不足
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        deduplicator = TripleDeduplicator(partitions=partitions, tmp_dir=output_dir or None)
     
-    for filename in os.listdir(json_directory):
-        if filename.endswith('.json'):
-            file_path = os.path.join(json_directory, filename)
-            
-            try:
-                # 读取并解析JSON文件
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    triplets = json.load(f)
-                    
-                    # 将当前文件中的三元组添加到总列表中
+    file_paths = sorted_range_files(json_directory)
+    
+    pool = multiprocessing.Pool(processes=workers) if workers > 1 and len(file_paths) > 1 else None
+    try:
+        if deduplicator and pool:
+            # 各进程聚合一段连续的文件；段数多于进程数，避免某个进程分到的文件特别大时其余进程空闲
+            slices = split_contiguous(file_paths, workers * 4)
+            for filename, count, error in deduplicator.add_file_slices(pool, slices):
+                if error:
+                    print(error)
+                    continue
+                file_count += 1
+                print(f"已处理文件: {filename} (包含 {count} 个三元组)")
+        else:
+            # imap 按文件顺序返回结果，拼接顺序与串行读取相同
+            results = pool.imap(_load_triplet_file, file_paths) if pool else map(_load_triplet_file, file_paths)
+            for filename, triplets, error in results:
+                if error:
+                    print(error)
+                    continue
+                
+                # 将当前文件中的三元组添加到总列表中
+                if deduplicator:
+                    deduplicator.add_all(triplets)
+                else:
                     all_triplets.extend(triplets)
-                    file_count += 1
-                    print(f"已处理文件: {filename} (包含 {len(triplets)} 个三元组)")
-                    
-            except json.JSONDecodeError as e:
-                print(f"警告: 文件 {filename} 不是有效的JSON格式，已跳过")
-            except Exception as e:
-                print(f"警告: 处理文件 {filename} 时出错: {e}")
+                file_count += 1
+                print(f"已处理文件: {filename} (包含 {len(triplets)} 个三元组)")
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
     
     # 保存合并后的结果到新文件
     try:
@@ -50,33 +297,50 @@ def merge_all_triplets(json_directory, output_file):
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(all_triplets, f, ensure_ascii=False, indent=2)
+        if deduplicator:
+            total_count = deduplicator.write(output_file, compact=compact)
+        else:
+            total_count = write_records(output_file, all_triplets, compact=compact, indent=2)
         
         print(f"\n合并完成:")
         print(f"- 处理了 {file_count} 个JSON文件")
-        print(f"- 总共合并了 {len(all_triplets)} 个三元组")
+        if deduplicator:
+            print(f"- 共读取 {deduplicator.total} 个三元组，去重后 {total_count} 个")
+        else:
+            print(f"- 总共合并了 {total_count} 个三元组")
         print(f"- 结果已保存到: {output_file}")
         
-        return len(all_triplets)
+        return total_count
         
     except Exception as e:
         print(f"保存文件时出错: {e}")
         return 0
+    finally:
+        if deduplicator:
+            deduplicator.close()
 
 # 使用示例
 if __name__ == "__main__":
     # 设置输入目录和输出文件路径
-    input_directory = "/disk1/wuchufeng/KG_construction/triplets_output"
-    output_file_path = "/disk1/wuchufeng/KG_construction/kg_output/triples_kb.json"
+    parser = argparse.ArgumentParser(description='Merge triple files into the triple knowledge base')
+    parser.add_argument('--input_dir', type=str, default="/disk1/wuchufeng/KG_construction/triplets_output",
+                        help='Directory of triple JSON / JSONL files')
+    parser.add_argument('--output_file', type=str, default="/disk1/wuchufeng/KG_construction/kg_output/triples_kb.json",
+                        help='Output knowledge base path (.json, .jsonl or a .kbc columnar directory)')
+    parser.add_argument('--compact', action='store_true', help='Write one compact triple per line instead of indented JSON')
+    parser.add_argument('--workers', type=int, default=1, help='Processes used to parse files')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Deduplicate normalized (subject, relation, object) triples, aggregating chunk_ids and support')
+    parser.add_argument('--partitions', type=int, default=16, help='Hash partitions used by --dedup')
+    args = parser.parse_args()
+    output_file_path = args.output_file
     
     # 执行合并操作
-    total_triplets = merge_all_triplets(input_directory, output_file_path)
+    total_triplets = merge_all_triplets(args.input_dir, output_file_path, workers=args.workers,
+                                        dedup=args.dedup, partitions=args.partitions, compact=args.compact)
     
     # 可选：显示前几个三元组作为预览
     if total_triplets > 0:
-        with open(output_file_path, 'r', encoding='utf-8') as f:
-            sample_data = json.load(f)
-            print(f"\n前5个三元组预览:")
-            for i, triplet in enumerate(sample_data[:5]):
-                print(f"{i+1}. {triplet}")
\ No newline at end of file
+        print(f"\n前5个三元组预览:")
+        for i, triplet in enumerate(itertools.islice(iter_records(output_file_path), 5)):
+            print(f"{i+1}. {triplet}")
\ No newline at end of file